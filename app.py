@@ -31,6 +31,7 @@ if not st.session_state.logged_in:
                 st.session_state.nombre_completo = user_profile['nombre_completo']
                 st.session_state.rol = user_profile['rol']
                 st.session_state.usuario_id = user_profile['id']
+                st.session_state.punto_partida = user_profile.get('punto_partida')
                 st.rerun()
 else:
     # --- Aplicación Principal ---
@@ -1,15 +1,20 @@
 """
 Servicio para análisis y balanceo de planes de visitas
 """
+from collections import OrderedDict
 from typing import Dict, List
 from datetime import date
 
-from models import Visit, DayPlan, WeekPlan, Problem, Suggestion, AnalysisResult
+import numpy as np
+
+import plan_heuristics
+from models import Visit, DayPlan, WeekPlan, Problem, Suggestion, AnalysisResult, RebalanceResult
 from config import (
     get_daily_time_budget, UMBRAL_SOBRECARGA, UMBRAL_BAJA_OCUPACION,
-    UMBRAL_MEJORA_OPTIMIZACION, MAX_SUGERENCIAS_MOSTRAR, DURACION_VISITA_SEGUNDOS
+    UMBRAL_MEJORA_OPTIMIZACION, MAX_SUGERENCIAS_MOSTRAR, DURACION_VISITA_SEGUNDOS,
+    TIEMPO_MAX_REBALANCEO_MS, CACHE_ANALISIS_MAX
 )
-from route_optimizer import RouteOptimizer
+from route_optimizer import RouteOptimizer, day_fingerprint
 
 
 class BalancingService:
@@ -17,11 +22,19 @@ class BalancingService:
 
     def __init__(self, optimizer: RouteOptimizer = None):
         self.optimizer = optimizer or RouteOptimizer()
+        # Análisis memorizados por huella: plan completo, cada día y cada par de días
+        self._analysis_cache = OrderedDict()
+        self._day_info_cache = OrderedDict()
+        self._pair_moves_cache = OrderedDict()
 
     def analyze_plan(self, plan: Dict[str, dict]) -> AnalysisResult:
         """
         Analiza un plan completo y genera problemas y sugerencias
 
+        El resultado se memoriza por la huella del plan. Si solo cambian
+        algunos días, se recalcula su información y las sugerencias entre
+        ellos y el resto; los demás días y pares de días salen de caché.
+
         Args:
             plan: Diccionario con formato legacy {fecha_iso: {ruta: [...], tiempo_total: int}}
 
@@ -31,8 +44,14 @@ class BalancingService:
         if not plan:
             return AnalysisResult()
 
+        huellas = self._day_fingerprints(plan)
+        huella_plan = tuple(sorted(huellas.items()))
+        resultado = self._cache_get(self._analysis_cache, huella_plan)
+        if resultado is not None:
+            return resultado
+
         # Convertir plan a estructura analizable
-        dias_info = self._build_days_info(plan)
+        dias_info = self._build_days_info(plan, huellas)
 
         # Detectar problemas
         problemas = self._detect_problems(dias_info)
@@ -40,20 +59,64 @@ class BalancingService:
         # Generar sugerencias
         sugerencias = self._generate_suggestions(dias_info)
 
-        return AnalysisResult(
+        resultado = AnalysisResult(
             problemas=problemas,
             sugerencias=sugerencias[:MAX_SUGERENCIAS_MOSTRAR]
         )
-
-    def _build_days_info(self, plan: Dict[str, dict]) -> Dict[str, dict]:
-        """Construye información detallada de cada día"""
+        self._cache_put(self._analysis_cache, huella_plan, resultado)
+
+        return resultado
+
+    def _day_fingerprints(self, plan: Dict[str, dict]) -> Dict[str, str]:
+        """Huella del contenido de cada día del plan"""
+        return {
+            dia_iso: day_fingerprint(
+                datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia,
+                DURACION_VISITA_SEGUNDOS
+            )
+            for dia_iso, datos_dia in plan.items()
+        }
+
+    @staticmethod
+    def _cache_get(cache: OrderedDict, clave):
+        """Lee de una caché LRU (None si no está)"""
+        valor = cache.get(clave)
+        if valor is not None:
+            cache.move_to_end(clave)
+        return valor
+
+    @staticmethod
+    def _cache_put(cache: OrderedDict, clave, valor):
+        """Guarda en una caché LRU expulsando lo menos usado por encima de CACHE_ANALISIS_MAX"""
+        cache[clave] = valor
+        cache.move_to_end(clave)
+        while len(cache) > CACHE_ANALISIS_MAX:
+            cache.popitem(last=False)
+
+    def _build_days_info(self, plan: Dict[str, dict], huellas: Dict[str, str] = None) -> Dict[str, dict]:
+        """Construye información detallada de cada día (solo recalcula los días cambiados)"""
         dias_info = {}
+        huellas = huellas or self._day_fingerprints(plan)
+
+        # Resolver de una vez los pares entre todas las visitas del plan: los
+        # tiempos por día y las simulaciones de mover visitas salen de la matriz
+        self.optimizer.ensure_locations([
+            v['direccion_texto']
+            for datos_dia in plan.values()
+            for v in (datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia)
+        ])
 
         for dia_iso in sorted(plan.keys()):
             dia = date.fromisoformat(dia_iso)
             datos_dia = plan[dia_iso]
             visitas = datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia
 
+            clave = (dia_iso, huellas[dia_iso])
+            info = self._cache_get(self._day_info_cache, clave)
+            if info is not None:
+                dias_info[dia_iso] = dict(info, visitas=visitas)
+                continue
+
             tiempo_total = self._calculate_day_time(visitas)
             limite = get_daily_time_budget(dia.weekday())
             capacidad_usada = (tiempo_total / limite) * 100 if limite > 0 else 0
@@ -64,8 +127,10 @@ class BalancingService:
                 'tiempo_total': tiempo_total,
                 'limite': limite,
                 'capacidad_usada': capacidad_usada,
-                'num_visitas': len(visitas)
+                'num_visitas': len(visitas),
+                'huella': huellas[dia_iso]
             }
+            self._cache_put(self._day_info_cache, clave, dias_info[dia_iso])
 
         return dias_info
 
@@ -107,7 +172,7 @@ class BalancingService:
         sugerencias = []
         dias_list = list(dias_info.items())
 
-        # Sugerencia 1: Mover visitas entre días
+        # Sugerencia 1: Mover o intercambiar visitas entre días
         sugerencias.extend(self._suggest_move_visits(dias_list))
 
         # Sugerencia 2: Optimizar orden de visitas
@@ -116,37 +181,185 @@ class BalancingService:
         return sugerencias
 
     def _suggest_move_visits(self, dias_list: List[tuple]) -> List[Suggestion]:
-        """Sugiere mover visitas para balancear carga"""
-        sugerencias = []
+        """
+        Sugiere los mejores movimientos entre días (mover, intercambiar visitas
+        o intercambiar finales de ruta) que ahorran al menos UMBRAL_MEJORA_OPTIMIZACION
+
+        Los movimientos de cada par de días se memorizan por la huella de ambos
+        días: al cambiar un día solo se reevalúan sus pares.
+        """
+        claves = [(dia_iso, info['huella']) for dia_iso, info in dias_list]
+        pares = [(a, b) for a in range(len(claves)) for b in range(a + 1, len(claves))]
+
+        # Leer los pares memorizados antes de guardar los nuevos: con muchos
+        # días, guardar puede expulsar entradas de esta misma llamada
+        por_par = {}
+        pendientes = []
+        for a, b in pares:
+            memorizados = self._cache_get(self._pair_moves_cache, (claves[a], claves[b]))
+            if memorizados is None:
+                pendientes.append((a, b))
+            else:
+                por_par[(a, b)] = memorizados
+
+        if pendientes:
+            plan = {dia_iso: info['visitas'] for dia_iso, info in dias_list}
+            dias_iso, visitas, rutas, time_matrix, limites = self._plan_problem(plan)
+
+            nuevos = {par: [] for par in pendientes}
+            for movimiento in plan_heuristics.best_moves(
+                rutas, time_matrix, DURACION_VISITA_SEGUNDOS, limites, pares=pendientes
+            ):
+                par = tuple(sorted((movimiento['origen'], movimiento['destino'])))
+                nuevos[par].append((
+                    movimiento['delta'],
+                    self._move_suggestion(movimiento, dias_iso, visitas, rutas, time_matrix)
+                ))
+            for (a, b), candidatos in nuevos.items():
+                self._cache_put(self._pair_moves_cache, (claves[a], claves[b]), candidatos)
+            por_par.update(nuevos)
 
-        for i, (dia_iso_origen, info_origen) in enumerate(dias_list):
-            if info_origen['capacidad_usada'] > UMBRAL_SOBRECARGA:
-                for j, (dia_iso_destino, info_destino) in enumerate(dias_list):
-                    if i != j and info_destino['capacidad_usada'] < 90:
-                        # Buscar visita movible
-                        for visita in info_origen['visitas']:
-                            tiempo_sin_visita = self._calculate_day_time(
-                                [v for v in info_origen['visitas'] if v['id'] != visita['id']]
-                            )
-                            tiempo_con_visita = self._calculate_day_time(
-                                info_destino['visitas'] + [visita]
-                            )
-
-                            if (tiempo_sin_visita <= info_origen['limite'] and
-                                tiempo_con_visita <= info_destino['limite']):
-                                sugerencias.append(Suggestion(
-                                    tipo='mover',
-                                    mensaje=f"Mover '{visita['direccion_texto'][:40]}...' de {info_origen['dia'].strftime('%A')} a {info_destino['dia'].strftime('%A')}",
-                                    beneficio=f"Balancea carga (-{(info_origen['tiempo_total']-tiempo_sin_visita)/60:.0f}min origen, +{(tiempo_con_visita-info_destino['tiempo_total'])/60:.0f}min destino)",
-                                    data={
-                                        'origen': dia_iso_origen,
-                                        'destino': dia_iso_destino,
-                                        'visita_id': visita['id']
-                                    }
-                                ))
-                                break
+        candidatos = [candidato for par in pares for candidato in por_par[par]]
+        candidatos.sort(key=lambda c: c[0])
 
-        return sugerencias
+        return [sugerencia for delta, sugerencia in candidatos if -delta >= UMBRAL_MEJORA_OPTIMIZACION]
+
+    def rebalance(
+        self,
+        plan: Dict[str, dict],
+        budget_ms: int = TIEMPO_MAX_REBALANCEO_MS,
+        top_k: int = MAX_SUGERENCIAS_MOSTRAR
+    ) -> RebalanceResult:
+        """
+        Rebalancea el plan con búsqueda local entre días
+
+        Aplica relocate, swap y 2-opt* (intercambio de finales de ruta) con
+        evaluación delta sobre la matriz compartida, primero eliminando excesos
+        de jornada y después reduciendo el viaje total, hasta que ningún
+        movimiento mejora o se agota el tiempo.
+
+        Args:
+            plan: Plan en formato legacy
+            budget_ms: Tiempo máximo de la búsqueda en milisegundos
+            top_k: Número de mejores movimientos sobre el plan original a devolver
+                como sugerencias
+
+        Returns:
+            RebalanceResult con el plan rebalanceado y las sugerencias
+        """
+        if not plan:
+            return RebalanceResult()
+
+        dias_iso, visitas, rutas, time_matrix, limites = self._plan_problem(plan)
+        duracion = DURACION_VISITA_SEGUNDOS
+
+        movimientos = plan_heuristics.best_moves(rutas, time_matrix, duracion, limites)
+        sugerencias = [
+            self._move_suggestion(movimiento, dias_iso, visitas, rutas, time_matrix)
+            for movimiento in movimientos[:top_k]
+        ]
+
+        nuevas, aplicados = plan_heuristics.rebalance(rutas, time_matrix, duracion, limites, budget_ms)
+
+        tiempos_antes = np.array([plan_heuristics.day_time(r, time_matrix, duracion) for r in rutas])
+        tiempos_despues = np.array([plan_heuristics.day_time(r, time_matrix, duracion) for r in nuevas])
+
+        plan_rebalanceado = {
+            dias_iso[d]: {
+                'ruta': [visitas[i] for i in ruta],
+                'tiempo_total': int(tiempos_despues[d])
+            }
+            for d, ruta in enumerate(nuevas) if ruta
+        }
+
+        return RebalanceResult(
+            plan=plan_rebalanceado,
+            sugerencias=sugerencias,
+            movimientos_aplicados=len(aplicados),
+            tiempo_antes=int(tiempos_antes.sum()),
+            tiempo_despues=int(tiempos_despues.sum()),
+            exceso_antes=int(np.maximum(0, tiempos_antes - limites).sum()),
+            exceso_despues=int(np.maximum(0, tiempos_despues - limites).sum())
+        )
+
+    def _plan_problem(self, plan: Dict[str, dict]) -> tuple:
+        """
+        Traduce un plan a rutas de índices sobre una matriz de tiempos local
+
+        Returns:
+            (dias_iso, visitas, rutas, time_matrix, limites): las visitas de
+            todos los días en una lista, una ruta de posiciones de esa lista por
+            día, la matriz de tiempos entre ellas y la jornada de cada día
+        """
+        dias_iso = sorted(plan.keys())
+        visitas = []
+        rutas = []
+        for dia_iso in dias_iso:
+            datos_dia = plan[dia_iso]
+            visitas_dia = datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia
+            rutas.append(list(range(len(visitas), len(visitas) + len(visitas_dia))))
+            visitas.extend(visitas_dia)
+
+        indices = self.optimizer.ensure_locations([v['direccion_texto'] for v in visitas])
+        time_matrix = self.optimizer.matrix.time_submatrix(indices)
+        limites = np.array([get_daily_time_budget(date.fromisoformat(d).weekday()) for d in dias_iso])
+
+        return dias_iso, visitas, rutas, time_matrix, limites
+
+    def _move_suggestion(self, movimiento: dict, dias_iso: list, visitas: list,
+                         rutas: list, time_matrix) -> Suggestion:
+        """Convierte un movimiento de plan_heuristics en una Suggestion aplicable"""
+        a, b = movimiento['origen'], movimiento['destino']
+        p, q = movimiento['posicion'], movimiento['posicion_destino']
+        dia_a = date.fromisoformat(dias_iso[a]).strftime('%A')
+        dia_b = date.fromisoformat(dias_iso[b]).strftime('%A')
+        tiempo_a = plan_heuristics.day_time(rutas[a], time_matrix, DURACION_VISITA_SEGUNDOS)
+        tiempo_b = plan_heuristics.day_time(rutas[b], time_matrix, DURACION_VISITA_SEGUNDOS)
+        nuevo_a, nuevo_b = movimiento['tiempos']
+
+        if movimiento['tipo'] == 'relocate':
+            visita = visitas[rutas[a][p]]
+            return Suggestion(
+                tipo='mover',
+                mensaje=f"Mover '{visita['direccion_texto'][:40]}...' de {dia_a} a {dia_b}",
+                beneficio=f"Balancea carga (-{(tiempo_a-nuevo_a)/60:.0f}min origen, +{(nuevo_b-tiempo_b)/60:.0f}min destino)",
+                data={
+                    'origen': dias_iso[a],
+                    'destino': dias_iso[b],
+                    'visita_id': visita['id'],
+                    'posicion': q
+                }
+            )
+
+        beneficio = (f"{dia_a}: {tiempo_a/3600:.1f}h → {nuevo_a/3600:.1f}h, "
+                     f"{dia_b}: {tiempo_b/3600:.1f}h → {nuevo_b/3600:.1f}h")
+
+        if movimiento['tipo'] == 'swap':
+            visita_a = visitas[rutas[a][p]]
+            visita_b = visitas[rutas[b][q]]
+            return Suggestion(
+                tipo='intercambiar',
+                mensaje=f"Intercambiar '{visita_a['direccion_texto'][:30]}...' ({dia_a}) con '{visita_b['direccion_texto'][:30]}...' ({dia_b})",
+                beneficio=beneficio,
+                data={
+                    'dia_a': dias_iso[a],
+                    'dia_b': dias_iso[b],
+                    'visita_a': visita_a['id'],
+                    'visita_b': visita_b['id']
+                }
+            )
+
+        return Suggestion(
+            tipo='intercambiar_tramos',
+            mensaje=f"Intercambiar el final de la ruta del {dia_a} (desde la visita {p+1}) con el del {dia_b} (desde la visita {q+1})",
+            beneficio=beneficio,
+            data={
+                'dia_a': dias_iso[a],
+                'dia_b': dias_iso[b],
+                'desde_a': p,
+                'desde_b': q
+            }
+        )
 
     def _suggest_optimize_order(self, dias_info: Dict[str, dict]) -> List[Suggestion]:
         """Sugiere optimizar orden de visitas"""
@@ -189,6 +402,10 @@ class BalancingService:
         """
         if suggestion.tipo == 'mover':
             return self._apply_move_suggestion(plan, suggestion)
+        elif suggestion.tipo == 'intercambiar':
+            return self._apply_swap_suggestion(plan, suggestion)
+        elif suggestion.tipo == 'intercambiar_tramos':
+            return self._apply_tails_suggestion(plan, suggestion)
         elif suggestion.tipo == 'optimizar':
             return self._apply_optimize_suggestion(plan, suggestion)
         return plan
@@ -216,7 +433,39 @@ class BalancingService:
 
         destino_datos = plan[destino]
         destino_visitas = destino_datos['ruta'] if isinstance(destino_datos, dict) else destino_datos
-        destino_visitas.append(visita_a_mover)
+        destino_visitas.insert(suggestion.data.get('posicion', len(destino_visitas)), visita_a_mover)
+
+        return plan
+
+    def _apply_swap_suggestion(self, plan: Dict[str, dict], suggestion: Suggestion) -> Dict[str, dict]:
+        """Aplica sugerencia de intercambiar dos visitas entre días"""
+        datos_a = plan[suggestion.data['dia_a']]
+        datos_b = plan[suggestion.data['dia_b']]
+        visitas_a = datos_a['ruta'] if isinstance(datos_a, dict) else datos_a
+        visitas_b = datos_b['ruta'] if isinstance(datos_b, dict) else datos_b
+
+        p = next((k for k, v in enumerate(visitas_a) if v['id'] == suggestion.data['visita_a']), None)
+        q = next((k for k, v in enumerate(visitas_b) if v['id'] == suggestion.data['visita_b']), None)
+        if p is None or q is None:
+            return plan
+
+        visitas_a[p], visitas_b[q] = visitas_b[q], visitas_a[p]
+        return plan
+
+    def _apply_tails_suggestion(self, plan: Dict[str, dict], suggestion: Suggestion) -> Dict[str, dict]:
+        """Aplica sugerencia de intercambiar los finales de ruta de dos días"""
+        dia_a, dia_b = suggestion.data['dia_a'], suggestion.data['dia_b']
+        p, q = suggestion.data['desde_a'], suggestion.data['desde_b']
+        visitas_a = list(plan[dia_a]['ruta'] if isinstance(plan[dia_a], dict) else plan[dia_a])
+        visitas_b = list(plan[dia_b]['ruta'] if isinstance(plan[dia_b], dict) else plan[dia_b])
+
+        plan[dia_a] = visitas_a[:p] + visitas_b[q:]
+        plan[dia_b] = visitas_b[:q] + visitas_a[p:]
+
+        # Eliminar días que quedan vacíos
+        for dia_iso in (dia_a, dia_b):
+            if not plan[dia_iso]:
+                del plan[dia_iso]
 
         return plan
 
@@ -0,0 +1,175 @@
+"""
+Benchmark de los algoritmos de rutas sobre matrices sintéticas
+
+Uso:
+    python benchmark_routes.py
+
+No necesita Supabase ni Google Maps: las matrices se generan con puntos
+aleatorios (semilla fija) y tiempos proporcionales a la distancia euclídea.
+"""
+import math
+import random
+import time
+
+import numpy as np
+
+from config import DURACION_VISITA_SEGUNDOS, get_daily_time_budget
+import plan_heuristics
+import route_heuristics
+
+# Segundos por km en las matrices sintéticas (~50 km/h)
+SEGUNDOS_POR_KM = 72
+
+
+def generar_matriz(n, semilla=0, lado_km=100):
+    """Genera una matriz de tiempos simétrica para n puntos aleatorios en un cuadrado"""
+    rnd = random.Random(semilla)
+    puntos = [(rnd.uniform(0, lado_km), rnd.uniform(0, lado_km)) for _ in range(n)]
+    return [[int(math.dist(a, b) * SEGUNDOS_POR_KM) for b in puntos] for a in puntos]
+
+
+def two_opt_referencia(route, time_matrix, duracion_visita_seg, max_iterations=100):
+    """2-opt original de RouteOptimizer (recalcula la ruta completa por movimiento)"""
+    def calcular(r):
+        total = sum(time_matrix[r[i]][r[i + 1]] for i in range(len(r) - 1))
+        return total + len(r) * duracion_visita_seg
+
+    improved = True
+    best_route = route[:]
+    iterations = 0
+
+    while improved and iterations < max_iterations:
+        iterations += 1
+        improved = False
+        for i in range(1, len(route) - 1):
+            for j in range(i + 1, len(route)):
+                new_route = route[:i] + route[i:j][::-1] + route[j:]
+                if calcular(new_route) < calcular(best_route):
+                    best_route = new_route
+                    improved = True
+        route = best_route[:]
+
+    return best_route
+
+
+def cronometrar(func, *args, **kwargs):
+    """Ejecuta func y devuelve (resultado, milisegundos)"""
+    inicio = time.perf_counter()
+    resultado = func(*args, **kwargs)
+    return resultado, (time.perf_counter() - inicio) * 1000
+
+
+def benchmark_two_opt(tamanos=(10, 15, 30, 50, 100, 150), limite_referencia=60):
+    """Compara el 2-opt delta con el original sobre las mismas matrices"""
+    print("== 2-opt: delta + vecinos + don't-look bits vs original ==")
+    print(f"{'n':>5} {'NN (min)':>10} {'delta (min)':>12} {'delta ms':>9} {'orig (min)':>11} {'orig ms':>9}")
+
+    for n in tamanos:
+        matriz = generar_matriz(n, semilla=n)
+        inicial = route_heuristics.nearest_neighbor(matriz)
+        nueva, ms_nueva = cronometrar(route_heuristics.two_opt, inicial, matriz)
+
+        linea = (f"{n:>5} {route_heuristics.route_travel_time(inicial, matriz) / 60:>10.0f} "
+                 f"{route_heuristics.route_travel_time(nueva, matriz) / 60:>12.0f} {ms_nueva:>9.1f}")
+
+        if n <= limite_referencia:
+            original, ms_original = cronometrar(
+                two_opt_referencia, inicial, matriz, DURACION_VISITA_SEGUNDOS
+            )
+            linea += f" {route_heuristics.route_travel_time(original, matriz) / 60:>11.0f} {ms_original:>9.1f}"
+        else:
+            linea += f" {'-':>11} {'-':>9}"
+
+        print(linea)
+    print()
+
+
+def benchmark_busqueda_local(tamanos=(10, 15, 30, 50, 100, 150)):
+    """Mide lo que añaden Or-opt y swap encadenados tras 2-opt"""
+    combinaciones = (('two_opt',), ('two_opt', 'or_opt'), ('two_opt', 'or_opt', 'swap'))
+    print("== Búsqueda local encadenada (minutos de viaje / ms) ==")
+    print(f"{'n':>5} " + " ".join(f"{'+'.join(c):>24}" for c in combinaciones))
+
+    for n in tamanos:
+        matriz = generar_matriz(n, semilla=n)
+        inicial = route_heuristics.nearest_neighbor(matriz)
+        columnas = []
+        for movimientos in combinaciones:
+            ruta, ms = cronometrar(route_heuristics.improve_route, inicial, matriz, movimientos)
+            columnas.append(f"{route_heuristics.route_travel_time(ruta, matriz) / 60:>14.0f} / {ms:>6.1f}")
+        print(f"{n:>5} " + " ".join(f"{c:>24}" for c in columnas))
+    print()
+
+
+def benchmark_exacto(tamanos=(5, 8, 10, 12, 14), semillas=5):
+    """Tiempo de Held-Karp y hueco de optimalidad de NN + búsqueda local por tamaño"""
+    print("== Held-Karp exacto vs NN + búsqueda local ==")
+    print(f"{'n':>5} {'exacto ms':>10} {'heur. ms':>9} {'hueco medio %':>14} {'hueco máx %':>12}")
+
+    for n in tamanos:
+        ms_exacto = ms_heuristica = 0.0
+        huecos = []
+        for semilla in range(semillas):
+            matriz = generar_matriz(n, semilla=1000 * n + semilla)
+            exacta, ms = cronometrar(route_heuristics.held_karp, matriz)
+            ms_exacto += ms
+
+            inicial = route_heuristics.nearest_neighbor(matriz)
+            heuristica, ms = cronometrar(route_heuristics.improve_route, inicial, matriz)
+            ms_heuristica += ms
+
+            optimo = route_heuristics.route_travel_time(exacta, matriz)
+            obtenido = route_heuristics.route_travel_time(heuristica, matriz)
+            huecos.append(100 * (obtenido - optimo) / optimo if optimo else 0.0)
+
+        print(f"{n:>5} {ms_exacto / semillas:>10.1f} {ms_heuristica / semillas:>9.1f} "
+              f"{sum(huecos) / semillas:>14.2f} {max(huecos):>12.2f}")
+    print()
+
+
+def plan_greedy(matriz, limites, duracion_visita_seg):
+    """Reparto greedy de optimize_multiday: llenar cada día con la visita más cercana a la última"""
+    restantes = list(range(len(matriz)))
+    rutas = []
+    for limite in limites:
+        ruta, tiempo = [], 0
+        while restantes:
+            candidata = min(restantes, key=matriz[ruta[-1]].__getitem__) if ruta else restantes[0]
+            tiempo_nueva = duracion_visita_seg + (matriz[ruta[-1]][candidata] if ruta else 0)
+            if tiempo + tiempo_nueva > limite:
+                break
+            ruta.append(candidata)
+            restantes.remove(candidata)
+            tiempo += tiempo_nueva
+        rutas.append(route_heuristics.improve_route(ruta, matriz) if len(ruta) > 3 else ruta)
+    return rutas, restantes
+
+
+def benchmark_lns(tamanos=(30, 60, 120, 200), tiempo_ms=2000, lado_km=30):
+    """Visitas planificadas y minutos de plan: greedy vs greedy + LNS (semana de 5 días)"""
+    limites = [get_daily_time_budget(d) for d in range(5)]
+    print(f"== LNS (ruin & recreate, {tiempo_ms} ms) sobre el plan greedy de 5 días ==")
+    print(f"{'n':>5} {'greedy visitas':>15} {'greedy min':>11} {'LNS visitas':>12} {'LNS min':>8} {'LNS ms':>8}")
+
+    for n in tamanos:
+        matriz = generar_matriz(n, semilla=n, lado_km=lado_km)
+        rutas, restantes = plan_greedy(matriz, limites, DURACION_VISITA_SEGUNDOS)
+        matriz_np = np.asarray(matriz)
+        (rutas_lns, restantes_lns), ms = cronometrar(
+            plan_heuristics.ruin_and_recreate, matriz_np, rutas, restantes,
+            DURACION_VISITA_SEGUNDOS, limites, time_budget_ms=tiempo_ms
+        )
+
+        def minutos(plan):
+            return sum(plan_heuristics.day_time(r, matriz_np, DURACION_VISITA_SEGUNDOS) for r in plan) / 60
+
+        print(f"{n:>5} {n - len(restantes):>15} {minutos(rutas):>11.0f} "
+              f"{n - len(restantes_lns):>12} {minutos(rutas_lns):>8.0f} {ms:>8.0f}")
+    print()
+
+
+if __name__ == '__main__':
+    benchmark_two_opt()
+    benchmark_busqueda_local()
+    benchmark_exacto()
+    benchmark_lns()
@@ -0,0 +1,123 @@
+"""
+Agrupación geográfica de visitas en clústeres del tamaño de un día
+
+Para planificar muchas visitas se agrupa primero y se enruta después
+("cluster first, route second"): las visitas se reparten en un grupo por día
+según sus coordenadas (lat/lon) y cada grupo se enruta por separado, de modo
+que solo hacen falta los tiempos entre visitas del mismo grupo.
+"""
+import math
+import random
+
+import numpy as np
+
+from config import MAX_ITERACIONES_KMEANS
+
+
+def has_coordinates(visita):
+    """True si la visita tiene lat y lon válidas"""
+    lat, lon = visita.get('lat'), visita.get('lon')
+    try:
+        return lat is not None and lon is not None and not (math.isnan(lat) or math.isnan(lon))
+    except TypeError:
+        return False
+
+
+def to_plane(coordenadas):
+    """
+    Proyecta (lat, lon) a kilómetros en un plano local (equirrectangular)
+
+    Suficiente a escala de provincia para comparar distancias entre visitas.
+
+    Args:
+        coordenadas: Lista de tuplas (lat, lon)
+
+    Returns:
+        Array n×2 de (x, y) en kilómetros
+    """
+    coords = np.asarray(coordenadas, dtype=float).reshape(-1, 2)
+    lat0 = np.radians(coords[:, 0].mean()) if len(coords) else 0.0
+    return np.column_stack([coords[:, 1] * 111.32 * np.cos(lat0), coords[:, 0] * 110.57])
+
+
+def _assign_with_capacity(distancias, capacidades):
+    """
+    Asigna cada punto al centro más cercano que aún tiene hueco
+
+    Los puntos se asignan por "regret" decreciente (lo que perderían si no
+    van a su centro más cercano), así los que más dependen de su centro lo
+    ocupan primero.
+    """
+    n, k = distancias.shape
+    orden_centros = np.argsort(distancias, axis=1)
+    if k > 1:
+        ordenadas = np.take_along_axis(distancias, orden_centros, axis=1)
+        regret = ordenadas[:, 1] - ordenadas[:, 0]
+    else:
+        regret = np.zeros(n)
+
+    hueco = np.array(capacidades, dtype=np.int64)
+    etiquetas = np.full(n, -1, dtype=np.intp)
+    for i in np.argsort(-regret, kind='stable'):
+        for c in orden_centros[i]:
+            if hueco[c] > 0:
+                etiquetas[i] = c
+                hueco[c] -= 1
+                break
+    return etiquetas
+
+
+def capacitated_kmeans(puntos, capacidades, max_iter=MAX_ITERACIONES_KMEANS, seed=0):
+    """
+    k-means con capacidad máxima de puntos por grupo
+
+    Los centros se inicializan con k-means++ y se alterna la asignación con
+    capacidad (_assign_with_capacity) con el recálculo de los centros hasta
+    que las etiquetas no cambian.
+
+    Args:
+        puntos: Array n×2 (p. ej. de to_plane)
+        capacidades: Máximo de puntos de cada grupo (k valores, suma >= n)
+        max_iter: Máximo de iteraciones
+        seed: Semilla de la inicialización
+
+    Returns:
+        Array de n etiquetas en 0..k-1
+    """
+    puntos = np.asarray(puntos, dtype=float)
+    n, k = len(puntos), len(capacidades)
+    if sum(capacidades) < n:
+        raise ValueError("La capacidad total de los grupos es menor que el número de puntos")
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # Inicialización k-means++
+    rng = random.Random(seed)
+    centros = [puntos[rng.randrange(n)]]
+    while len(centros) < k:
+        d2 = ((puntos[:, None, :] - np.array(centros)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        total = d2.sum()
+        if total <= 0:
+            centros.append(puntos[rng.randrange(n)])
+            continue
+        objetivo, acumulado = rng.random() * total, 0.0
+        for i, peso in enumerate(d2):
+            acumulado += peso
+            if acumulado >= objetivo:
+                break
+        centros.append(puntos[i])
+    centros = np.array(centros)
+
+    etiquetas = None
+    for _ in range(max_iter):
+        distancias = ((puntos[:, None, :] - centros[None, :, :]) ** 2).sum(axis=2)
+        nuevas = _assign_with_capacity(distancias, capacidades)
+        if etiquetas is not None and np.array_equal(nuevas, etiquetas):
+            break
+        etiquetas = nuevas
+        for c in range(k):
+            miembros = puntos[etiquetas == c]
+            if len(miembros):
+                centros[c] = miembros.mean(axis=0)
+
+    return etiquetas
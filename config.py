@@ -15,17 +15,84 @@ JORNADA_VIERNES = 7 * 3600  # 7 horas
 # Hora de inicio estándar
 HORA_INICIO_DIA = time(8, 0)
 
+# Tiempo de viaje supuesto cuando no se pudo calcular un trayecto (30 minutos)
+TIEMPO_VIAJE_DEFECTO_SEG = 30 * 60
+
 # ==================== LÍMITES Y UMBRALES ====================
 
 # Límite de visitas para planificación coordinador
 LIMITE_VISITAS_PLANIFICAR_COORDINADOR = 50
 
-# Límite de visitas para usar 2-opt (optimización pesada)
-LIMITE_VISITAS_2OPT = 15
+# Límite de visitas para usar 2-opt (evaluación delta con listas de vecinos)
+LIMITE_VISITAS_2OPT = 150
 
-# Número máximo de iteraciones en 2-opt
+# Número máximo de iteraciones en 2-opt (movimientos de mejora por visita)
 MAX_ITERACIONES_2OPT = 100
 
+# Vecinos más cercanos que se prueban por visita en 2-opt
+NUM_VECINOS_2OPT = 10
+
+# Longitud máxima del tramo que mueve Or-opt
+MAX_SEGMENTO_OR_OPT = 3
+
+# Movimientos de búsqueda local que se encadenan tras Nearest Neighbor
+BUSQUEDA_LOCAL_RUTA = ('two_opt', 'or_opt')
+
+# Tiempo máximo de la búsqueda local por ruta (milisegundos)
+TIEMPO_MAX_BUSQUEDA_LOCAL_MS = 250
+
+# Presupuesto del modo anytime (construir, búsqueda local y perturbaciones) en milisegundos
+TIEMPO_MAX_OPTIMIZACION_MS = 3000
+
+# Hasta este número de visitas se calcula la ruta óptima exacta (Held-Karp)
+LIMITE_VISITAS_EXACTO = 12
+
+# Viaje estimado por visita para calcular cuántas visitas caben en el clúster de un día (segundos)
+TIEMPO_TRAMO_ESTIMADO_CLUSTER_SEG = 900
+
+# Visitas que se agrupan por zonas, en múltiplos de la capacidad estimada de los días: con más
+# visitas que huecos cada clúster es más compacto y al recortarlo a la jornada se quedan las más cercanas
+FACTOR_CANDIDATAS_CLUSTER = 3
+
+# Días más cercanos en los que se intenta reinsertar cada visita que se queda sin clúster
+DIAS_CANDIDATOS_REINSERCION = 3
+
+# Visitas por lote al resolver los pares de la reinserción (una consulta al caché por lote)
+LOTE_REINSERCION_CLUSTER = 25
+
+# Iteraciones máximas del k-means con capacidad
+MAX_ITERACIONES_KMEANS = 50
+
+# Rutas exactas memorizadas por huella de matriz
+MAX_RUTAS_EXACTAS_MEMORIA = 512
+
+# Cada segundo por encima de la jornada cuenta como este número de segundos al rebalancear
+PENALIZACION_EXCESO_JORNADA = 10
+
+# Tiempo máximo de la búsqueda local entre días (milisegundos)
+TIEMPO_MAX_REBALANCEO_MS = 500
+
+# Tiempo de la búsqueda de vecindario grande (LNS) sobre el plan semanal (milisegundos)
+TIEMPO_MAX_LNS_MS = 2000
+
+# Máximo de visitas que se quitan del plan en cada iteración del LNS
+MAX_VISITAS_RUINA = 12
+
+# El LNS acepta planes peores hasta esta fracción del coste inicial (baja a cero con el tiempo)
+UMBRAL_ACEPTACION_LNS = 0.02
+
+# Coste de dejar una visita sin día en el LNS (segundos de plan)
+PENALIZACION_VISITA_NO_ASIGNADA_SEG = 3 * 3600
+
+# Premio de una visita opcional ('Propuesta'): entra si añade menos tiempo que esto (segundos)
+PREMIO_VISITA_PROPUESTA_SEG = 3 * 3600
+
+# Tiempo total para evaluar todas las combinaciones de días al recomendar días (milisegundos)
+TIEMPO_MAX_RECOMENDAR_DIAS_MS = TIEMPO_MAX_OPTIMIZACION_MS + TIEMPO_MAX_LNS_MS
+
+# Análisis de planes memorizados (planes, días y pares de días) en BalancingService
+CACHE_ANALISIS_MAX = 128
+
 # Umbral mínimo de mejora en optimización (segundos)
 UMBRAL_MEJORA_OPTIMIZACION = 300  # 5 minutos
 
@@ -48,9 +115,29 @@ PROXIMIDAD_MAXIMA = 50000  # 50 km
 # Tiempo de vida del caché de rutas (días)
 CACHE_TTL_DIAS = 30
 
-# Tamaño de chunk para llamadas batch a Google Maps API
+# País que se añade a las direcciones al normalizar las claves del caché
+PAIS_POR_DEFECTO = "España"
+
+# Tamaño de chunk para llamadas batch a Google Maps API (máximo de orígenes y de destinos)
 GOOGLE_MAPS_CHUNK_SIZE = 25
 
+# Máximo de elementos (orígenes × destinos) por petición a la Distance Matrix API
+GOOGLE_MAPS_MAX_ELEMENTOS = 100
+
+# Lectura en bloque del caché de rutas (filtros in_ sobre origen/destino)
+CACHE_BULK_MAX_UBICACIONES = 40  # Ubicaciones por filtro in_
+CACHE_BULK_MAX_CARACTERES = 3000  # Caracteres por filtro in_ (límite de URL)
+CACHE_BULK_PAGINA = 1000  # Filas por página (max-rows de PostgREST)
+
+# Máximo de rutas en la caché en memoria compartida por el proceso (LRU)
+CACHE_MEMORIA_MAX_RUTAS = 50000
+
+# Rutas pendientes en el buffer de escritura antes de forzar un volcado
+CACHE_FLUSH_UMBRAL = 200
+
+# Días optimizados memorizados por optimizador (orden y tiempo por contenido del día)
+CACHE_DIAS_MAX = 512
+
 # ==================== MAPAS ====================
 
 # Centro de Cataluña para mapas
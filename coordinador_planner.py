@@ -1,9 +1,11 @@
 # Fichero: coordinador_planner.py (con optimización mejorada)
 import streamlit as st
 import pandas as pd
-from datetime import date, timedelta, datetime, time
+from datetime import date, timedelta
 from database import supabase
 from route_optimizer import RouteOptimizer
+import window_heuristics
+from config import PUNTO_INICIO_MARTIN, TIEMPO_MAX_OPTIMIZACION_MS, HORA_INICIO_DIA
 
 # --- CONSTANTES ---
 DURACION_VISITA_SEGUNDOS = 45 * 60
@@ -14,6 +16,28 @@ def get_daily_time_budget(weekday):
     """Devuelve la duración de la jornada en segundos (8h L-J, 7h V)."""
     return 7 * 3600 if weekday == 4 else 8 * 3600
 
+def calcular_horario(optimizer, punto_inicio, visitas, volver_al_inicio=False):
+    """
+    Hora de inicio de cada visita de una ruta ya ordenada y tiempo total del día
+
+    Sale del punto de partida a HORA_INICIO_DIA y espera a que abra la franja
+    horaria de cada visita si llega antes, igual que el optimizador.
+
+    Returns:
+        (inicios, tiempo_total): segundos desde medianoche de cada visita y
+        segundos desde el inicio del día hasta el final (con la vuelta si se pide)
+    """
+    inicio_dia = HORA_INICIO_DIA.hour * 3600 + HORA_INICIO_DIA.minute * 60
+    paradas = [punto_inicio] + [v['direccion_texto'] for v in visitas]
+    indices = optimizer.ensure_legs([paradas + [punto_inicio] if volver_al_inicio else paradas])[0]
+    tiempos = optimizer.matrix.time_submatrix(indices[:len(paradas)]).tolist()
+    ventanas = [None] + [window_heuristics.parse_franja(v.get('franja_horaria')) for v in visitas]
+
+    ruta = list(range(len(paradas)))
+    inicios = window_heuristics.schedule(ruta, tiempos, DURACION_VISITA_SEGUNDOS, ventanas, inicio_dia, depot=True)
+    fin = window_heuristics.route_end(ruta, inicios, tiempos, DURACION_VISITA_SEGUNDOS, depot=True, closed=volver_al_inicio)
+    return inicios[1:], fin - inicio_dia
+
 # --- INTERFAZ DE STREAMLIT ---
 def mostrar_planificador_coordinador():
     st.header("✨ Planificación Óptima de Visitas (Coordinador)")
@@ -61,7 +85,12 @@ def mostrar_planificador_coordinador():
     visitas_a_planificar_ids = df_visitas[df_visitas['display_name'].isin(visitas_seleccionadas_display)]['id'].tolist()
     visitas_a_planificar = [v for v in visitas_pendientes_raw if v['id'] in visitas_a_planificar_ids]
     
-    punto_inicio = st.text_input("📍 Introduce tu punto de partida para la jornada:", placeholder="Ej: Carrer de la Riera, 7, Cornellà de Llobregat")
+    punto_inicio = st.text_input(
+        "📍 Introduce tu punto de partida para la jornada:",
+        value=st.session_state.get('punto_partida') or PUNTO_INICIO_MARTIN,
+        placeholder="Ej: Carrer de la Riera, 7, Cornellà de Llobregat"
+    )
+    volver_al_inicio = st.checkbox("🏠 Incluir la vuelta al punto de partida en la jornada")
     num_dias = st.selectbox("🗓️ ¿En cuántos días quieres planificar?", [1, 2])
 
     dias_semana_siguiente = [start_of_next_week + timedelta(days=i) for i in range(5)]
@@ -100,47 +129,49 @@ def mostrar_planificador_coordinador():
         # Crear optimizador
         optimizer = RouteOptimizer()
 
-        # Añadir punto de inicio como primera "visita" temporal
-        visitas_con_inicio = [{'direccion_texto': punto_inicio, 'id': 'inicio'}] + visitas_a_planificar
-
         status_text.text("🧠 Optimizando rutas con algoritmo mejorado...")
         progress_bar.progress(30)
 
+        def mostrar_avance(fraccion, mensaje):
+            progress_bar.progress(30 + int(40 * fraccion))
+            status_text.text(f"🧠 {mensaje}")
+
         if num_dias == 1:
-            # Optimizar para un solo día
+            # Optimizar para un solo día saliendo del punto de partida
             visitas_ordenadas, tiempo_total = optimizer.optimize_route(
-                visitas_con_inicio,
-                DURACION_VISITA_SEGUNDOS
+                visitas_a_planificar,
+                DURACION_VISITA_SEGUNDOS,
+                depot=punto_inicio,
+                return_to_depot=volver_al_inicio,
+                time_budget_ms=TIEMPO_MAX_OPTIMIZACION_MS,
+                anytime=True,
+                progress_callback=mostrar_avance,
+                time_windows=True
             )
 
+            # Las visitas sin hueco en su franja horaria se quedan fuera de la ruta
+            ids_en_ruta = {v['id'] for v in visitas_ordenadas}
+            visitas_no_asignadas = [v for v in visitas_a_planificar if v['id'] not in ids_en_ruta]
+
             progress_bar.progress(70)
             status_text.text("📊 Verificando capacidad de jornada...")
 
-            # Quitar el punto de inicio
-            visitas_ordenadas = [v for v in visitas_ordenadas if v['id'] != 'inicio']
-
             # Verificar que cabe en la jornada
             budget = get_daily_time_budget(fechas_seleccionadas[0].weekday())
             if tiempo_total <= budget:
                 plan_final = {fechas_seleccionadas[0]: {'ruta': visitas_ordenadas, 'tiempo_total': tiempo_total}}
             else:
-                # Recortar visitas hasta que quepa
-                visitas_que_caben = []
-                tiempo_acumulado = 0
-                for v in visitas_ordenadas:
-                    tiempo_prueba = tiempo_acumulado + DURACION_VISITA_SEGUNDOS
-                    if len(visitas_que_caben) > 0:
-                        # Añadir tiempo de viaje (estimado)
-                        tiempo_prueba += 1800  # 30 min aprox
-
-                    if tiempo_prueba <= budget:
-                        visitas_que_caben.append(v)
-                        tiempo_acumulado = tiempo_prueba
-                    else:
-                        break
+                # Recortar visitas del final hasta que quepa (con las esperas de las franjas)
+                visitas_que_caben = list(visitas_ordenadas)
+                tiempo_acumulado = tiempo_total
+                while visitas_que_caben and tiempo_acumulado > budget:
+                    visitas_que_caben.pop()
+                    _, tiempo_acumulado = calcular_horario(
+                        optimizer, punto_inicio, visitas_que_caben, volver_al_inicio
+                    )
 
                 plan_final = {fechas_seleccionadas[0]: {'ruta': visitas_que_caben, 'tiempo_total': tiempo_acumulado}}
-                visitas_no_asignadas = [v for v in visitas_ordenadas if v not in visitas_que_caben]
+                visitas_no_asignadas += [v for v in visitas_ordenadas if v not in visitas_que_caben]
 
         else:
             # Optimizar para múltiples días
@@ -148,7 +179,13 @@ def mostrar_planificador_coordinador():
                 visitas_a_planificar,
                 fechas_seleccionadas,
                 DURACION_VISITA_SEGUNDOS,
-                get_daily_time_budget
+                get_daily_time_budget,
+                depot=punto_inicio,
+                return_to_depot=volver_al_inicio,
+                time_budget_ms=TIEMPO_MAX_OPTIMIZACION_MS,
+                anytime=True,
+                progress_callback=mostrar_avance,
+                time_windows=True
             )
 
             progress_bar.progress(70)
@@ -159,7 +196,7 @@ def mostrar_planificador_coordinador():
 
         st.session_state.plan_propuesto = {
             'plan': plan_final,
-            'no_asignadas': visitas_no_asignadas if num_dias > 1 or 'visitas_no_asignadas' in locals() else [],
+            'no_asignadas': visitas_no_asignadas,
             'punto_inicio': punto_inicio
         }
         st.rerun()
@@ -184,24 +221,12 @@ def mostrar_planificador_coordinador():
             ruta_visitas = datos_ruta['ruta'] if isinstance(datos_ruta, dict) else datos_ruta
 
             with st.expander(f"**🗓️ Plan para el {fecha.strftime('%A, %d/%m/%Y')}** ({len(ruta_visitas)} visitas)", expanded=True):
-                hora_actual = datetime.combine(fecha, time(8, 0))
-
-                for idx, visita in enumerate(ruta_visitas):
-                    if idx > 0:
-                        # Calcular tiempo de viaje desde la visita anterior
-                        origen = ruta_visitas[idx-1]['direccion_texto']
-                        destino = visita['direccion_texto']
-                        _, tiempo_viaje = optimizer.get_distance_duration(origen, destino)
-                        if tiempo_viaje:
-                            hora_actual += timedelta(seconds=tiempo_viaje)
-                    else:
-                        # Primera visita: calcular desde punto de inicio
-                        _, tiempo_viaje = optimizer.get_distance_duration(plan_data['punto_inicio'], visita['direccion_texto'])
-                        if tiempo_viaje:
-                            hora_actual += timedelta(seconds=tiempo_viaje)
-
-                    st.markdown(f"- **🕣 {hora_actual.strftime('%H:%M')}** - **{visita['direccion_texto']}** (Equipo: *{visita['equipo']}*)")
-                    hora_actual += timedelta(seconds=DURACION_VISITA_SEGUNDOS)
+                # Horas con las esperas hasta que abre la franja de cada visita, como en el plan
+                inicios, _ = calcular_horario(optimizer, plan_data['punto_inicio'], ruta_visitas)
+
+                for visita, hora in zip(ruta_visitas, inicios):
+                    franja = f" · franja {visita['franja_horaria']}" if visita.get('franja_horaria') else ""
+                    st.markdown(f"- **🕣 {hora // 3600:02d}:{hora // 60 % 60:02d}** - **{visita['direccion_texto']}** (Equipo: *{visita['equipo']}*){franja}")
 
                 # Calcular tiempo total (manejar ambos formatos)
                 tiempo_total_seg = datos_ruta['tiempo_total'] if isinstance(datos_ruta, dict) and 'tiempo_total' in datos_ruta else len(ruta_visitas) * DURACION_VISITA_SEGUNDOS
@@ -210,6 +235,7 @@ def mostrar_planificador_coordinador():
 
         if plan_data.get('no_asignadas'):
             st.markdown("---")
-            st.warning("Visitas no incluidas en el plan (por falta de tiempo):")
+            st.warning("Visitas no incluidas en el plan (por falta de tiempo o fuera de su franja horaria):")
             for v in plan_data['no_asignadas']:
-                st.markdown(f"- {v['direccion_texto']} (Equipo: {v['equipo']})")
\ No newline at end of file
+                franja = f" · franja {v['franja_horaria']}" if v.get('franja_horaria') else ""
+                st.markdown(f"- {v['direccion_texto']} (Equipo: {v['equipo']}){franja}")
\ No newline at end of file
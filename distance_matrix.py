@@ -0,0 +1,162 @@
+"""
+Matriz de distancias y tiempos compartida, respaldada por arrays de NumPy
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import TIEMPO_VIAJE_DEFECTO_SEG
+from route_cache import normalize_location
+
+
+class DistanceMatrix:
+    """
+    Matriz simétrica de segundos y metros entre direcciones
+
+    Cada dirección canónica (normalize_location) ocupa un índice; direcciones
+    equivalentes comparten índice y por tanto tiempo 0 entre ellas. Los pares
+    aún no resueltos se marcan en `known` y se rellenan al resolverse, de modo
+    que la matriz puede ampliarse con nuevas direcciones sin recalcular las
+    existentes. RouteOptimizer.ensure_locations resuelve los pares pendientes.
+    """
+
+    def __init__(self, capacidad_inicial: int = 16):
+        self.index: Dict[str, int] = {}  # dirección canónica -> índice
+        self.canonical: List[str] = []   # dirección canónica por índice
+        self.locations: List[str] = []   # dirección original (primera vista) por índice
+        self._n = 0
+        self._seconds = np.zeros((capacidad_inicial, capacidad_inicial), dtype=np.int32)
+        self._meters = np.zeros((capacidad_inicial, capacidad_inicial), dtype=np.int32)
+        self._known = np.eye(capacidad_inicial, dtype=bool)
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, direccion: str) -> bool:
+        return normalize_location(direccion) in self.index
+
+    @property
+    def seconds(self) -> np.ndarray:
+        """Tiempos en segundos (vista n×n; 0 en pares no resueltos)"""
+        return self._seconds[:self._n, :self._n]
+
+    @property
+    def meters(self) -> np.ndarray:
+        """Distancias en metros (vista n×n; 0 en pares no resueltos)"""
+        return self._meters[:self._n, :self._n]
+
+    @property
+    def known(self) -> np.ndarray:
+        """Máscara de pares resueltos (vista n×n)"""
+        return self._known[:self._n, :self._n]
+
+    def add_locations(self, direcciones: List[str]) -> List[int]:
+        """
+        Añade direcciones a la matriz (las ya presentes no se duplican)
+
+        Args:
+            direcciones: Lista de direcciones
+
+        Returns:
+            Índice de cada dirección, en el mismo orden
+        """
+        indices = []
+        for direccion in direcciones:
+            canonica = normalize_location(direccion)
+            idx = self.index.get(canonica)
+            if idx is None:
+                idx = self._n
+                self._grow(idx + 1)
+                self.index[canonica] = idx
+                self.canonical.append(canonica)
+                self.locations.append(direccion)
+                self._n += 1
+            indices.append(idx)
+        return indices
+
+    def indices(self, direcciones: List[str]) -> np.ndarray:
+        """Índices de direcciones ya presentes en la matriz (KeyError si falta alguna)"""
+        return np.array([self.index[normalize_location(d)] for d in direcciones], dtype=np.intp)
+
+    def set_pair(self, i: int, j: int, metros: int, segundos: int):
+        """Guarda un par resuelto en ambos sentidos"""
+        self._seconds[i, j] = self._seconds[j, i] = segundos
+        self._meters[i, j] = self._meters[j, i] = metros
+        self._known[i, j] = self._known[j, i] = True
+
+    def missing_pairs(self, indices, columnas=None) -> List[Tuple[int, int]]:
+        """
+        Pares (i, j) con i < j entre los índices dados que aún no están resueltos
+
+        Args:
+            indices: Índices de la matriz (se ignoran repetidos)
+            columnas: Si se indica, solo los pares entre indices y columnas
+                (no los de indices entre sí)
+        """
+        unicos = np.unique(np.asarray(indices, dtype=np.intp))
+        if columnas is None:
+            pendientes = np.argwhere(np.triu(~self._known[np.ix_(unicos, unicos)], k=1))
+            return [(int(unicos[a]), int(unicos[b])) for a, b in pendientes]
+
+        otros = np.unique(np.asarray(columnas, dtype=np.intp))
+        pendientes = np.argwhere(~self._known[np.ix_(unicos, otros)])
+        return sorted({
+            (int(min(unicos[a], otros[b])), int(max(unicos[a], otros[b])))
+            for a, b in pendientes
+        })
+
+    def pair(self, origen: str, destino: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Distancia y tiempo entre dos direcciones si el par está resuelto
+
+        Returns:
+            (distancia_metros, duracion_segundos) o (None, None)
+        """
+        i = self.index.get(normalize_location(origen))
+        j = self.index.get(normalize_location(destino))
+        if i is None or j is None or not self._known[i, j]:
+            return None, None
+        return int(self._meters[i, j]), int(self._seconds[i, j])
+
+    def time_submatrix(self, indices, tiempo_defecto: int = TIEMPO_VIAJE_DEFECTO_SEG) -> np.ndarray:
+        """
+        Submatriz de tiempos para una secuencia de índices
+
+        Los pares no resueltos toman tiempo_defecto; los índices repetidos
+        (direcciones equivalentes) quedan a 0 entre sí.
+        """
+        return self.time_block(indices, indices, tiempo_defecto)
+
+    def time_block(self, filas, columnas, tiempo_defecto: int = TIEMPO_VIAJE_DEFECTO_SEG) -> np.ndarray:
+        """Tiempos de cada índice de filas a cada índice de columnas (no resueltos: tiempo_defecto)"""
+        malla = np.ix_(np.asarray(filas, dtype=np.intp), np.asarray(columnas, dtype=np.intp))
+        return np.where(self._known[malla], self._seconds[malla], tiempo_defecto)
+
+    def distance_submatrix(self, indices) -> np.ndarray:
+        """Submatriz de metros para una secuencia de índices (0 en pares no resueltos)"""
+        idx = np.asarray(indices, dtype=np.intp)
+        return self._meters[np.ix_(idx, idx)]
+
+    def leg_times(self, indices, tiempo_defecto: int = TIEMPO_VIAJE_DEFECTO_SEG) -> np.ndarray:
+        """Tiempos de los tramos consecutivos de una ruta (n-1 valores)"""
+        idx = np.asarray(indices, dtype=np.intp)
+        origen, destino = idx[:-1], idx[1:]
+        return np.where(
+            self._known[origen, destino], self._seconds[origen, destino], tiempo_defecto
+        )
+
+    def _grow(self, tamano: int):
+        """Amplía los arrays (duplicando capacidad) para alojar tamano direcciones"""
+        capacidad = self._seconds.shape[0]
+        if tamano <= capacidad:
+            return
+        nueva = max(tamano, capacidad * 2)
+
+        seconds = np.zeros((nueva, nueva), dtype=np.int32)
+        meters = np.zeros((nueva, nueva), dtype=np.int32)
+        known = np.eye(nueva, dtype=bool)
+        seconds[:capacidad, :capacidad] = self._seconds
+        meters[:capacidad, :capacidad] = self._meters
+        known[:capacidad, :capacidad] = self._known
+
+        self._seconds, self._meters, self._known = seconds, meters, known
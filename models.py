@@ -6,6 +6,8 @@ from datetime import date, time
 from typing import Optional, List, Dict
 from enum import Enum
 
+import numpy as np
+
 
 class VisitStatus(Enum):
     """Estados posibles de una visita"""
@@ -180,6 +182,18 @@ class AnalysisResult:
         return len(self.problemas) == 0 and len(self.sugerencias) == 0
 
 
+@dataclass
+class RebalanceResult:
+    """Resultado de rebalancear un plan con búsqueda local entre días"""
+    plan: Dict[str, dict] = field(default_factory=dict)  # Formato legacy {fecha_iso: {ruta, tiempo_total}}
+    sugerencias: List[Suggestion] = field(default_factory=list)  # Mejores movimientos sobre el plan original
+    movimientos_aplicados: int = 0
+    tiempo_antes: int = 0
+    tiempo_despues: int = 0
+    exceso_antes: int = 0  # Segundos por encima de la jornada, sumados en todos los días
+    exceso_despues: int = 0
+
+
 @dataclass
 class ScoreInfo:
     """Información de score de idoneidad"""
@@ -187,6 +201,7 @@ class ScoreInfo:
     capacidad_disponible: float
     proximidad: float
     capacidad_pct: float
+    tiempo_extra: int = 0  # Segundos que la visita añade al día (inserción más barata)
 
     @property
     def estrellas(self) -> str:
@@ -205,3 +220,30 @@ class ScoreInfo:
             return "Aceptable"
         else:
             return "No recomendado"
+
+
+@dataclass
+class ScoreTable:
+    """Scores de idoneidad de varias visitas (filas) para varios días (columnas)"""
+    dias: List[date]
+    scores: np.ndarray  # m×d, 0.0 - 1.0
+    capacidad_disponible: np.ndarray  # m×d
+    proximidad: np.ndarray  # m×d
+    tiempo_extra: np.ndarray  # m×d, segundos que añade cada visita a cada día
+    capacidad_pct: np.ndarray  # d, % de jornada ya ocupado en cada día
+
+    def score_info(self, fila: int, dia: date) -> ScoreInfo:
+        """ScoreInfo de la visita de la fila dada para un día"""
+        col = self.dias.index(dia)
+        return ScoreInfo(
+            score=float(self.scores[fila, col]),
+            capacidad_disponible=float(self.capacidad_disponible[fila, col]),
+            proximidad=float(self.proximidad[fila, col]),
+            capacidad_pct=float(self.capacidad_pct[col]),
+            tiempo_extra=int(self.tiempo_extra[fila, col])
+        )
+
+    def dias_ordenados(self, fila: int) -> List[date]:
+        """Días ordenados por score para la visita de la fila dada (mejor primero)"""
+        orden = np.argsort(-self.scores[fila], kind='stable')
+        return [self.dias[col] for col in orden]
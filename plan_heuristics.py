@@ -0,0 +1,831 @@
+"""
+Búsqueda local entre días sobre una matriz de tiempos en memoria
+
+Un plan es una lista de rutas (una por día) de índices de la matriz. Cada ruta
+es un camino abierto y su tiempo es el viaje entre visitas consecutivas más la
+duración de cada visita. El coste de un día penaliza el tiempo que excede su
+jornada, de modo que la búsqueda primero elimina excesos y después reduce el
+viaje total.
+
+Movimientos entre dos días, todos con evaluación delta vectorizada:
+    relocate: mover una visita a la mejor posición de otro día
+    swap: intercambiar dos visitas de días distintos (cada una ocupa el hueco de la otra)
+    two_opt_star: intercambiar los finales de dos rutas
+
+También incluye la construcción de planes por ahorros (savings_routes), la
+búsqueda de vecindario grande sobre un plan completo (ruin_and_recreate), una
+cota inferior para saber si las visitas obligatorias caben
+(mandatory_lower_bound) y el recorte de una ruta a su jornada (trim_route).
+"""
+import random
+import time
+
+import numpy as np
+
+import route_heuristics
+from config import (
+    PENALIZACION_EXCESO_JORNADA, PENALIZACION_VISITA_NO_ASIGNADA_SEG, TIEMPO_MAX_LNS_MS,
+    MAX_VISITAS_RUINA, UMBRAL_ACEPTACION_LNS
+)
+
+
+# Extra de inserción para las candidatas que no caben en un día
+_SIN_HUECO = np.int64(2 ** 60)
+
+
+def day_time(route, time_matrix, duracion_visita_seg):
+    """Tiempo de un día: viaje entre visitas consecutivas + duración de cada visita"""
+    if not len(route):
+        return 0
+    idx = np.asarray(route, dtype=np.intp)
+    return int(time_matrix[idx[:-1], idx[1:]].sum()) + len(route) * duracion_visita_seg
+
+
+def day_cost(tiempo, limite):
+    """Coste de un día: su tiempo más el exceso sobre la jornada penalizado"""
+    return tiempo + PENALIZACION_EXCESO_JORNADA * np.maximum(0, tiempo - limite)
+
+
+def _adjacent_travel(route, time_matrix):
+    """Suma de las aristas que tocan cada visita de la ruta"""
+    aristas = np.zeros(len(route), dtype=np.int64)
+    if len(route) > 1:
+        tramos = time_matrix[route[:-1], route[1:]]
+        aristas[1:] += tramos
+        aristas[:-1] += tramos
+    return aristas
+
+
+def _removal_gain(route, time_matrix):
+    """Viaje que se ahorra al quitar cada visita de la ruta (uniendo sus vecinas)"""
+    ganancia = _adjacent_travel(route, time_matrix)
+    if len(route) > 2:
+        ganancia[1:-1] -= time_matrix[route[:-2], route[2:]]
+    return ganancia
+
+
+def _insertion_extra(candidatas, route, time_matrix):
+    """
+    Viaje añadido al insertar cada candidata en la mejor posición de la ruta
+
+    Returns:
+        (posiciones, extra) con un valor por candidata
+    """
+    if not len(route):
+        return np.zeros(len(candidatas), dtype=np.intp), np.zeros(len(candidatas), dtype=np.int64)
+
+    hasta_ruta = time_matrix[np.ix_(candidatas, route)]
+    tramos = time_matrix[route[:-1], route[1:]]
+    extra = np.concatenate([
+        hasta_ruta[:, :1],
+        hasta_ruta[:, :-1] + hasta_ruta[:, 1:] - tramos,
+        hasta_ruta[:, -1:]
+    ], axis=1)
+    posiciones = extra.argmin(axis=1)
+    return posiciones, extra[np.arange(len(candidatas)), posiciones]
+
+
+def _best_relocate(a, b, rutas, tiempos, limites, time_matrix, duracion):
+    """Mejor visita del día a para mover al día b"""
+    ruta_a, ruta_b = rutas[a], rutas[b]
+    if not len(ruta_a):
+        return None
+
+    posiciones, extra = _insertion_extra(ruta_a, ruta_b, time_matrix)
+    nuevo_a = tiempos[a] - _removal_gain(ruta_a, time_matrix) - duracion
+    nuevo_b = tiempos[b] + extra + duracion
+    delta = (day_cost(nuevo_a, limites[a]) + day_cost(nuevo_b, limites[b]) -
+             day_cost(tiempos[a], limites[a]) - day_cost(tiempos[b], limites[b]))
+
+    p = int(delta.argmin())
+    return {
+        'tipo': 'relocate', 'origen': a, 'destino': b,
+        'posicion': p, 'posicion_destino': int(posiciones[p]),
+        'delta': int(delta[p]), 'tiempos': (int(nuevo_a[p]), int(nuevo_b[p]))
+    }
+
+
+def _replacement_delta(route, otras, time_matrix):
+    """
+    Cambio de viaje al sustituir cada visita de route por cada una de otras
+
+    Returns:
+        Matriz len(route) × len(otras)
+    """
+    n = len(route)
+    delta = np.zeros((n, len(otras)), dtype=np.int64)
+    if n > 1:
+        delta[1:] += time_matrix[np.ix_(route[:-1], otras)]
+        delta[:-1] += time_matrix[np.ix_(route[1:], otras)]
+    return delta - _adjacent_travel(route, time_matrix)[:, None]
+
+
+def _best_swap(a, b, rutas, tiempos, limites, time_matrix, duracion):
+    """Mejor pareja de visitas a intercambiar entre los días a y b"""
+    ruta_a, ruta_b = rutas[a], rutas[b]
+    if not len(ruta_a) or not len(ruta_b):
+        return None
+
+    nuevo_a = tiempos[a] + _replacement_delta(ruta_a, ruta_b, time_matrix)
+    nuevo_b = tiempos[b] + _replacement_delta(ruta_b, ruta_a, time_matrix).T
+    delta = (day_cost(nuevo_a, limites[a]) + day_cost(nuevo_b, limites[b]) -
+             day_cost(tiempos[a], limites[a]) - day_cost(tiempos[b], limites[b]))
+
+    p, q = np.unravel_index(int(delta.argmin()), delta.shape)
+    return {
+        'tipo': 'swap', 'origen': a, 'destino': b,
+        'posicion': int(p), 'posicion_destino': int(q),
+        'delta': int(delta[p, q]), 'tiempos': (int(nuevo_a[p, q]), int(nuevo_b[p, q]))
+    }
+
+
+def _prefix_suffix_travel(route, time_matrix):
+    """Viaje de route[:i] y de route[i:] para i = 0..n"""
+    n = len(route)
+    tramos = time_matrix[route[:-1], route[1:]] if n > 1 else np.zeros(0, dtype=np.int64)
+    acumulado = np.concatenate([[0], np.cumsum(tramos)])  # viaje de route[:k+1]
+    prefijo = np.concatenate([[0], acumulado])[:n + 1]
+    sufijo = acumulado[-1] - np.concatenate([acumulado, [acumulado[-1]]])[:n + 1]
+    return prefijo, sufijo
+
+
+def _best_two_opt_star(a, b, rutas, tiempos, limites, time_matrix, duracion):
+    """Mejor intercambio de finales: a[:i] + b[j:] y b[:j] + a[i:]"""
+    ruta_a, ruta_b = rutas[a], rutas[b]
+    n_a, n_b = len(ruta_a), len(ruta_b)
+    if not n_a and not n_b:
+        return None
+
+    prefijo_a, sufijo_a = _prefix_suffix_travel(ruta_a, time_matrix)
+    prefijo_b, sufijo_b = _prefix_suffix_travel(ruta_b, time_matrix)
+
+    # enlace_ab[i, j]: arista a[i-1] -> b[j] (0 si alguno de los lados está vacío)
+    enlace_ab = np.zeros((n_a + 1, n_b + 1), dtype=np.int64)
+    enlace_ba = np.zeros((n_a + 1, n_b + 1), dtype=np.int64)
+    if n_a and n_b:
+        enlace_ab[1:, :-1] = time_matrix[np.ix_(ruta_a, ruta_b)]
+        enlace_ba[:-1, 1:] = time_matrix[np.ix_(ruta_a, ruta_b)]
+
+    i = np.arange(n_a + 1)[:, None]
+    j = np.arange(n_b + 1)[None, :]
+    nuevo_a = prefijo_a[:, None] + enlace_ab + sufijo_b[None, :] + (i + n_b - j) * duracion
+    nuevo_b = prefijo_b[None, :] + enlace_ba + sufijo_a[:, None] + (j + n_a - i) * duracion
+    delta = (day_cost(nuevo_a, limites[a]) + day_cost(nuevo_b, limites[b]) -
+             day_cost(tiempos[a], limites[a]) - day_cost(tiempos[b], limites[b]))
+    delta[n_a, n_b] = 0  # Intercambiar dos finales vacíos no cambia nada
+
+    p, q = np.unravel_index(int(delta.argmin()), delta.shape)
+    return {
+        'tipo': 'two_opt_star', 'origen': a, 'destino': b,
+        'posicion': int(p), 'posicion_destino': int(q),
+        'delta': int(delta[p, q]), 'tiempos': (int(nuevo_a[p, q]), int(nuevo_b[p, q]))
+    }
+
+
+INTER_DAY_MOVES = {
+    'relocate': _best_relocate,
+    'swap': _best_swap,
+    'two_opt_star': _best_two_opt_star,
+}
+
+# Movimientos simétricos: basta evaluar cada par de días una vez
+_SYMMETRIC_MOVES = {'swap', 'two_opt_star'}
+
+
+def best_moves(rutas, time_matrix, duracion_visita_seg, limites, moves=tuple(INTER_DAY_MOVES), pares=None):
+    """
+    Mejor movimiento de cada tipo para cada par de días, ordenados por mejora
+
+    Args:
+        rutas: Lista de rutas (listas de índices), una por día
+        time_matrix: Matriz de tiempos (array de NumPy)
+        duracion_visita_seg: Duración de cada visita
+        limites: Jornada en segundos de cada día
+        moves: Nombres de INTER_DAY_MOVES a evaluar
+        pares: Pares de días (a, b) con a < b a evaluar; None evalúa todos
+
+    Returns:
+        Lista de movimientos que mejoran el plan (delta < 0), mejor primero.
+        Cada movimiento es un dict con 'tipo', 'origen', 'destino',
+        'posicion', 'posicion_destino', 'delta' y 'tiempos' (nuevos tiempos
+        de origen y destino).
+    """
+    rutas = [np.asarray(r, dtype=np.intp) for r in rutas]
+    tiempos = [day_time(r, time_matrix, duracion_visita_seg) for r in rutas]
+
+    if pares is None:
+        pares = [(a, b) for a in range(len(rutas)) for b in range(a + 1, len(rutas))]
+
+    candidatos = []
+    for par in pares:
+        for a, b in (par, par[::-1]):
+            for nombre in moves:
+                if nombre in _SYMMETRIC_MOVES and b < a:
+                    continue
+                movimiento = INTER_DAY_MOVES[nombre](
+                    a, b, rutas, tiempos, limites, time_matrix, duracion_visita_seg
+                )
+                if movimiento and movimiento['delta'] < 0:
+                    candidatos.append(movimiento)
+
+    return sorted(candidatos, key=lambda m: m['delta'])
+
+
+def apply_move(rutas, movimiento):
+    """
+    Aplica un movimiento de best_moves
+
+    Returns:
+        Nueva lista de rutas (listas de índices)
+    """
+    rutas = [list(r) for r in rutas]
+    a, b = movimiento['origen'], movimiento['destino']
+    p, q = movimiento['posicion'], movimiento['posicion_destino']
+
+    if movimiento['tipo'] == 'relocate':
+        rutas[b].insert(q, rutas[a].pop(p))
+    elif movimiento['tipo'] == 'swap':
+        rutas[a][p], rutas[b][q] = rutas[b][q], rutas[a][p]
+    elif movimiento['tipo'] == 'two_opt_star':
+        rutas[a], rutas[b] = rutas[a][:p] + rutas[b][q:], rutas[b][:q] + rutas[a][p:]
+
+    return rutas
+
+
+def rebalance(rutas, time_matrix, duracion_visita_seg, limites,
+              time_budget_ms=None, moves=tuple(INTER_DAY_MOVES)):
+    """
+    Búsqueda local entre días con el criterio de mejor mejora
+
+    En cada iteración aplica el mejor movimiento entre días y reordena los dos
+    días afectados con la búsqueda local de route_heuristics, hasta que ningún
+    movimiento mejora o se agota el tiempo.
+
+    Args:
+        rutas: Lista de rutas (listas de índices), una por día
+        time_matrix: Matriz de tiempos (array de NumPy)
+        duracion_visita_seg: Duración de cada visita
+        limites: Jornada en segundos de cada día
+        time_budget_ms: Tiempo máximo en milisegundos (None = sin límite)
+        moves: Nombres de INTER_DAY_MOVES a usar
+
+    Returns:
+        (rutas, movimientos_aplicados)
+    """
+    deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+    matriz_lista = time_matrix.tolist()
+
+    def reordenar(ruta):
+        if len(ruta) <= 3:
+            return list(ruta)
+        return route_heuristics.improve_route(list(ruta), matriz_lista)
+
+    rutas = [reordenar(r) for r in rutas]
+    aplicados = []
+
+    while deadline is None or time.perf_counter() < deadline:
+        candidatos = best_moves(rutas, time_matrix, duracion_visita_seg, limites, moves)
+        if not candidatos:
+            break
+
+        movimiento = candidatos[0]
+        rutas = apply_move(rutas, movimiento)
+        for d in (movimiento['origen'], movimiento['destino']):
+            rutas[d] = reordenar(rutas[d])
+        aplicados.append(movimiento)
+
+    return rutas, aplicados
+
+
+def savings_routes(time_matrix, visitas, duracion_visita_seg, limites, depot=None, closed=False):
+    """
+    Construcción de un plan por ahorros (Clarke-Wright) con una jornada por día
+
+    Cada visita empieza en su propia ruta y se unen extremos de rutas por
+    orden de ahorro t(0, i) + t(0, j) - t(i, j) mientras la ruta unida quepa
+    en la jornada más larga. Después cada día, de mayor a menor jornada, toma
+    la ruta con más visitas que le cabe, y las visitas sobrantes se insertan
+    por orden de prioridad en la posición más barata de un día donde quepan
+    (así se aprovechan también las jornadas cortas, como la del viernes).
+    Mientras entren visitas, se repasa el orden de cada día con la búsqueda
+    local de route_heuristics para liberar tiempo y se vuelve a insertar.
+
+    Args:
+        time_matrix: Matriz de tiempos (array de NumPy)
+        visitas: Índices de la matriz a repartir, en orden de prioridad
+        duracion_visita_seg: Duración de cada visita
+        limites: Jornada en segundos de cada día
+        depot: Índice del punto de partida; None usa la visita más central
+            solo como referencia para calcular los ahorros
+        closed: Si True (con depot), cada día suma la vuelta al punto de partida
+
+    Returns:
+        (rutas, no_asignadas): una ruta (índices de la matriz, sin el punto de
+        partida) por día y los índices que no caben, en orden de prioridad
+    """
+    visitas = np.asarray(visitas, dtype=np.intp)
+    n = len(visitas)
+    if n == 0 or not len(limites):
+        return [[] for _ in limites], visitas.tolist()
+
+    # Trabajar con índices locales 0..n-1 (el índice local es la prioridad)
+    tm, sub, salida, vuelta = _endpoint_times(time_matrix, visitas, depot, closed)
+    desde = salida if depot is not None else sub[int(sub.sum(axis=1).argmin())]
+
+    def tiempo(ruta, viaje):
+        return viaje + len(ruta) * duracion_visita_seg + int(salida[ruta[0]]) + int(vuelta[ruta[-1]])
+
+    # Una ruta por visita; unir extremos por orden de ahorro
+    rutas = {i: [i] for i in range(n)}
+    viajes = {i: 0 for i in range(n)}
+    ruta_de = list(range(n))
+    limite_max = max(limites)
+
+    iu, ju = np.triu_indices(n, k=1)
+    ahorros = desde[iu] + desde[ju] - sub[iu, ju]
+    orden = np.argsort(-ahorros, kind='stable')
+    orden = orden[ahorros[orden] > 0]
+
+    for k in orden.tolist():
+        i, j = int(iu[k]), int(ju[k])
+        ri, rj = ruta_de[i], ruta_de[j]
+        if ri == rj:
+            continue
+        a, b = rutas[ri], rutas[rj]
+        if i not in (a[0], a[-1]) or j not in (b[0], b[-1]):
+            continue
+
+        # Orientar para que a termine en i y b empiece en j
+        if a[-1] != i:
+            a = a[::-1]
+        if b[0] != j:
+            b = b[::-1]
+        unida = a + b
+        viaje = viajes[ri] + viajes[rj] + int(sub[i, j])
+        # Con punto de partida el sentido importa: quedarse con el más corto
+        if tiempo(unida[::-1], viaje) < tiempo(unida, viaje):
+            unida = unida[::-1]
+        if tiempo(unida, viaje) > limite_max:
+            continue
+
+        rutas[ri], viajes[ri] = unida, viaje
+        del rutas[rj], viajes[rj]
+        for x in b:
+            ruta_de[x] = ri
+
+    # Cada día (de mayor a menor jornada) toma la ruta con más visitas que le cabe
+    rutas_dia = [[] for _ in limites]
+    tiempos_dia = [0] * len(limites)
+    for d in sorted(range(len(limites)), key=lambda d: -limites[d]):
+        caben = [r for r in rutas if tiempo(rutas[r], viajes[r]) <= limites[d]]
+        if not caben:
+            continue
+        r = max(caben, key=lambda r: (len(rutas[r]), -min(rutas[r])))
+        rutas_dia[d], tiempos_dia[d] = rutas[r], tiempo(rutas[r], viajes[r])
+        del rutas[r]
+
+    # Visitas sobrantes: inserción más barata en un día donde quepan
+    no_asignadas = sorted(x for ruta in rutas.values() for x in ruta)
+    insertadas = True
+    while no_asignadas and insertadas:
+        for d in range(len(limites)):
+            rutas_dia[d], tiempos_dia[d] = _improve_day(
+                rutas_dia[d], tiempos_dia[d], tm, visitas, sub, salida, vuelta,
+                duracion_visita_seg, depot, closed
+            )
+        pendientes = len(no_asignadas)
+        no_asignadas = _insert_cheapest(
+            no_asignadas, rutas_dia, tiempos_dia, limites, sub, salida, vuelta, duracion_visita_seg
+        )
+        insertadas = len(no_asignadas) < pendientes
+
+    return [visitas[ruta].tolist() for ruta in rutas_dia], visitas[no_asignadas].tolist()
+
+
+def mandatory_lower_bound(time_matrix, visitas, duracion_visita_seg, num_dias, depot=None):
+    """
+    Cota inferior del tiempo necesario para cubrir unas visitas en num_dias días
+
+    Las rutas de todos los días juntas forman un bosque que cubre las visitas
+    (un árbol que pasa por el punto de partida, si lo hay), así que su viaje
+    no baja del árbol de expansión mínima. Sin punto de partida hay hasta
+    num_dias rutas separadas: se descuentan las num_dias - 1 aristas más
+    largas del árbol. Se usa el tiempo más corto de cada par en cualquier
+    sentido, así que vale aunque la matriz no sea simétrica.
+
+    Args:
+        time_matrix: Matriz de tiempos (array de NumPy)
+        visitas: Índices de la matriz a cubrir
+        duracion_visita_seg: Duración de cada visita
+        num_dias: Número de días disponibles
+        depot: Índice del punto de partida (None = sin punto de partida)
+
+    Returns:
+        Segundos (visitas + viaje mínimo)
+    """
+    puntos = list(visitas) if depot is None else [depot] + list(visitas)
+    if not len(visitas):
+        return 0
+
+    tm = np.asarray(time_matrix, dtype=np.int64)
+    sub = tm[np.ix_(puntos, puntos)]
+    sub = np.minimum(sub, sub.T)
+
+    # Prim en O(n²)
+    n = len(puntos)
+    en_arbol = np.zeros(n, dtype=bool)
+    en_arbol[0] = True
+    distancia = sub[0].copy()
+    aristas = []
+    for _ in range(n - 1):
+        k = int(np.where(en_arbol, _SIN_HUECO, distancia).argmin())
+        aristas.append(int(distancia[k]))
+        en_arbol[k] = True
+        distancia = np.minimum(distancia, sub[k])
+
+    if depot is None and num_dias > 1:
+        aristas = sorted(aristas)[:max(0, len(aristas) - (num_dias - 1))]
+
+    return len(visitas) * duracion_visita_seg + sum(aristas)
+
+
+def trim_route(time_matrix, ruta, duracion_visita_seg, limite, depot=None, closed=False):
+    """
+    Recorta una ruta hasta que quepa en la jornada
+
+    Quita cada vez la visita cuyo viaje de ida y vuelta más se ahorra (la
+    más apartada del resto) y reordena las demás con búsqueda local.
+
+    Args:
+        time_matrix: Matriz de tiempos (array de NumPy)
+        ruta: Índices de la matriz en orden
+        duracion_visita_seg: Duración de cada visita
+        limite: Jornada en segundos
+        depot, closed: Punto de partida y vuelta, como en savings_routes
+
+    Returns:
+        (ruta, quitadas): la ruta que cabe y las visitas quitadas, en el orden
+        en que se quitaron
+    """
+    visitas = np.asarray(ruta, dtype=np.intp)
+    tm, sub, salida, vuelta = _endpoint_times(time_matrix, visitas, depot, closed)
+    local = list(range(len(visitas)))
+    tiempo = _route_time(local, sub, salida, vuelta, duracion_visita_seg)
+    quitadas = []
+
+    while local and tiempo > limite:
+        k = int(_removal_gains(local, sub, salida, vuelta).argmax())
+        quitadas.append(local.pop(k))
+        local, tiempo = _improve_day(
+            local, _route_time(local, sub, salida, vuelta, duracion_visita_seg), tm, visitas, sub,
+            salida, vuelta, duracion_visita_seg, depot, closed
+        )
+
+    return visitas[local].tolist(), visitas[quitadas].tolist()
+
+
+def _endpoint_times(time_matrix, visitas, depot=None, closed=False):
+    """
+    Submatriz de las visitas y tiempos desde / hasta el punto de partida
+
+    Returns:
+        (tm, sub, salida, vuelta): matriz completa, submatriz en índices
+        locales, tiempo desde el punto de partida a cada visita y tiempo de
+        vuelta (ceros sin punto de partida o sin vuelta)
+    """
+    tm = np.asarray(time_matrix, dtype=np.int64)
+    sub = tm[np.ix_(visitas, visitas)]
+    ceros = np.zeros(len(visitas), dtype=np.int64)
+    if depot is None:
+        return tm, sub, ceros, ceros
+    salida = tm[depot, visitas]
+    return tm, sub, salida, salida if closed else ceros
+
+
+def _route_time(ruta, sub, salida, vuelta, duracion):
+    """Tiempo de un día en índices locales, con la salida y la vuelta"""
+    if not ruta:
+        return 0
+    r = np.asarray(ruta, dtype=np.intp)
+    return (int(sub[r[:-1], r[1:]].sum()) + len(ruta) * duracion
+            + int(salida[r[0]]) + int(vuelta[r[-1]]))
+
+
+def _insertion_extras(candidatas, ruta, sub, salida, vuelta):
+    """
+    Viaje añadido al insertar cada candidata en cada posición de la ruta
+
+    Returns:
+        Array candidatas × (len(ruta) + 1)
+    """
+    c = np.asarray(candidatas, dtype=np.intp)
+    if not len(ruta):
+        return (salida[c] + vuelta[c])[:, None]
+
+    r = np.asarray(ruta, dtype=np.intp)
+    hasta_ruta = sub[np.ix_(c, r)]
+    desde_ruta = sub[np.ix_(r, c)].T
+    return np.concatenate([
+        (salida[c] + hasta_ruta[:, 0] - salida[r[0]])[:, None],
+        desde_ruta[:, :-1] + hasta_ruta[:, 1:] - sub[r[:-1], r[1:]],
+        (desde_ruta[:, -1] + vuelta[c] - vuelta[r[-1]])[:, None]
+    ], axis=1)
+
+
+def _removal_gains(ruta, sub, salida, vuelta):
+    """Viaje que se ahorra al quitar cada visita de la ruta, con la salida y la vuelta"""
+    r = np.asarray(ruta, dtype=np.intp)
+    if len(r) == 1:
+        return salida[r] + vuelta[r]
+
+    entrada = np.concatenate([salida[r[:1]], sub[r[:-1], r[1:]]])
+    salida_visita = np.concatenate([sub[r[:-1], r[1:]], vuelta[r[-1:]]])
+    puente = np.concatenate([salida[r[1:2]], sub[r[:-2], r[2:]], vuelta[r[-2:-1]]])
+    return entrada + salida_visita - puente
+
+
+def _improve_day(ruta, tiempo, tm, visitas, sub, salida, vuelta, duracion, depot=None, closed=False):
+    """
+    Reordena un día con la búsqueda local de route_heuristics
+
+    Returns:
+        (ruta, tiempo): la nueva ruta solo si es más corta
+    """
+    if len(ruta) < 3:
+        return ruta, tiempo
+
+    puntos = visitas[ruta] if depot is None else np.concatenate([[depot], visitas[ruta]])
+    base = 0 if depot is None else 1
+    orden = route_heuristics.improve_route(
+        list(range(len(puntos))), tm[np.ix_(puntos, puntos)].tolist(),
+        closed=closed and depot is not None
+    )
+    nueva = [ruta[k - base] for k in orden[base:]]
+    tiempo_nueva = _route_time(nueva, sub, salida, vuelta, duracion)
+    if tiempo_nueva < tiempo:
+        return nueva, tiempo_nueva
+    return ruta, tiempo
+
+
+def _insert_cheapest(candidatas, rutas, tiempos, limites, sub, salida, vuelta, duracion, penalizacion=None):
+    """
+    Inserta cada candidata (en orden) en la posición más barata de un día donde quepa
+
+    Los extras de todas las candidatas se calculan una vez por día y solo se
+    recalculan en el día que recibe una visita. Con penalizacion (coste de
+    dejar cada visita sin día) no se inserta una visita que cueste más que
+    su penalización. Modifica rutas y tiempos in situ y devuelve las
+    candidatas que no caben.
+    """
+    c = np.asarray(candidatas, dtype=np.intp)
+    if not len(c):
+        return []
+
+    extra = np.empty((len(rutas), len(c)), dtype=np.int64)
+    posicion = np.empty((len(rutas), len(c)), dtype=np.intp)
+
+    def evaluar(d, desde=0):
+        extras = _insertion_extras(c[desde:], rutas[d], sub, salida, vuelta)
+        posicion[d, desde:] = extras.argmin(axis=1)
+        extra[d, desde:] = extras[np.arange(len(c) - desde), posicion[d, desde:]]
+
+    for d in range(len(rutas)):
+        evaluar(d)
+
+    no_asignadas = []
+    for k, v in enumerate(c.tolist()):
+        cabe = np.asarray(tiempos) + extra[:, k] + duracion <= np.asarray(limites)
+        if penalizacion is not None:
+            cabe &= extra[:, k] + duracion <= penalizacion[v]
+        if not cabe.any():
+            no_asignadas.append(v)
+            continue
+        d = int(np.where(cabe, extra[:, k], _SIN_HUECO).argmin())
+        rutas[d].insert(int(posicion[d, k]), v)
+        tiempos[d] += int(extra[d, k]) + duracion
+        evaluar(d, k + 1)
+
+    return no_asignadas
+
+
+def _regret_insertion(candidatas, rutas, tiempos, limites, sub, salida, vuelta, duracion,
+                      obligatoria, penalizacion):
+    """
+    Inserción por arrepentimiento (regret-2)
+
+    En cada paso inserta la candidata con más diferencia entre su mejor día
+    y el segundo mejor (la que más perdería si se deja para después), en su
+    posición más barata. Las candidatas obligatorias van siempre antes, y no
+    se inserta una visita que cueste más que su penalización por quedarse
+    sin día. Modifica rutas y tiempos in situ.
+
+    Returns:
+        Candidatas que no caben en ningún día, en el orden recibido
+    """
+    c = np.asarray(candidatas, dtype=np.intp)
+    m = len(c)
+    if m == 0:
+        return []
+
+    extra = np.full((len(rutas), m), _SIN_HUECO, dtype=np.int64)
+    posicion = np.zeros((len(rutas), m), dtype=np.intp)
+    activa = np.ones(m, dtype=bool)
+
+    def evaluar(d):
+        extras = _insertion_extras(c, rutas[d], sub, salida, vuelta)
+        posicion[d] = extras.argmin(axis=1)
+        mejores = extras[np.arange(m), posicion[d]]
+        cabe = activa & (tiempos[d] + mejores + duracion <= limites[d]) & (mejores + duracion <= penalizacion[c])
+        extra[d] = np.where(cabe, mejores, _SIN_HUECO)
+
+    for d in range(len(rutas)):
+        evaluar(d)
+
+    while True:
+        ordenados = np.sort(extra, axis=0)
+        mejor = ordenados[0]
+        posibles = np.flatnonzero(mejor < _SIN_HUECO)
+        if not len(posibles):
+            break
+        segundo = ordenados[1] if len(rutas) > 1 else mejor
+        arrepentimiento = np.where(segundo >= _SIN_HUECO, _SIN_HUECO, segundo - mejor)[posibles]
+
+        # Obligatorias primero, después más arrepentimiento, después menos viaje añadido
+        k = posibles[np.lexsort((mejor[posibles], -arrepentimiento, ~obligatoria[c[posibles]]))[0]]
+        d = int(extra[:, k].argmin())
+        rutas[d].insert(int(posicion[d, k]), int(c[k]))
+        tiempos[d] += int(extra[d, k]) + duracion
+        activa[k] = False
+        extra[:, k] = _SIN_HUECO
+        evaluar(d)
+
+    return c[activa].tolist()
+
+
+def _random_removal(rutas, cuantas, libres, sub, salida, vuelta, rng):
+    """Quita visitas al azar"""
+    return rng.sample(libres, cuantas)
+
+
+def _related_removal(rutas, cuantas, libres, sub, salida, vuelta, rng):
+    """Quita una visita al azar y las más cercanas a ella (de cualquier día)"""
+    semilla = rng.choice(libres)
+    cercania = sub[semilla, libres] + sub[libres, semilla]
+    return [libres[i] for i in np.argsort(cercania, kind='stable')[:cuantas]]
+
+
+def _worst_removal(rutas, cuantas, libres, sub, salida, vuelta, rng):
+    """Quita las visitas que más viaje cuestan, con algo de ruido para no repetir siempre"""
+    ganancias = {}
+    for ruta in rutas:
+        if ruta:
+            ganancias.update(zip(ruta, _removal_gains(ruta, sub, salida, vuelta).tolist()))
+    return sorted(libres, key=lambda v: -ganancias[v] * rng.uniform(0.8, 1.2))[:cuantas]
+
+
+# Operadores de destrucción de ruin_and_recreate
+RUIN_OPERATORS = {
+    'random': _random_removal,
+    'related': _related_removal,
+    'worst': _worst_removal,
+}
+
+
+def ruin_and_recreate(time_matrix, rutas, no_asignadas, duracion_visita_seg, limites, fijas=(),
+                      obligatorias=(), premios=None, depot=None, closed=False,
+                      time_budget_ms=TIEMPO_MAX_LNS_MS, seed=0, progress=None):
+    """
+    Búsqueda de vecindario grande (LNS) sobre un plan de varios días
+
+    Parte del plan recibido y, mientras quede tiempo, destruye una parte
+    (visitas al azar, cercanas entre sí o las más caras), la reconstruye con
+    inserción por arrepentimiento intentando también meter visitas no
+    asignadas, y reordena los días tocados con la búsqueda local. Acepta
+    planes algo peores al principio (umbral que baja a cero con el tiempo) y
+    devuelve el mejor encontrado.
+
+    Coste del plan (recogida de premios): suma de los tiempos de cada día
+    más el premio de cada visita opcional sin día. Una visita obligatoria sin
+    día cuesta más que cualquier plan, así que se cubren todas las que
+    quepan; si el plan de partida deja alguna fuera, se prueba también a
+    rehacerlo metiendo primero las obligatorias. Las fijas son obligatorias
+    que además no cambian de día.
+
+    Args:
+        time_matrix: Matriz de tiempos (array de NumPy)
+        rutas: Ruta inicial de cada día (índices de la matriz, sin el punto de partida)
+        no_asignadas: Índices sin día, en orden de prioridad
+        duracion_visita_seg: Duración de cada visita
+        limites: Jornada en segundos de cada día
+        fijas: Índices que no se quitan de su día
+        obligatorias: Índices que deben quedar en el plan (pueden cambiar de día)
+        premios: {índice: segundos} premio de cada visita opcional (por
+            defecto PENALIZACION_VISITA_NO_ASIGNADA_SEG)
+        depot: Índice del punto de partida (None = sin punto de partida)
+        closed: Si True (con depot), cada día suma la vuelta al punto de partida
+        time_budget_ms: Tiempo máximo en milisegundos
+        seed: Semilla (mismo resultado con el mismo número de iteraciones)
+        progress: Función progress(fraccion, mensaje) llamada al avanzar
+
+    Returns:
+        (rutas, no_asignadas) en índices de la matriz
+    """
+    inicio = time.perf_counter()
+    deadline = inicio + time_budget_ms / 1000
+    visitas = np.asarray([v for ruta in rutas for v in ruta] + list(no_asignadas), dtype=np.intp)
+    if not len(visitas) or not len(limites):
+        return [list(ruta) for ruta in rutas], list(no_asignadas)
+
+    tm, sub, salida, vuelta = _endpoint_times(time_matrix, visitas, depot, closed)
+    local = {v: k for k, v in enumerate(visitas.tolist())}
+    fija = np.zeros(len(visitas), dtype=bool)
+    fija[[local[v] for v in fijas if v in local]] = True
+    obligatoria = fija.copy()
+    obligatoria[[local[v] for v in obligatorias if v in local]] = True
+    premio = np.full(len(visitas), PENALIZACION_VISITA_NO_ASIGNADA_SEG, dtype=np.int64)
+    for v, segundos in (premios or {}).items():
+        if v in local:
+            premio[local[v]] = segundos
+    penalizacion = np.where(obligatoria, sum(limites) + int(premio.max()), premio)
+
+    def coste(tiempos, libres):
+        return sum(tiempos) + int(penalizacion[libres].sum())
+
+    def reconstruir(rutas_nuevas, tiempos_nuevos, candidatas):
+        # Obligatorias primero y después por premio; devuelve las que no caben
+        candidatas = sorted(candidatas, key=lambda v: (not obligatoria[v], -premio[v], v))
+        return _regret_insertion(
+            candidatas, rutas_nuevas, tiempos_nuevos, limites, sub, salida, vuelta,
+            duracion_visita_seg, obligatoria, penalizacion
+        )
+
+    actual = [[local[v] for v in ruta] for ruta in rutas]
+    tiempos_actual = [_route_time(ruta, sub, salida, vuelta, duracion_visita_seg) for ruta in actual]
+    libres_actual = [local[v] for v in no_asignadas]
+    coste_actual = coste(tiempos_actual, libres_actual)
+
+    if obligatoria[libres_actual].any():
+        # Alternativa: vaciar los días (salvo las fijas) y meter primero las obligatorias
+        rutas_nuevas = [[v for v in ruta if fija[v]] for ruta in actual]
+        tiempos_nuevos = [_route_time(ruta, sub, salida, vuelta, duracion_visita_seg) for ruta in rutas_nuevas]
+        quitadas = [v for ruta in actual for v in ruta if not fija[v]]
+        libres = reconstruir(rutas_nuevas, tiempos_nuevos, quitadas + libres_actual)
+        if coste(tiempos_nuevos, libres) < coste_actual:
+            actual, tiempos_actual, libres_actual = rutas_nuevas, tiempos_nuevos, libres
+            coste_actual = coste(tiempos_actual, libres_actual)
+    mejor, libres_mejor, coste_mejor = actual, libres_actual, coste_actual
+    coste_inicial = coste_actual
+
+    rng = random.Random(seed)
+    operadores = list(RUIN_OPERATORS.values())
+    ultimo_aviso = -1.0
+    iteracion = 0
+
+    while time.perf_counter() < deadline:
+        iteracion += 1
+        planificadas = [v for ruta in actual for v in ruta if not fija[v]]
+        if not planificadas:
+            break
+
+        # Destruir
+        cuantas = rng.randint(1, min(MAX_VISITAS_RUINA, max(1, len(planificadas) // 4)))
+        quitadas = set(rng.choice(operadores)(actual, cuantas, planificadas, sub, salida, vuelta, rng))
+        rutas_nuevas, tiempos_nuevos, tocados = [], [], set()
+        for d, ruta in enumerate(actual):
+            if quitadas.intersection(ruta):
+                ruta = [v for v in ruta if v not in quitadas]
+                tocados.add(d)
+                tiempos_nuevos.append(_route_time(ruta, sub, salida, vuelta, duracion_visita_seg))
+            else:
+                ruta = list(ruta)
+                tiempos_nuevos.append(tiempos_actual[d])
+            rutas_nuevas.append(ruta)
+
+        # Reconstruir (obligatorias y las de más premio primero) y reordenar los días tocados
+        libres = reconstruir(rutas_nuevas, tiempos_nuevos, quitadas.union(libres_actual))
+        tocados.update(d for d, ruta in enumerate(rutas_nuevas) if ruta != actual[d])
+        for d in tocados:
+            rutas_nuevas[d], tiempos_nuevos[d] = _improve_day(
+                rutas_nuevas[d], tiempos_nuevos[d], tm, visitas, sub, salida, vuelta,
+                duracion_visita_seg, depot, closed
+            )
+        if libres:
+            libres = _insert_cheapest(
+                libres, rutas_nuevas, tiempos_nuevos, limites, sub, salida, vuelta, duracion_visita_seg,
+                penalizacion
+            )
+
+        # Aceptar con un umbral que baja linealmente hasta cero
+        fraccion = min(1.0, (time.perf_counter() - inicio) * 1000 / time_budget_ms) if time_budget_ms > 0 else 1.0
+        coste_nuevo = coste(tiempos_nuevos, libres)
+        if coste_nuevo <= coste_actual + UMBRAL_ACEPTACION_LNS * (1 - fraccion) * coste_inicial:
+            actual, tiempos_actual, libres_actual, coste_actual = rutas_nuevas, tiempos_nuevos, libres, coste_nuevo
+            if coste_actual < coste_mejor:
+                mejor, libres_mejor, coste_mejor = actual, libres_actual, coste_actual
+
+        # Limitar avisos: uno por cada 2% de avance
+        if progress is not None and (fraccion - ultimo_aviso >= 0.02 or fraccion >= 1.0):
+            ultimo_aviso = fraccion
+            progress(fraccion, f"Iteración {iteracion}: {len(libres_mejor)} visitas sin día")
+
+    return [visitas[ruta].tolist() for ruta in mejor], visitas[libres_mejor].tolist()
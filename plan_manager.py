@@ -2,12 +2,18 @@
 Manager para gestión de planes y estado de sesión
 """
 from typing import Dict, List, Optional
-from datetime import date, datetime, time, timedelta
+from datetime import date, time
+import numpy as np
 import streamlit as st
 
 from models import Visit, DayPlan, WeekPlan
 from config import get_daily_time_budget, HORA_INICIO_DIA, DURACION_VISITA_SEGUNDOS
 from route_optimizer import RouteOptimizer
+from distance_matrix import DistanceMatrix
+import window_heuristics
+
+# Separación entre días en el máximo acumulado de calculate_plan_with_hours (segundos)
+_DESPLAZAMIENTO_DIA = 10 ** 12
 
 
 class PlanManager:
@@ -77,6 +83,28 @@ class PlanManager:
         if 'plan_manual' not in st.session_state:
             st.session_state.plan_manual = {}
 
+    def use_week_matrix(self, inicio_semana: date) -> DistanceMatrix:
+        """
+        Activa en el optimizador la matriz de distancias de una semana de planificación
+
+        La matriz se guarda en session_state por semana y se amplía de forma
+        incremental: al añadir una visita solo se resuelven sus pares con las
+        direcciones que ya contiene.
+
+        Args:
+            inicio_semana: Lunes de la semana que se planifica
+
+        Returns:
+            DistanceMatrix de la semana
+        """
+        matrices = st.session_state.setdefault('matrices_semana', {})
+        semana_iso = inicio_semana.isoformat()
+        if semana_iso not in matrices:
+            matrices[semana_iso] = DistanceMatrix()
+
+        self.optimizer.matrix = matrices[semana_iso]
+        return self.optimizer.matrix
+
     # ==================== CONVERSIONS ====================
 
     def extract_visits_from_day(self, day_data: any) -> List[dict]:
@@ -130,47 +158,56 @@ class PlanManager:
         """
         Calcula las horas de llegada para cada visita del plan
 
+        Los tramos de todos los días salen de la matriz compartida en una sola
+        consulta y las llegadas son una suma acumulada por día. Si se llega a
+        una visita antes de que abra su 'franja_horaria' se espera: la hora
+        de cada visita es el máximo acumulado, dentro de su día, de "apertura
+        de una visita anterior + lo que se tarda desde ella". La hora se
+        escribe en 'hora_asignada' de las propias visitas, sin copiarlas.
+
         Args:
             plan: Plan en formato legacy
 
         Returns:
-            Plan con horas calculadas
+            Plan con horas calculadas {fecha_iso: [visitas]}
         """
-        plan_con_horas = {}
-
-        for day_iso, datos_dia in plan.items():
-            day = date.fromisoformat(day_iso)
-            hora_actual = datetime.combine(day, HORA_INICIO_DIA)
-            visitas_con_hora = []
-
-            # Extraer visitas
-            visitas = self.extract_visits_from_day(datos_dia)
-
-            if visitas:
-                # Primera visita
-                v_primera = visitas[0].copy()
-                v_primera['hora_asignada'] = hora_actual.strftime('%H:%M')
-                visitas_con_hora.append(v_primera)
-
-                # Resto de visitas
-                for i in range(len(visitas) - 1):
-                    hora_actual += timedelta(seconds=DURACION_VISITA_SEGUNDOS)
-                    origen = visitas[i]['direccion_texto']
-                    destino = visitas[i+1]['direccion_texto']
-
-                    _, tiempo_viaje = self.optimizer.get_distance_duration(origen, destino)
-                    if tiempo_viaje:
-                        hora_actual += timedelta(seconds=tiempo_viaje)
-                    else:
-                        hora_actual += timedelta(minutes=30)  # Fallback
-
-                    v_siguiente = visitas[i+1].copy()
-                    v_siguiente['hora_asignada'] = hora_actual.strftime('%H:%M')
-                    visitas_con_hora.append(v_siguiente)
-
-            plan_con_horas[day_iso] = visitas_con_hora
-
-        return plan_con_horas
+        dias = {day_iso: self.extract_visits_from_day(datos_dia) for day_iso, datos_dia in plan.items()}
+        visitas = [v for visitas_dia in dias.values() for v in visitas_dia]
+
+        if visitas:
+            # Tramos consecutivos de todos los días (30 min si un par no se pudo resolver)
+            indices = np.concatenate(self.optimizer.ensure_legs([
+                [v['direccion_texto'] for v in visitas_dia] for visitas_dia in dias.values()
+            ]))
+            tramos = self.optimizer.matrix.leg_times(indices).astype(np.int64)
+
+            # Incremento de cada visita respecto a la anterior; 0 en la primera de cada día
+            longitudes = np.array([len(visitas_dia) for visitas_dia in dias.values()])
+            inicios = np.cumsum(longitudes) - longitudes
+            incrementos = np.zeros(len(visitas), dtype=np.int64)
+            incrementos[1:] = tramos + DURACION_VISITA_SEGUNDOS
+            incrementos[inicios[longitudes > 0]] = 0
+
+            acumulado = np.cumsum(incrementos)
+
+            # Hora mínima de inicio de cada visita: el inicio del día o la apertura de su franja
+            inicio_dia = HORA_INICIO_DIA.hour * 3600 + HORA_INICIO_DIA.minute * 60 + HORA_INICIO_DIA.second
+            aperturas = np.array([
+                (window_heuristics.parse_franja(v.get('franja_horaria')) or (inicio_dia,))[0] for v in visitas
+            ], dtype=np.int64)
+            aperturas = np.maximum(aperturas, inicio_dia)
+
+            # Máximo acumulado por día (el desplazamiento por día impide arrastrarlo al siguiente)
+            desplazamiento = np.repeat(np.arange(len(longitudes[longitudes > 0]), dtype=np.int64),
+                                       longitudes[longitudes > 0]) * _DESPLAZAMIENTO_DIA
+            llegadas = acumulado + np.maximum.accumulate(aperturas - acumulado + desplazamiento) - desplazamiento
+
+            horas = (llegadas // 3600) % 24
+            minutos = (llegadas // 60) % 60
+            for visita, hora, minuto in zip(visitas, horas.tolist(), minutos.tolist()):
+                visita['hora_asignada'] = f'{hora:02d}:{minuto:02d}'
+
+        return {day_iso: list(visitas_dia) for day_iso, visitas_dia in dias.items()}
 
     def calculate_day_time(self, visits: List[dict]) -> int:
         """
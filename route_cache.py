@@ -0,0 +1,166 @@
+"""
+Caché en memoria de rutas compartido por todo el proceso
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import streamlit as st
+
+from config import CACHE_TTL_DIAS, CACHE_MEMORIA_MAX_RUTAS, PAIS_POR_DEFECTO
+
+
+def _sin_acentos(texto: str) -> str:
+    """Elimina tildes y diacríticos (ç → c, ñ → n)"""
+    return ''.join(
+        c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)
+    )
+
+
+# Formas en que puede aparecer el país al final de una dirección
+_ALIAS_PAIS = ('espana', 'spain', 'espanya')
+_PAIS_CANONICO = _sin_acentos(PAIS_POR_DEFECTO).casefold()
+
+
+@lru_cache(maxsize=8192)
+def normalize_location(texto: str) -> str:
+    """
+    Normaliza una dirección para usarla como clave de caché
+
+    Recorta y colapsa espacios, pasa a minúsculas, elimina acentos y añade el
+    país por defecto si no aparece: "Girona ", "girona" y "Girona, España"
+    producen la misma clave.
+
+    Args:
+        texto: Dirección tal como la introdujo el usuario
+
+    Returns:
+        Dirección canónica (ej: "girona, espana")
+    """
+    if not texto:
+        return ''
+
+    canonica = re.sub(r'\s+', ' ', _sin_acentos(texto).casefold()).strip()
+    canonica = re.sub(r'\s*,\s*', ', ', canonica).strip(', ')
+
+    partes = canonica.rsplit(', ', 1)
+    if len(partes) == 2 and partes[1] in _ALIAS_PAIS:
+        canonica = partes[0]
+
+    return f"{canonica}, {_PAIS_CANONICO}" if canonica else ''
+
+
+def route_pair_key(origen: str, destino: str) -> Tuple[str, str]:
+    """
+    Clave no dirigida de un par de direcciones
+
+    El modelo de conducción se asume simétrico, así que A→B y B→A comparten
+    clave. La tupla está ordenada: (min, max) de las direcciones canónicas.
+    """
+    a = normalize_location(origen)
+    b = normalize_location(destino)
+    return (a, b) if a <= b else (b, a)
+
+
+class RouteMemoryCache:
+    """
+    Caché LRU con TTL, seguro entre hilos, delante de la tabla rutas_cache
+
+    Las claves son pares (origen, destino); RouteOptimizer usa route_pair_key.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MEMORIA_MAX_RUTAS, ttl_dias: int = CACHE_TTL_DIAS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_dias * 24 * 3600
+        self._entries = OrderedDict()  # (origen, destino) -> (distancia, duracion, expira_en)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, origen: str, destino: str) -> Optional[Tuple[int, int]]:
+        """
+        Recupera una ruta si está en memoria y no ha caducado
+
+        Returns:
+            Tupla (distancia_metros, duracion_segundos) o None
+        """
+        key = (origen, destino)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            distancia, duracion, expira_en = entry
+            if expira_en <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return distancia, duracion
+
+    def put(self, origen: str, destino: str, distancia: int, duracion: int, fecha_calculo=None):
+        """
+        Guarda una ruta en memoria, expulsando la menos usada si está lleno
+
+        Args:
+            fecha_calculo: Fecha de cálculo de la ruta (datetime o ISO); si se
+                indica, la entrada caduca a la vez que la fila de Supabase
+        """
+        expira_en = self._calculation_timestamp(fecha_calculo) + self.ttl_seconds
+        if expira_en <= time.time():
+            return
+
+        key = (origen, destino)
+        with self._lock:
+            self._entries[key] = (distancia, duracion, expira_en)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Vacía la caché y reinicia los contadores"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Devuelve aciertos, fallos, tamaño y tasa de acierto"""
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.hits / consultas if consultas else 0.0
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _calculation_timestamp(fecha_calculo) -> float:
+        """Convierte la fecha de cálculo a timestamp (ahora si no se conoce)"""
+        if fecha_calculo is None:
+            return time.time()
+        try:
+            if isinstance(fecha_calculo, str):
+                fecha_calculo = datetime.fromisoformat(fecha_calculo)
+            return fecha_calculo.timestamp()
+        except (TypeError, ValueError):
+            return time.time()
+
+
+@st.cache_resource
+def get_route_memory_cache() -> RouteMemoryCache:
+    """Devuelve la caché de rutas en memoria compartida por todas las sesiones"""
+    return RouteMemoryCache()
@@ -0,0 +1,601 @@
+"""
+Algoritmos de construcción y mejora de rutas sobre matrices de tiempos en memoria
+
+Las rutas son caminos abiertos: empiezan en route[0] (fijo) y terminan en la
+última visita, sin viaje de vuelta. Con closed=True se cuenta además la vuelta
+de la última visita a route[0] (p. ej. regresar al punto de partida). Las
+matrices se asumen simétricas, como las proporciona DistanceMatrix.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from config import (
+    NUM_VECINOS_2OPT, MAX_ITERACIONES_2OPT, MAX_SEGMENTO_OR_OPT, MAX_RUTAS_EXACTAS_MEMORIA,
+    LIMITE_VISITAS_EXACTO, LIMITE_VISITAS_2OPT, BUSQUEDA_LOCAL_RUTA, TIEMPO_MAX_BUSQUEDA_LOCAL_MS,
+    TIEMPO_MAX_OPTIMIZACION_MS
+)
+
+# Rutas exactas ya resueltas: huella de la matriz -> ruta óptima
+_exact_routes = OrderedDict()
+_exact_routes_lock = threading.Lock()
+
+
+def route_travel_time(route, time_matrix, closed=False):
+    """Suma los tiempos de viaje entre visitas consecutivas de la ruta (y la vuelta si closed)"""
+    total = sum(time_matrix[route[i]][route[i + 1]] for i in range(len(route) - 1))
+    if closed and len(route) > 1:
+        total += time_matrix[route[-1]][route[0]]
+    return total
+
+
+def nearest_neighbor(time_matrix, start=0):
+    """
+    Construye una ruta visitando siempre el punto más cercano al actual
+
+    Args:
+        time_matrix: Matriz de tiempos (lista de listas)
+        start: Índice del punto de partida
+
+    Returns:
+        Lista de índices
+    """
+    n = len(time_matrix)
+    if n == 0:
+        return []
+
+    unvisited = set(range(n))
+    unvisited.remove(start)
+    route = [start]
+    current = start
+
+    while unvisited:
+        fila = time_matrix[current]
+        current = min(unvisited, key=fila.__getitem__)
+        route.append(current)
+        unvisited.remove(current)
+
+    return route
+
+
+def _neighbors_in_route(route, time_matrix, k):
+    """Listas de k vecinos restringidas a los puntos de la ruta"""
+    return {
+        a: sorted((c for c in route if c != a), key=time_matrix[a].__getitem__)[:k]
+        for a in route
+    }
+
+
+def two_opt(route, time_matrix, k=NUM_VECINOS_2OPT, max_moves=None, deadline=None, closed=False):
+    """
+    2-opt con evaluación delta, listas de vecinos y bits "don't look"
+
+    Cada movimiento (invertir un tramo) se evalúa en O(1) con las cuatro aristas
+    afectadas, ya que en una matriz simétrica el interior del tramo no cambia de
+    coste. Solo se prueban movimientos que acercan un punto a uno de sus k
+    vecinos más cercanos, y los puntos sin mejora posible se desactivan hasta
+    que un movimiento toque alguna de sus aristas.
+
+    El final abierto de la ruta se modela con un nodo ficticio a coste 0 de
+    todos los puntos, de modo que también se prueba cambiar la última visita.
+    En rutas cerradas el nodo ficticio es una copia de route[0].
+
+    Args:
+        route: Ruta inicial (lista de índices); route[0] se mantiene fijo
+        time_matrix: Matriz de tiempos simétrica
+        k: Tamaño de las listas de vecinos
+        max_moves: Máximo de movimientos de mejora a aplicar (None = sin límite)
+        deadline: Instante (time.perf_counter) a partir del cual se detiene
+        closed: Si True, cuenta la vuelta de la última visita a route[0]
+
+    Returns:
+        Ruta mejorada (nueva lista)
+    """
+    n = len(route)
+    if n < 3:
+        return route[:]
+
+    # Matriz extendida con el nodo ficticio de final de ruta
+    fin = len(time_matrix)
+    inicio = route[0]
+    d = [list(fila) + [fila[inicio] if closed else 0] for fila in time_matrix]
+    d.append([fila[fin] for fila in d] + [0])
+
+    tour = route + [fin]
+    pos = {ciudad: idx for idx, ciudad in enumerate(tour)}
+
+    # Vecinos de cada punto de la ruta (el nodo ficticio siempre es candidato)
+    vecinos = {a: [fin] + cercanos for a, cercanos in _neighbors_in_route(route, d, k).items()}
+
+    def invertir(i, j):
+        tour[i:j + 1] = tour[i:j + 1][::-1]
+        for idx in range(i, j + 1):
+            pos[tour[idx]] = idx
+
+    activos = deque(route)
+    en_cola = set(route)
+    movimientos = 0
+
+    while activos:
+        if max_moves is not None and movimientos >= max_moves:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+        a = activos.popleft()
+        en_cola.discard(a)
+        mejorado = False
+
+        # Caso 1: reconectar a con el vecino c a través de su arista siguiente
+        pa = pos[a]
+        sa = tour[pa + 1]
+        d_a_sa = d[a][sa]
+        for c in vecinos[a]:
+            if c == fin or c == sa:
+                continue
+            ganancia = d_a_sa - d[a][c]
+            if ganancia <= 0:
+                break
+            pc = pos[c]
+            sc = tour[pc + 1]
+            delta = d[a][c] + d[sa][sc] - d_a_sa - d[c][sc]
+            if delta < 0:
+                if pa < pc:
+                    invertir(pa + 1, pc)
+                else:
+                    invertir(pc + 1, pa)
+                extremos = (a, sa, c, sc)
+                mejorado = True
+                break
+
+        # Caso 2: reconectar a con el vecino c a través de su arista anterior
+        if not mejorado and pa > 0:
+            prev_a = tour[pa - 1]
+            d_pa_a = d[prev_a][a]
+            for c in vecinos[a]:
+                if c == prev_a:
+                    continue
+                ganancia = d_pa_a - d[c][a]
+                if ganancia <= 0:
+                    if c == fin:
+                        continue
+                    break
+                pc = pos[c]
+                if pc == 0:
+                    continue
+                prev_c = tour[pc - 1]
+                delta = d[c][a] + d[prev_a][prev_c] - d_pa_a - d[prev_c][c]
+                if delta < 0:
+                    if pc < pa:
+                        invertir(pc, pa - 1)
+                    else:
+                        invertir(pa, pc - 1)
+                    extremos = (a, prev_a, c, prev_c)
+                    mejorado = True
+                    break
+
+        if mejorado:
+            movimientos += 1
+            # Reactivar los extremos de las aristas modificadas
+            for ciudad in extremos:
+                if ciudad != fin and ciudad not in en_cola:
+                    activos.append(ciudad)
+                    en_cola.add(ciudad)
+
+    return tour[:-1]
+
+
+def or_opt(route, time_matrix, max_segment=MAX_SEGMENTO_OR_OPT, k=NUM_VECINOS_2OPT, deadline=None, closed=False):
+    """
+    Or-opt: recoloca tramos de 1 a max_segment visitas (opcionalmente invertidos)
+
+    Con tramos de longitud 1 equivale al movimiento "relocate". Cada
+    recolocación se evalúa en O(1) con las tres aristas que se quitan y las
+    tres que se añaden, y solo se prueba insertar el tramo junto a uno de los
+    k vecinos más cercanos de sus extremos.
+
+    Args:
+        route: Ruta (lista de índices); route[0] se mantiene fijo
+        time_matrix: Matriz de tiempos simétrica
+        max_segment: Longitud máxima del tramo a mover
+        k: Tamaño de las listas de vecinos
+        deadline: Instante (time.perf_counter) a partir del cual se detiene
+        closed: Si True, cuenta la vuelta de la última visita a route[0]
+
+    Returns:
+        Ruta mejorada (nueva lista)
+    """
+    route = route[:]
+    n = len(route)
+    if n < 3:
+        return route
+
+    d = time_matrix
+    vecinos = _neighbors_in_route(route, d, k)
+    pos = {c: idx for idx, c in enumerate(route)}
+    inicio = route[0]
+
+    def vuelta(c):
+        """Coste de terminar la ruta en c"""
+        return d[c][inicio] if closed else 0
+
+    mejorado = True
+
+    while mejorado:
+        mejorado = False
+        for longitud in range(1, max_segment + 1):
+            i = 1
+            while i + longitud <= n:
+                if deadline is not None and time.perf_counter() > deadline:
+                    return route
+
+                s0 = route[i]
+                s_fin = route[i + longitud - 1]
+                prev = route[i - 1]
+                sig = route[i + longitud] if i + longitud < n else None
+
+                # Ahorro por quitar el tramo y unir prev con sig (o terminar en prev)
+                ahorro = d[prev][s0]
+                if sig is not None:
+                    ahorro += d[s_fin][sig] - d[prev][sig]
+                else:
+                    ahorro += vuelta(s_fin) - vuelta(prev)
+
+                # Posiciones candidatas: junto a los vecinos de los extremos del tramo
+                candidatas = set()
+                for c in vecinos[s0] + vecinos[s_fin]:
+                    j = pos[c]
+                    candidatas.add(j)      # insertar tras c
+                    candidatas.add(j - 1)  # insertar antes de c
+
+                mejor_delta, mejor_j, mejor_invertido = 0, None, False
+                for j in candidatas:
+                    if j < 0 or i - 1 <= j <= i + longitud - 1:
+                        continue
+                    a = route[j]
+                    b = route[j + 1] if j + 1 < n else None
+                    base = -d[a][b] if b is not None else -vuelta(a)
+                    directo = d[a][s0] + (d[s_fin][b] if b is not None else vuelta(s_fin)) + base
+                    invertido = d[a][s_fin] + (d[s0][b] if b is not None else vuelta(s0)) + base
+                    for coste, es_invertido in ((directo, False), (invertido, True)):
+                        delta = coste - ahorro
+                        if delta < mejor_delta:
+                            mejor_delta, mejor_j, mejor_invertido = delta, j, es_invertido
+
+                if mejor_j is not None:
+                    tramo = route[i:i + longitud]
+                    if mejor_invertido:
+                        tramo.reverse()
+                    resto = route[:i] + route[i + longitud:]
+                    destino = mejor_j if mejor_j < i else mejor_j - longitud
+                    route = resto[:destino + 1] + tramo + resto[destino + 1:]
+                    pos = {c: idx for idx, c in enumerate(route)}
+                    mejorado = True
+                i += 1
+
+    return route
+
+
+def swap(route, time_matrix, k=NUM_VECINOS_2OPT, deadline=None, closed=False):
+    """
+    Intercambia pares de visitas cuando acorta la ruta
+
+    Solo se prueban intercambios que dejan una visita junto a uno de sus k
+    vecinos más cercanos; cada intercambio se evalúa en O(1) con las aristas
+    afectadas.
+
+    Args:
+        route: Ruta (lista de índices); route[0] se mantiene fijo
+        time_matrix: Matriz de tiempos simétrica
+        k: Tamaño de las listas de vecinos
+        deadline: Instante (time.perf_counter) a partir del cual se detiene
+        closed: Si True, cuenta la vuelta de la última visita a route[0]
+
+    Returns:
+        Ruta mejorada (nueva lista)
+    """
+    route = route[:]
+    n = len(route)
+    if n < 3:
+        return route
+
+    d = time_matrix
+    vecinos = _neighbors_in_route(route, d, k)
+    pos = {c: idx for idx, c in enumerate(route)}
+
+    def delta_swap(i, j):
+        aristas = {e for e in (i - 1, i, j - 1, j) if 0 <= e < n - 1}
+
+        def en(idx):
+            return route[j] if idx == i else route[i] if idx == j else route[idx]
+
+        antes = sum(d[route[e]][route[e + 1]] for e in aristas)
+        despues = sum(d[en(e)][en(e + 1)] for e in aristas)
+        if closed and j == n - 1:
+            # La última visita cambia: también cambia la vuelta a route[0]
+            antes += d[route[j]][route[0]]
+            despues += d[route[i]][route[0]]
+        return despues - antes
+
+    mejorado = True
+    while mejorado:
+        mejorado = False
+        for i in range(1, n):
+            if deadline is not None and time.perf_counter() > deadline:
+                return route
+
+            a = route[i]
+            for c in vecinos[a]:
+                # Poner a junto a c: intercambiarla con el anterior o el siguiente de c
+                for j in (pos[c] - 1, pos[c] + 1):
+                    if j < 1 or j >= n or j == i:
+                        continue
+                    if delta_swap(min(i, j), max(i, j)) < 0:
+                        route[i], route[j] = route[j], route[i]
+                        pos[route[i]] = i
+                        pos[route[j]] = j
+                        mejorado = True
+                        break
+                if route[i] != a:
+                    break
+
+    return route
+
+
+# Movimientos de búsqueda local disponibles para improve_route
+LOCAL_SEARCH_MOVES = {
+    'two_opt': lambda route, tm, deadline, closed=False: two_opt(
+        route, tm, max_moves=MAX_ITERACIONES_2OPT * len(route), deadline=deadline, closed=closed
+    ),
+    'or_opt': lambda route, tm, deadline, closed=False: or_opt(route, tm, deadline=deadline, closed=closed),
+    'swap': lambda route, tm, deadline, closed=False: swap(route, tm, deadline=deadline, closed=closed),
+}
+
+
+def improve_route(route, time_matrix, moves=('two_opt', 'or_opt'), time_budget_ms=None, closed=False):
+    """
+    Encadena movimientos de búsqueda local hasta que ninguno mejora
+
+    Args:
+        route: Ruta inicial (lista de índices)
+        time_matrix: Matriz de tiempos simétrica
+        moves: Nombres de movimientos de LOCAL_SEARCH_MOVES, en orden
+        time_budget_ms: Tiempo máximo en milisegundos (None = sin límite)
+        closed: Si True, cuenta la vuelta de la última visita a route[0]
+
+    Returns:
+        Ruta mejorada (nueva lista)
+    """
+    deadline = time.perf_counter() + time_budget_ms / 1000 if time_budget_ms is not None else None
+    mejor = route[:]
+    mejor_tiempo = route_travel_time(mejor, time_matrix, closed)
+
+    while True:
+        tiempo_ronda = mejor_tiempo
+        for nombre in moves:
+            candidata = LOCAL_SEARCH_MOVES[nombre](mejor, time_matrix, deadline, closed)
+            tiempo = route_travel_time(candidata, time_matrix, closed)
+            if tiempo < mejor_tiempo:
+                mejor, mejor_tiempo = candidata, tiempo
+
+        if mejor_tiempo >= tiempo_ronda:
+            break
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+
+    return mejor
+
+
+def perturb(route, rng):
+    """
+    Perturbación "double bridge": corta la ruta en cuatro tramos A B C D y los
+    reordena como A C B D, un cambio que la búsqueda local no deshace con un
+    solo movimiento. Las rutas cortas invierten un tramo al azar. route[0] no
+    se mueve.
+
+    Args:
+        route: Ruta (lista de índices)
+        rng: Generador random.Random
+
+    Returns:
+        Ruta perturbada (nueva lista)
+    """
+    n = len(route)
+    if n < 3:
+        return route[:]
+    if n < 5:
+        i, j = sorted(rng.sample(range(1, n), 2))
+        return route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+
+    a, b, c = sorted(rng.sample(range(1, n), 3))
+    return route[:a] + route[b:c] + route[a:b] + route[c:]
+
+
+def iterated_local_search(route, time_matrix, moves=('two_opt', 'or_opt'), time_budget_ms=1000,
+                          closed=False, seed=0, progress=None):
+    """
+    Búsqueda local iterada "anytime"
+
+    Mejora la ruta con improve_route y, mientras quede presupuesto, perturba
+    la mejor ruta encontrada y la vuelve a mejorar, quedándose con el
+    resultado si no empeora. Al agotarse el tiempo devuelve la mejor ruta
+    hasta el momento, así que la latencia no depende del tamaño de la ruta.
+
+    Args:
+        route: Ruta inicial (lista de índices); route[0] se mantiene fijo
+        time_matrix: Matriz de tiempos simétrica
+        moves: Nombres de movimientos de LOCAL_SEARCH_MOVES, en orden
+        time_budget_ms: Tiempo total en milisegundos
+        closed: Si True, cuenta la vuelta de la última visita a route[0]
+        seed: Semilla de las perturbaciones (mismo resultado con el mismo tiempo)
+        progress: Función progress(fraccion, mensaje) llamada al avanzar
+
+    Returns:
+        Mejor ruta encontrada (nueva lista)
+    """
+    inicio = time.perf_counter()
+    deadline = inicio + time_budget_ms / 1000
+    rng = random.Random(seed)
+    ultimo_aviso = -1.0
+
+    def avisar(mensaje):
+        nonlocal ultimo_aviso
+        if progress is None:
+            return
+        fraccion = min(1.0, (time.perf_counter() - inicio) * 1000 / time_budget_ms) if time_budget_ms > 0 else 1.0
+        # Limitar avisos: uno por cada 2% de avance
+        if fraccion - ultimo_aviso >= 0.02 or fraccion >= 1.0:
+            ultimo_aviso = fraccion
+            progress(fraccion, mensaje)
+
+    mejor = improve_route(route, time_matrix, moves, time_budget_ms, closed)
+    mejor_tiempo = route_travel_time(mejor, time_matrix, closed)
+    avisar("Búsqueda local completada")
+
+    iteracion = 0
+    while len(mejor) > 3 and time.perf_counter() < deadline:
+        restante_ms = (deadline - time.perf_counter()) * 1000
+        candidata = improve_route(perturb(mejor, rng), time_matrix, moves, restante_ms, closed)
+        tiempo = route_travel_time(candidata, time_matrix, closed)
+        if tiempo <= mejor_tiempo:
+            mejor, mejor_tiempo = candidata, tiempo
+        iteracion += 1
+        avisar(f"Perturbación {iteracion}: {mejor_tiempo // 60} min de viaje")
+
+    return mejor
+
+
+def matrix_fingerprint(time_matrix):
+    """Huella del contenido de una matriz de tiempos (para memoizar resultados)"""
+    matriz = np.ascontiguousarray(time_matrix, dtype=np.int64)
+    return hashlib.blake2b(
+        matriz.tobytes() + str(matriz.shape).encode(), digest_size=16
+    ).hexdigest()
+
+
+def held_karp(time_matrix, closed=False):
+    """
+    Ruta óptima exacta por programación dinámica sobre subconjuntos (Held-Karp)
+
+    Resuelve el camino abierto más corto que empieza en el punto 0 y recorre
+    todos los demás (o el circuito que vuelve a 0 si closed). Las tablas son arrays de NumPy de 2^(n-1) × (n-1) y cada
+    subconjunto se expande de forma vectorizada, así que es práctico hasta unas
+    15 visitas. Los resultados se memorizan por la huella de la matriz.
+
+    Args:
+        time_matrix: Matriz de tiempos (lista de listas o array)
+        closed: Si True, cuenta la vuelta de la última visita a 0
+
+    Returns:
+        Lista de índices de la ruta óptima, empezando en 0
+    """
+    n = len(time_matrix)
+    if n <= 2:
+        return list(range(n))
+
+    huella = (matrix_fingerprint(time_matrix), closed)
+    with _exact_routes_lock:
+        if huella in _exact_routes:
+            _exact_routes.move_to_end(huella)
+            return list(_exact_routes[huella])
+
+    matriz = np.asarray(time_matrix, dtype=np.int64)
+    m = n - 1
+    desde_inicio = matriz[0, 1:]
+    entre_visitas = matriz[1:, 1:]
+    bits = 1 << np.arange(m)
+    columnas = np.arange(m)
+
+    # coste[mask, k]: mejor camino desde 0 que visita mask y termina en k
+    infinito = np.iinfo(np.int64).max // 4
+    coste = np.full((1 << m, m), infinito, dtype=np.int64)
+    anterior = np.full((1 << m, m), -1, dtype=np.int16)
+    coste[bits, columnas] = desde_inicio
+
+    for mask in range(1, 1 << m):
+        fuera = columnas[(mask & bits) == 0]
+        if fuera.size == 0:
+            continue
+        # Mejor último punto j de mask para llegar a cada k fuera de mask
+        candidatos = coste[mask][:, None] + entre_visitas[:, fuera]
+        mejor_j = candidatos.argmin(axis=0)
+        coste[mask | bits[fuera], fuera] = candidatos[mejor_j, np.arange(fuera.size)]
+        anterior[mask | bits[fuera], fuera] = mejor_j
+
+    # Reconstruir desde el mejor punto final (sumando la vuelta a 0 si es un circuito)
+    mask = (1 << m) - 1
+    finales = coste[mask] + matriz[1:, 0] if closed else coste[mask]
+    k = int(finales.argmin())
+    inversa = []
+    while k >= 0:
+        inversa.append(k + 1)
+        k, mask = int(anterior[mask, k]), mask & ~(1 << k)
+    route = [0] + inversa[::-1]
+
+    with _exact_routes_lock:
+        _exact_routes[huella] = tuple(route)
+        while len(_exact_routes) > MAX_RUTAS_EXACTAS_MEMORIA:
+            _exact_routes.popitem(last=False)
+
+    return route
+
+
+def solve_route(time_matrix, local_search=None, time_budget_ms=None, closed=False, anytime=False, progress=None):
+    """
+    Ruta exacta (Held-Karp) hasta LIMITE_VISITAS_EXACTO puntos; Nearest
+    Neighbor + búsqueda local por encima
+
+    Args:
+        time_matrix: Matriz de tiempos (lista de listas); el punto 0 es el inicio fijo
+        local_search: Movimientos a encadenar ('two_opt', 'or_opt', 'swap');
+            None usa BUSQUEDA_LOCAL_RUTA
+        time_budget_ms: Tiempo máximo de la búsqueda local (del total en modo
+            anytime); None usa TIEMPO_MAX_BUSQUEDA_LOCAL_MS / TIEMPO_MAX_OPTIMIZACION_MS
+        closed: Si True, cuenta la vuelta de la última visita a 0
+        anytime: Si True, sigue mejorando con perturbaciones hasta agotar
+            time_budget_ms, sea cual sea el tamaño de la ruta
+        progress: Función progress(fraccion, mensaje)
+
+    Returns:
+        Lista de índices de la ruta, empezando en 0
+    """
+    inicio = time.perf_counter()
+    moves = BUSQUEDA_LOCAL_RUTA if local_search is None else local_search
+
+    # Rutas pequeñas: ruta óptima exacta
+    if len(time_matrix) <= LIMITE_VISITAS_EXACTO:
+        route = held_karp(time_matrix, closed)
+        if progress:
+            progress(1.0, "Ruta óptima calculada")
+        return route
+
+    route = nearest_neighbor(time_matrix, start=0)
+
+    if anytime:
+        # Búsqueda local y perturbaciones con el tiempo que quede del presupuesto
+        presupuesto = TIEMPO_MAX_OPTIMIZACION_MS if time_budget_ms is None else time_budget_ms
+        return iterated_local_search(
+            route,
+            time_matrix,
+            moves=moves,
+            time_budget_ms=max(0, presupuesto - (time.perf_counter() - inicio) * 1000),
+            closed=closed,
+            progress=progress
+        )
+
+    # Mejorar con búsqueda local SOLO para rutas pequeñas/medianas
+    # Para rutas grandes, Nearest Neighbor es suficiente y mucho más rápido
+    if 3 < len(route) <= LIMITE_VISITAS_2OPT:
+        route = improve_route(
+            route,
+            time_matrix,
+            moves=moves,
+            time_budget_ms=TIEMPO_MAX_BUSQUEDA_LOCAL_MS if time_budget_ms is None else time_budget_ms,
+            closed=closed
+        )
+
+    return route
@@ -1,261 +1,862 @@
 # Fichero: route_optimizer.py - Optimización de rutas eficiente con caché
+import atexit
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from itertools import combinations
 import googlemaps
+import numpy as np
 from datetime import datetime, timedelta
 from database import supabase
 import streamlit as st
+import plan_heuristics
+import route_heuristics
+import window_heuristics
+from cluster_heuristics import capacitated_kmeans, has_coordinates, to_plane
+from distance_matrix import DistanceMatrix
+from route_cache import get_route_memory_cache, normalize_location, route_pair_key
 from config import (
-    CACHE_TTL_DIAS, GOOGLE_MAPS_CHUNK_SIZE,
-    LIMITE_VISITAS_2OPT, MAX_ITERACIONES_2OPT
+    CACHE_TTL_DIAS, GOOGLE_MAPS_CHUNK_SIZE, GOOGLE_MAPS_MAX_ELEMENTOS,
+    LIMITE_VISITAS_2OPT, NUM_VECINOS_2OPT, TIEMPO_MAX_OPTIMIZACION_MS, TIEMPO_MAX_LNS_MS,
+    CACHE_BULK_MAX_UBICACIONES, CACHE_BULK_MAX_CARACTERES, CACHE_BULK_PAGINA,
+    CACHE_FLUSH_UMBRAL, CACHE_DIAS_MAX,
+    TIEMPO_TRAMO_ESTIMADO_CLUSTER_SEG,
+    DIAS_CANDIDATOS_REINSERCION, FACTOR_CANDIDATAS_CLUSTER, LOTE_REINSERCION_CLUSTER,
+    HORA_INICIO_DIA, TIEMPO_MAX_RECOMENDAR_DIAS_MS
 )
 
+# Optimizadores con escrituras de caché pendientes (se vacían al salir del proceso)
+_optimizers_con_pendientes = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all_pending_routes():
+    """Vuelca al caché las rutas pendientes de todos los optimizadores vivos"""
+    for optimizer in list(_optimizers_con_pendientes):
+        optimizer.flush_route_cache()
+
+
+def plan_matrix_tiles(pairs, max_filas=GOOGLE_MAPS_CHUNK_SIZE, max_elementos=GOOGLE_MAPS_MAX_ELEMENTOS):
+    """
+    Agrupa pares (i, j) pendientes en bloques origen×destino densos
+
+    Cada bloque cumple los límites de la Distance Matrix API (máximo de orígenes,
+    de destinos y de elementos por petición) y solo contiene pares pendientes,
+    de modo que todos los elementos devueltos se aprovechan. Los pares se tratan
+    como no dirigidos: (i, j) se cubre también con el elemento j→i.
+
+    Args:
+        pairs: Iterable de pares de índices (i, j)
+        max_filas: Máximo de orígenes y de destinos por petición
+        max_elementos: Máximo de elementos (orígenes × destinos) por petición
+
+    Returns:
+        Lista de tuplas (origenes, destinos) con listas de índices
+    """
+    vecinos = {}
+    for i, j in pairs:
+        if i == j:
+            continue
+        vecinos.setdefault(i, set()).add(j)
+        vecinos.setdefault(j, set()).add(i)
+
+    tiles = []
+    while vecinos:
+        # Pivote: el índice con más pares pendientes
+        pivote = max(vecinos, key=lambda k: (len(vecinos[k]), -k))
+        destinos = set(sorted(vecinos[pivote])[:min(max_filas, max_elementos)])
+        origenes = [pivote]
+
+        # Añadir orígenes que comparten destinos pendientes mientras crezca el bloque
+        candidatos = sorted(
+            (v for v in vecinos if v != pivote and v not in destinos),
+            key=lambda v: (-len(vecinos[v] & destinos), v)
+        )
+        for v in candidatos:
+            alto = len(origenes) + 1
+            if alto > max_filas:
+                break
+            comunes = vecinos[v] & destinos
+            ancho = min(len(comunes), max_filas, max_elementos // alto)
+            if alto * ancho > len(origenes) * len(destinos):
+                origenes.append(v)
+                destinos = set(sorted(comunes)[:ancho])
+
+        destinos = sorted(destinos)
+        tiles.append((origenes, destinos))
+
+        # Marcar los pares del bloque como cubiertos
+        for i in origenes:
+            for j in destinos:
+                vecinos[i].discard(j)
+                vecinos[j].discard(i)
+        for k in [k for k, v in vecinos.items() if not v]:
+            del vecinos[k]
+
+    return tiles
+
+
+def day_fingerprint(visitas, duracion_visita_seg, local_search=None, time_budget_ms=None,
+                    depot=None, return_to_depot=False, anytime=False, time_windows=False):
+    """
+    Huella del contenido de un día para memorizar cálculos sobre él
+
+    Incluye el id y la dirección canónica de cada visita en orden (la
+    primera visita es el inicio fijo de la ruta si no hay punto de partida),
+    y su franja horaria si se respetan franjas, así que cambiar una
+    dirección o una franja produce otra huella y el resultado anterior deja
+    de usarse.
+    """
+    return hashlib.blake2b(repr((
+        tuple(
+            (str(v.get('id')), normalize_location(v['direccion_texto']))
+            + ((v.get('franja_horaria'),) if time_windows else ())
+            for v in visitas
+        ),
+        duracion_visita_seg,
+        tuple(local_search) if local_search is not None else None,
+        time_budget_ms,
+        normalize_location(depot) if depot else None,
+        return_to_depot,
+        anytime,
+        time_windows
+    )).encode(), digest_size=16).hexdigest()
+
+
+# Hora de inicio del día en segundos desde medianoche (para las franjas horarias)
+_INICIO_DIA_SEG = HORA_INICIO_DIA.hour * 3600 + HORA_INICIO_DIA.minute * 60 + HORA_INICIO_DIA.second
+
+
 class RouteOptimizer:
-    def __init__(self):
+    def __init__(self, matrix: DistanceMatrix = None):
         self.gmaps = googlemaps.Client(key=st.secrets["google"]["api_key"])
         self.cache_ttl_days = CACHE_TTL_DIAS
+        self.memory_cache = get_route_memory_cache()
+        self._pending_routes = {}
+        self._pending_lock = threading.Lock()
+        self.cache_rows_flushed = 0
+        self.api_requests = 0
+        self.api_elements = 0  # Elementos facturados por la Distance Matrix API
+        # Matriz compartida por los servicios que usan este optimizador
+        self.matrix = matrix if matrix is not None else DistanceMatrix()
+        # Días ya optimizados: huella del contenido -> (orden, tiempo_total)
+        self._day_memo = OrderedDict()
+        self._day_memo_lock = threading.Lock()
     
     def get_route_from_cache(self, origen, destino):
-        """Intenta recuperar una ruta del caché"""
+        """Intenta recuperar una ruta del caché (primero en memoria, luego Supabase)"""
+        key = route_pair_key(origen, destino)
+        en_memoria = self.memory_cache.get(*key)
+        if en_memoria:
+            return en_memoria
+
+        pendiente = self._pending_routes.get(key)
+        if pendiente:
+            return pendiente['distancia_metros'], pendiente['duracion_segundos']
+
         try:
             cutoff_date = (datetime.now() - timedelta(days=self.cache_ttl_days)).isoformat()
-            
-            response = supabase.table('rutas_cache').select('*').eq(
-                'origen', origen
-            ).eq(
-                'destino', destino
+
+            # Claves canónicas y, por compatibilidad, las direcciones tal cual en ambos sentidos
+            candidatas = list(dict.fromkeys([key[0], key[1], origen, destino]))
+            response = supabase.table('rutas_cache').select('*').in_(
+                'origen', candidatas
+            ).in_(
+                'destino', candidatas
             ).gte(
                 'fecha_calculo', cutoff_date
-            ).limit(1).execute()
-            
-            if response.data:
-                return response.data[0]['distancia_metros'], response.data[0]['duracion_segundos']
-            
+            ).limit(CACHE_BULK_PAGINA).execute()
+
+            for row in response.data or []:
+                if (row['distancia_metros'] and row['duracion_segundos'] and
+                        route_pair_key(row['origen'], row['destino']) == key):
+                    self.memory_cache.put(
+                        *key, row['distancia_metros'], row['duracion_segundos'],
+                        row.get('fecha_calculo')
+                    )
+                    return row['distancia_metros'], row['duracion_segundos']
+
             return None, None
         except:
             return None, None
+
+    def _chunk_locations(self, locations):
+        """
+        Divide las ubicaciones en bloques que caben en la URL de un filtro in_
+
+        Cada bloque respeta tanto un máximo de elementos como un máximo de
+        caracteres acumulados, ya que PostgREST recibe el filtro en la query string.
+        """
+        chunks = []
+        actual = []
+        caracteres = 0
+
+        for loc in locations:
+            longitud = len(loc) + 3  # comillas y separador
+            if actual and (len(actual) >= CACHE_BULK_MAX_UBICACIONES or
+                           caracteres + longitud > CACHE_BULK_MAX_CARACTERES):
+                chunks.append(actual)
+                actual = []
+                caracteres = 0
+            actual.append(loc)
+            caracteres += longitud
+
+        if actual:
+            chunks.append(actual)
+
+        return chunks
+
+    def get_routes_from_cache_bulk(self, locations, pares=None):
+        """
+        Recupera del caché todas las rutas entre un conjunto de ubicaciones
+
+        Args:
+            locations: Lista de direcciones
+            pares: Pares (origen, destino) concretos a buscar; None busca todos
+                los pares entre locations. Al ampliar una matriz con una
+                dirección solo se buscan sus pares nuevos, no todos.
+
+        Returns:
+            Dict {route_pair_key: (distancia_metros, duracion_segundos)}
+        """
+        rutas = {}
+        canonicas = {loc: normalize_location(loc) for loc in locations}
+        if pares is None:
+            claves = sorted(set(canonicas.values()))
+            buscadas = {(a, b) for i, a in enumerate(claves) for b in claves[i + 1:]}
+        else:
+            for pair in pares:
+                canonicas.update({loc: normalize_location(loc) for loc in pair})
+            buscadas = {route_pair_key(*pair) for pair in pares}
+            buscadas = {key for key in buscadas if key[0] != key[1]}
+        if not buscadas:
+            return rutas
+
+        # Primero la caché en memoria; solo se consulta Supabase por los pares sin resolver
+        sin_resolver = set()
+        for key in buscadas:
+            en_memoria = self.memory_cache.get(*key)
+            if en_memoria:
+                rutas[key] = en_memoria
+            else:
+                sin_resolver.add(key)
+
+        cutoff_date = (datetime.now() - timedelta(days=self.cache_ttl_days)).isoformat()
+        for origenes, destinos in self._cache_query_blocks(sin_resolver, canonicas):
+            for chunk_origen in self._chunk_locations(origenes):
+                for chunk_destino in self._chunk_locations(destinos):
+                    inicio = 0
+                    try:
+                        while True:
+                            response = supabase.table('rutas_cache').select(
+                                'origen, destino, distancia_metros, duracion_segundos, fecha_calculo'
+                            ).in_(
+                                'origen', chunk_origen
+                            ).in_(
+                                'destino', chunk_destino
+                            ).gte(
+                                'fecha_calculo', cutoff_date
+                            ).range(inicio, inicio + CACHE_BULK_PAGINA - 1).execute()
+
+                            for row in response.data or []:
+                                if row['distancia_metros'] and row['duracion_segundos']:
+                                    key = route_pair_key(row['origen'], row['destino'])
+                                    rutas[key] = (row['distancia_metros'], row['duracion_segundos'])
+                                    self.memory_cache.put(
+                                        *key, row['distancia_metros'], row['duracion_segundos'],
+                                        row.get('fecha_calculo')
+                                    )
+
+                            if not response.data or len(response.data) < CACHE_BULK_PAGINA:
+                                break
+                            inicio += CACHE_BULK_PAGINA
+                    except:
+                        continue  # Los pares de este bloque se tratarán como no cacheados
+
+        # Rutas calculadas en este proceso que aún no se han volcado
+        with self._pending_lock:
+            pendientes = list(self._pending_routes.items())
+        for key, fila in pendientes:
+            if key in buscadas:
+                rutas[key] = (fila['distancia_metros'], fila['duracion_segundos'])
+
+        return rutas
+
+    def _cache_query_blocks(self, claves_pares, canonicas):
+        """
+        Bloques (origenes, destinos) de consulta a Supabase para unos pares
+
+        Si los pares cubren buena parte de los posibles entre sus ubicaciones
+        se consulta un único bloque todas×todas. Si son pocos (p. ej. los de una
+        dirección recién añadida) se consultan bloques densos de solo esos
+        pares en ambos sentidos, para no descargar filas que ya se conocen.
+        Cada ubicación se busca por su clave canónica y, por compatibilidad,
+        por la dirección tal cual.
+        """
+        if not claves_pares:
+            return []
+
+        formas = {}
+        for loc, canonica in canonicas.items():
+            formas.setdefault(canonica, [canonica])
+            if loc != canonica and loc not in formas[canonica]:
+                formas[canonica].append(loc)
+
+        ubicaciones = sorted({c for key in claves_pares for c in key})
+        if 2 * len(claves_pares) >= len(ubicaciones) * (len(ubicaciones) - 1) / 2:
+            todas = [f for c in ubicaciones for f in formas[c]]
+            return [(todas, todas)]
+
+        posicion = {c: k for k, c in enumerate(ubicaciones)}
+        bloques = []
+        for origenes, destinos in plan_matrix_tiles(
+            [(posicion[a], posicion[b]) for a, b in claves_pares],
+            max_filas=CACHE_BULK_MAX_UBICACIONES,
+            max_elementos=CACHE_BULK_MAX_UBICACIONES ** 2
+        ):
+            origenes = [f for k in origenes for f in formas[ubicaciones[k]]]
+            destinos = [f for k in destinos for f in formas[ubicaciones[k]]]
+            bloques.append((origenes, destinos))
+            bloques.append((destinos, origenes))
+        return bloques
     
     def save_route_to_cache(self, origen, destino, distancia, duracion):
-        """Guarda una ruta en el caché"""
-        try:
-            supabase.table('rutas_cache').insert({
-                'origen': origen,
-                'destino': destino,
+        """
+        Añade una ruta al buffer de escritura del caché
+
+        La fila se guarda con la clave canónica no dirigida (route_pair_key).
+        Las rutas se escriben en bloque con flush_route_cache() al terminar una
+        matriz, al superar CACHE_FLUSH_UMBRAL pendientes o al salir del proceso.
+        """
+        key = route_pair_key(origen, destino)
+        self.memory_cache.put(*key, distancia, duracion)
+
+        with self._pending_lock:
+            self._pending_routes[key] = {
+                'origen': key[0],
+                'destino': key[1],
                 'distancia_metros': distancia,
                 'duracion_segundos': duracion
-            }).execute()
+            }
+            pendientes = len(self._pending_routes)
+        _optimizers_con_pendientes.add(self)
+
+        if pendientes >= CACHE_FLUSH_UMBRAL:
+            self.flush_route_cache()
+
+    def flush_route_cache(self):
+        """
+        Escribe las rutas pendientes con un único upsert sobre (origen, destino)
+
+        Returns:
+            Número de filas escritas
+        """
+        with self._pending_lock:
+            if not self._pending_routes:
+                return 0
+            filas = list(self._pending_routes.values())
+            self._pending_routes = {}
+
+        # Renovar la fecha para que el upsert reinicie el TTL de filas existentes
+        fecha_calculo = datetime.now().isoformat()
+        for fila in filas:
+            fila['fecha_calculo'] = fecha_calculo
+
+        try:
+            supabase.table('rutas_cache').upsert(filas, on_conflict='origen,destino').execute()
         except:
-            pass  # Si falla el guardado, no es crítico
+            try:
+                # Sin restricción única en (origen, destino) el upsert falla: insertar en bloque
+                supabase.table('rutas_cache').insert(filas).execute()
+            except:
+                return 0  # Si falla el guardado, no es crítico
+
+        self.cache_rows_flushed += len(filas)
+        return len(filas)
     
     def get_distance_duration(self, origen, destino):
-        """Obtiene distancia y duración, usando caché si existe"""
+        """Obtiene distancia y duración, usando la matriz compartida o el caché si existe"""
+        # Pares ya resueltos en la matriz compartida
+        dist, dur = self.matrix.pair(origen, destino)
+        if dist and dur:
+            return dist, dur
+
         # Intentar caché primero
         cached_dist, cached_dur = self.get_route_from_cache(origen, destino)
         if cached_dist and cached_dur:
+            self._remember_pair(origen, destino, cached_dist, cached_dur)
             return cached_dist, cached_dur
         
         # Si no hay caché, llamar a la API
         try:
             result = self.gmaps.distance_matrix(origen, destino, mode="driving")
+            self.api_requests += 1
+            self.api_elements += 1
             distancia = result['rows'][0]['elements'][0]['distance']['value']
             duracion = result['rows'][0]['elements'][0]['duration']['value']
             
             # Guardar en caché para futuro
             self.save_route_to_cache(origen, destino, distancia, duracion)
+            self._remember_pair(origen, destino, distancia, duracion)
             
             return distancia, duracion
         except:
             return None, None
+
+    def _remember_pair(self, origen, destino, distancia, duracion):
+        """Guarda en la matriz compartida un par resuelto fuera de ella"""
+        i, j = self.matrix.add_locations([origen, destino])
+        if i != j:
+            self.matrix.set_pair(i, j, distancia, duracion)
     
-    def build_distance_matrix(self, locations):
-        """Construye matriz de distancias optimizada con caché"""
-        n = len(locations)
-        dist_matrix = [[0] * n for _ in range(n)]
-        time_matrix = [[0] * n for _ in range(n)]
-        
+    def ensure_locations(self, locations, bulk_cache=True):
+        """
+        Añade direcciones a la matriz compartida y resuelve sus pares pendientes
+
+        Solo se buscan (caché y, si falta, API) los pares entre estas direcciones
+        que la matriz aún no conoce; las direcciones equivalentes comparten índice.
+        Añadir una dirección a un día de k visitas ya resuelto cuesta k pares.
+
+        Args:
+            locations: Lista de direcciones
+            bulk_cache: Si True, lee el caché en bloque (pocas consultas para todos
+                los pares); si False, hace una consulta por par
+
+        Returns:
+            Array con el índice de cada dirección en self.matrix
+        """
+        indices = np.asarray(self.matrix.add_locations(locations), dtype=np.intp)
+        self._resolve_pairs(self.matrix.missing_pairs(indices), bulk_cache)
+        return indices
+
+    def ensure_block(self, origenes, destinos, bulk_cache=True):
+        """
+        Como ensure_locations, pero solo resuelve los pares origen×destino
+
+        Útil para evaluar muchas candidatas contra las visitas de los días sin
+        pedir los pares de las candidatas entre sí.
+
+        Returns:
+            (indices_origenes, indices_destinos) en self.matrix
+        """
+        filas = np.asarray(self.matrix.add_locations(origenes), dtype=np.intp)
+        columnas = np.asarray(self.matrix.add_locations(destinos), dtype=np.intp)
+        self._resolve_pairs(self.matrix.missing_pairs(filas, columnas), bulk_cache)
+        return filas, columnas
+
+    def ensure_legs(self, rutas, bulk_cache=True):
+        """
+        Como ensure_locations, pero solo resuelve los tramos consecutivos de cada ruta
+
+        Basta para calcular horarios de rutas ya ordenadas sin pedir todos los
+        pares entre sus visitas.
+
+        Args:
+            rutas: Lista de rutas, cada una una lista de direcciones en orden
+
+        Returns:
+            Lista con el array de índices de cada ruta en self.matrix
+        """
+        rutas_indices = [
+            np.asarray(self.matrix.add_locations(direcciones), dtype=np.intp) for direcciones in rutas
+        ]
+        known = self.matrix.known
+        pendientes = sorted({
+            (int(min(i, j)), int(max(i, j)))
+            for indices in rutas_indices
+            for i, j in zip(indices[:-1], indices[1:])
+            if not known[i, j]
+        })
+        self._resolve_pairs(pendientes, bulk_cache)
+        return rutas_indices
+
+    def _resolve_pairs(self, pendientes, bulk_cache=True):
+        """Resuelve en la matriz compartida pares de índices (caché y, si falta, API)"""
+        if not pendientes:
+            return
+
+        matrix = self.matrix
+        direcciones = matrix.locations
+        claves = matrix.canonical
+
+        # Leer todos los pares cacheados de una vez
+        rutas_cacheadas = None
+        if bulk_cache:
+            rutas_cacheadas = self.get_routes_from_cache_bulk(
+                [], pares=[(direcciones[i], direcciones[j]) for i, j in pendientes]
+            )
+
         # Preparar lista de pares que necesitan cálculo
         pairs_to_fetch = []
-        for i in range(n):
-            for j in range(i + 1, n):
-                # Intentar caché
-                dist, dur = self.get_route_from_cache(locations[i], locations[j])
-                if dist and dur:
-                    dist_matrix[i][j] = dist
-                    dist_matrix[j][i] = dist
-                    time_matrix[i][j] = dur
-                    time_matrix[j][i] = dur
-                else:
-                    pairs_to_fetch.append((i, j))
-        
+        for i, j in pendientes:
+            # Intentar caché (clave no dirigida, el modelo es simétrico)
+            if rutas_cacheadas is not None:
+                a, b = claves[i], claves[j]
+                dist, dur = rutas_cacheadas.get((a, b) if a <= b else (b, a), (None, None))
+            else:
+                dist, dur = self.get_route_from_cache(direcciones[i], direcciones[j])
+            if dist and dur:
+                matrix.set_pair(i, j, dist, dur)
+            else:
+                pairs_to_fetch.append((i, j))
+
         # Batch API call para los que faltan
         if pairs_to_fetch:
-            # Dividir en chunks para evitar límites de API
-            chunk_size = GOOGLE_MAPS_CHUNK_SIZE
-            for chunk_start in range(0, len(pairs_to_fetch), chunk_size):
-                chunk = pairs_to_fetch[chunk_start:chunk_start + chunk_size]
-                
-                origins = [locations[i] for i, j in chunk]
-                destinations = [locations[j] for i, j in chunk]
-                
+            # Agrupar los pares en bloques origen×destino densos dentro de los límites de la API
+            for origenes, destinos in plan_matrix_tiles(pairs_to_fetch):
                 try:
-                    result = self.gmaps.distance_matrix(origins, destinations, mode="driving")
-                    
-                    for idx, (i, j) in enumerate(chunk):
-                        if idx < len(result['rows']):
-                            element = result['rows'][idx]['elements'][0]
+                    result = self.gmaps.distance_matrix(
+                        [direcciones[i] for i in origenes],
+                        [direcciones[j] for j in destinos],
+                        mode="driving"
+                    )
+                    self.api_requests += 1
+                    self.api_elements += len(origenes) * len(destinos)
+
+                    for fila, i in zip(result['rows'], origenes):
+                        for element, j in zip(fila['elements'], destinos):
                             if element['status'] == 'OK':
                                 dist = element['distance']['value']
                                 dur = element['duration']['value']
-                                
-                                dist_matrix[i][j] = dist
-                                dist_matrix[j][i] = dist
-                                time_matrix[i][j] = dur
-                                time_matrix[j][i] = dur
-                                
+                                matrix.set_pair(i, j, dist, dur)
+
                                 # Guardar en caché
-                                self.save_route_to_cache(locations[i], locations[j], dist, dur)
+                                self.save_route_to_cache(direcciones[i], direcciones[j], dist, dur)
                 except:
-                    # Si falla el batch, intentar uno por uno
-                    for i, j in chunk:
-                        dist, dur = self.get_distance_duration(locations[i], locations[j])
-                        if dist and dur:
-                            dist_matrix[i][j] = dist
-                            dist_matrix[j][i] = dist
-                            time_matrix[i][j] = dur
-                            time_matrix[j][i] = dur
-        
-        return dist_matrix, time_matrix
+                    # Si falla el bloque, intentar uno por uno
+                    for i in origenes:
+                        for j in destinos:
+                            self.get_distance_duration(direcciones[i], direcciones[j])
+
+            # Volcar al caché en una sola escritura los pares nuevos
+            self.flush_route_cache()
+
+    def build_distance_matrix(self, locations, bulk_cache=True):
+        """
+        Construye matriz de distancias optimizada con caché
+
+        Args:
+            locations: Lista de direcciones
+            bulk_cache: Si True, lee el caché en bloque (pocas consultas para todos
+                los pares); si False, hace una consulta por par
+
+        Returns:
+            (dist_matrix, time_matrix) como listas de listas; los pares que no se
+            pudieron resolver quedan a 0
+        """
+        indices = self.ensure_locations(locations, bulk_cache)
+        malla = np.ix_(indices, indices)
+        return self.matrix.meters[malla].tolist(), self.matrix.seconds[malla].tolist()
     
     def nearest_neighbor(self, time_matrix, duracion_visita_seg):
         """Algoritmo Nearest Neighbor para construir ruta inicial"""
-        n = len(time_matrix)
-        if n == 0:
+        if not time_matrix:
             return [], 0
-        
-        unvisited = set(range(n))
-        current = 0  # Empezar desde el primer punto
-        route = [current]
-        unvisited.remove(current)
-        total_time = 0
-        
-        while unvisited:
-            nearest = min(unvisited, key=lambda x: time_matrix[current][x])
-            total_time += time_matrix[current][nearest] + duracion_visita_seg
-            route.append(nearest)
-            unvisited.remove(nearest)
-            current = nearest
-        
-        # Añadir la última visita sin viaje de vuelta
-        total_time += duracion_visita_seg
-        
+
+        # Empezar desde el primer punto
+        route = route_heuristics.nearest_neighbor(time_matrix, start=0)
+        total_time = self._calculate_route_time(route, time_matrix, duracion_visita_seg)
+
         return route, total_time
     
     def two_opt(self, route, time_matrix, duracion_visita_seg, max_iterations=100):
-        """Mejora la ruta usando 2-opt con límite de iteraciones"""
-        improved = True
-        best_route = route[:]
-        iterations = 0
-
-        while improved and iterations < max_iterations:
-            iterations += 1
-            improved = False
-            for i in range(1, len(route) - 1):
-                for j in range(i + 1, len(route)):
-                    # Intercambiar aristas
-                    new_route = route[:i] + route[i:j][::-1] + route[j:]
-
-                    # Calcular tiempo de la nueva ruta
-                    new_time = self._calculate_route_time(new_route, time_matrix, duracion_visita_seg)
-                    old_time = self._calculate_route_time(best_route, time_matrix, duracion_visita_seg)
-
-                    if new_time < old_time:
-                        best_route = new_route
-                        improved = True
-
-            route = best_route[:]
-
-        return best_route
+        """
+        Mejora la ruta usando 2-opt con evaluación delta
+
+        Args:
+            route: Ruta inicial (índices); el primer punto se mantiene fijo
+            time_matrix: Matriz de tiempos
+            duracion_visita_seg: Duración de cada visita (no afecta al orden)
+            max_iterations: Máximo de movimientos de mejora por visita de la ruta
+
+        Returns:
+            Ruta mejorada
+        """
+        return route_heuristics.two_opt(
+            route, time_matrix, k=NUM_VECINOS_2OPT, max_moves=max_iterations * len(route)
+        )
     
-    def _calculate_route_time(self, route, time_matrix, duracion_visita_seg):
-        """Calcula el tiempo total de una ruta"""
-        total = 0
-        for i in range(len(route) - 1):
-            total += time_matrix[route[i]][route[i+1]]
-        total += len(route) * duracion_visita_seg
+    def _calculate_route_time(self, route, time_matrix, duracion_visita_seg, depot=False, return_to_depot=False):
+        """
+        Calcula el tiempo total de una ruta
+
+        Con depot, route[0] es el punto de partida: no suma duración de visita
+        y, con return_to_depot, se cuenta la vuelta desde la última visita.
+        """
+        total = route_heuristics.route_travel_time(route, time_matrix, depot and return_to_depot)
+        total += (len(route) - (1 if depot and route else 0)) * duracion_visita_seg
         return total
 
-    def _find_nearest(self, visita_base, visitas_candidatas):
+    def _optimize_route_indices(self, time_matrix, duracion_visita_seg, local_search=None, time_budget_ms=None,
+                                depot=False, return_to_depot=False, anytime=False, progress_callback=None):
         """
-        Encuentra la visita más cercana a visita_base dentro de visitas_candidatas
+        Ruta exacta (Held-Karp) para días pequeños; Nearest Neighbor + búsqueda
+        local por encima de LIMITE_VISITAS_EXACTO
 
         Args:
-            visita_base: Visita de referencia
-            visitas_candidatas: Lista de visitas entre las que buscar
+            local_search: Movimientos a encadenar ('two_opt', 'or_opt', 'swap');
+                None usa BUSQUEDA_LOCAL_RUTA
+            time_budget_ms: Tiempo máximo de la búsqueda local (del total en modo
+                anytime); None usa TIEMPO_MAX_BUSQUEDA_LOCAL_MS / TIEMPO_MAX_OPTIMIZACION_MS
+            depot: Si True, el índice 0 es el punto de partida y no una visita
+            return_to_depot: Si True (con depot), la ruta vuelve al punto de partida
+            anytime: Si True, sigue mejorando con perturbaciones hasta agotar
+                time_budget_ms, sea cual sea el tamaño de la ruta
+            progress_callback: Función progress_callback(fraccion, mensaje)
 
         Returns:
-            índice de la visita más cercana en visitas_candidatas
+            (route_indices, tiempo_total_seg)
         """
-        if not visitas_candidatas:
-            return None
+        route_indices = route_heuristics.solve_route(
+            time_matrix,
+            local_search=local_search,
+            time_budget_ms=time_budget_ms,
+            closed=depot and return_to_depot,
+            anytime=anytime,
+            progress=progress_callback
+        )
 
-        mejor_idx = 0
-        mejor_tiempo = float('inf')
+        # Calcular tiempo total final
+        total_time = self._calculate_route_time(
+            route_indices, time_matrix, duracion_visita_seg, depot, return_to_depot
+        )
+        if progress_callback:
+            progress_callback(1.0, "Ruta optimizada")
 
-        for idx, candidata in enumerate(visitas_candidatas):
-            _, tiempo = self.get_distance_duration(
-                visita_base['direccion_texto'],
-                candidata['direccion_texto']
-            )
+        return route_indices, total_time
+    
+    def _time_windows(self, visitas, depot=None):
+        """Franja (inicio, fin) en segundos o None por índice de la matriz (el punto de partida no tiene)"""
+        ventanas = [window_heuristics.parse_franja(v.get('franja_horaria')) for v in visitas]
+        return [None] + ventanas if depot else ventanas
 
-            if tiempo and tiempo < mejor_tiempo:
-                mejor_tiempo = tiempo
-                mejor_idx = idx
+    def _optimize_route_windows(self, time_matrix, ventanas, duracion_visita_seg, fin_dia=window_heuristics.SIN_LIMITE,
+                                depot=False, return_to_depot=False, time_budget_ms=None):
+        """
+        Ruta respetando franjas horarias (window_heuristics.solve_route_windows)
 
-        return mejor_idx
-    
-    def optimize_route(self, visitas, duracion_visita_seg=2700):
+        Las visitas sin hueco en su franja se quedan fuera de la ruta.
+
+        Returns:
+            (route_indices, tiempo_total_seg, fuera_de_franja): el tiempo va
+            desde HORA_INICIO_DIA hasta el final del día, esperas incluidas
         """
-        Optimiza una lista de visitas usando Nearest Neighbor + 2-opt
+        route_indices, fuera = window_heuristics.solve_route_windows(
+            time_matrix, duracion_visita_seg, ventanas, _INICIO_DIA_SEG, fin_dia,
+            depot=depot, closed=depot and return_to_depot, time_budget_ms=time_budget_ms
+        )
+        route_indices = [k for k in route_indices if k not in fuera]
+        inicios = window_heuristics.schedule(
+            route_indices, time_matrix, duracion_visita_seg, ventanas, _INICIO_DIA_SEG, depot
+        )
+        fin_ruta = window_heuristics.route_end(
+            route_indices, inicios, time_matrix, duracion_visita_seg, depot, depot and return_to_depot
+        )
+        return route_indices, fin_ruta - _INICIO_DIA_SEG, fuera
+
+    def optimize_route(self, visitas, duracion_visita_seg=2700, local_search=None, time_budget_ms=None,
+                       depot=None, return_to_depot=False, anytime=False, progress_callback=None,
+                       time_windows=False):
+        """
+        Optimiza una lista de visitas: exacto hasta LIMITE_VISITAS_EXACTO visitas,
+        Nearest Neighbor + búsqueda local por encima
+
+        Sin depot, la primera visita de la lista es el inicio fijo de la ruta.
+        Con depot, la ruta sale de esa dirección (que no cuenta como visita) y
+        todas las visitas pueden reordenarse.
+
+        Con time_windows, cada visita debe empezar dentro de su
+        'franja_horaria' (esperando si se llega antes) contando el día desde
+        HORA_INICIO_DIA: la ruta se construye por inserción y se mejora con
+        relocate (window_heuristics), todas las visitas pueden reordenarse y el
+        tiempo total incluye las esperas. Las visitas que no caben en su franja
+        se quedan fuera de la ruta devuelta (como las no asignadas de
+        optimize_multiday con time_windows).
 
         Args:
             visitas: Lista de diccionarios con 'direccion_texto'
             duracion_visita_seg: Duración de cada visita en segundos (default 45min)
+            local_search: Movimientos de mejora a encadenar, p. ej. ('two_opt', 'or_opt', 'swap')
+            time_budget_ms: Tiempo máximo de la búsqueda local en milisegundos
+            depot: Dirección del punto de partida (p. ej. usuarios.punto_partida)
+            return_to_depot: Si True, suma la vuelta al punto de partida
+            anytime: Si True, time_budget_ms es el tiempo total: se construye la
+                ruta, se mejora y se perturba hasta agotarlo, y se devuelve la
+                mejor encontrada
+            progress_callback: Función progress_callback(fraccion, mensaje), p. ej.
+                para actualizar un st.progress
+            time_windows: Si True, respeta la 'franja_horaria' de cada visita
 
         Returns:
-            (visitas_ordenadas, tiempo_total_seg)
+            (visitas_ordenadas, tiempo_total_seg); las visitas ordenadas no
+            incluyen el punto de partida ni, con time_windows, las que no caben
+            en su franja
         """
-        if not visitas or len(visitas) <= 1:
+        if not visitas or (len(visitas) <= 1 and not depot):
             return visitas, len(visitas) * duracion_visita_seg
 
-        # Extraer direcciones
+        # Días idénticos (mismas visitas, direcciones y parámetros) ya optimizados
+        huella = day_fingerprint(
+            visitas, duracion_visita_seg, local_search, time_budget_ms, depot, return_to_depot, anytime,
+            time_windows
+        )
+        with self._day_memo_lock:
+            memorizado = self._day_memo.get(huella)
+            if memorizado is not None:
+                self._day_memo.move_to_end(huella)
+        if memorizado is not None:
+            route_indices, total_time = memorizado
+            if progress_callback:
+                progress_callback(1.0, "Ruta ya optimizada")
+            return [visitas[i] for i in route_indices], total_time
+
+        # Extraer direcciones (el punto de partida ocupa el índice 0)
         locations = [v['direccion_texto'] for v in visitas]
+        if depot:
+            locations = [depot] + locations
 
-        # Construir matriz de tiempos con caché
-        _, time_matrix = self.build_distance_matrix(locations)
+        # Tiempos desde la matriz compartida (solo se buscan los pares nuevos)
+        indices = self.ensure_locations(locations)
+        time_matrix = self.matrix.time_submatrix(indices).tolist()
 
-        # Aplicar Nearest Neighbor
-        route_indices, _ = self.nearest_neighbor(time_matrix, duracion_visita_seg)
+        if time_windows:
+            route_indices, total_time, _ = self._optimize_route_windows(
+                time_matrix, self._time_windows(visitas, depot), duracion_visita_seg,
+                depot=bool(depot), return_to_depot=return_to_depot, time_budget_ms=time_budget_ms
+            )
+            if progress_callback:
+                progress_callback(1.0, "Ruta optimizada")
+        else:
+            route_indices, total_time = self._optimize_route_indices(
+                time_matrix, duracion_visita_seg, local_search, time_budget_ms,
+                depot=bool(depot), return_to_depot=return_to_depot,
+                anytime=anytime, progress_callback=progress_callback
+            )
+        if depot:
+            # Quitar el punto de partida: índices de la lista de visitas
+            route_indices = [i - 1 for i in route_indices[1:]]
 
-        # Mejorar con 2-opt SOLO para rutas pequeñas/medianas
-        # Para rutas grandes, Nearest Neighbor es suficiente y mucho más rápido
-        if 3 < len(route_indices) <= LIMITE_VISITAS_2OPT:
-            route_indices = self.two_opt(route_indices, time_matrix, duracion_visita_seg, max_iterations=MAX_ITERACIONES_2OPT)
-
-        # Calcular tiempo total final
-        total_time = self._calculate_route_time(route_indices, time_matrix, duracion_visita_seg)
+        # Solo se memorizan días con todos los pares resueltos (sin tiempos por defecto)
+        if self.matrix.known[np.ix_(indices, indices)].all():
+            with self._day_memo_lock:
+                self._day_memo[huella] = (tuple(route_indices), total_time)
+                while len(self._day_memo) > CACHE_DIAS_MAX:
+                    self._day_memo.popitem(last=False)
 
         # Reordenar visitas según los índices
         optimized_visitas = [visitas[i] for i in route_indices]
 
         return optimized_visitas, total_time
     
-    def optimize_multiday(self, visitas_disponibles, dias_disponibles, duracion_visita_seg=2700, tiempo_jornada_func=None):
+    def insertion_cost(self, route, visita, duracion_visita_seg=2700, fixed_start=False):
         """
-        Distribuye y optimiza visitas en múltiples días usando heurística greedy inteligente
+        Inserción más barata de una visita en una ruta ya ordenada
+
+        Evalúa en O(n) todas las posiciones (delante, entre cada par de visitas
+        consecutivas y al final) sobre la matriz compartida, sin reoptimizar.
+
+        Args:
+            route: Lista ordenada de visitas (diccionarios con 'direccion_texto')
+            visita: Visita a insertar
+            duracion_visita_seg: Duración de la visita
+            fixed_start: Si True, no se inserta delante de route[0] (inicio fijo
+                de la ruta, como en optimize_route sin punto de partida)
+
+        Returns:
+            (posicion, segundos_añadidos): índice en route donde insertarla y
+            tiempo que añade al día (viaje extra + duración de la visita)
+        """
+        posiciones, segundos = self.insertion_costs([visita], [route], duracion_visita_seg, fixed_start)
+        return int(posiciones[0, 0]), int(segundos[0, 0])
+
+    def insertion_costs(self, visitas, rutas, duracion_visita_seg=2700, fixed_start=False):
+        """
+        Inserción más barata de varias visitas en varias rutas a la vez
+
+        Los pares candidata×ruta se resuelven de una vez en la matriz compartida
+        y cada ruta se evalúa vectorizada para todas las visitas.
+
+        Args:
+            visitas: Lista de m visitas candidatas
+            rutas: Lista de d rutas (listas ordenadas de visitas)
+            duracion_visita_seg: Duración de cada visita
+            fixed_start: Si True, no se inserta delante de la primera visita de cada ruta
+
+        Returns:
+            (posiciones, segundos): arrays m×d con la mejor posición de cada
+            visita en cada ruta y los segundos que añadiría
+        """
+        posiciones = np.zeros((len(visitas), len(rutas)), dtype=np.intp)
+        segundos = np.full((len(visitas), len(rutas)), duracion_visita_seg, dtype=np.int64)
+        if not visitas or not rutas:
+            return posiciones, segundos
+
+        # Pares candidata×visitas de las rutas (no los de las candidatas entre sí)
+        candidatas, _ = self.ensure_block(
+            [v['direccion_texto'] for v in visitas],
+            [v['direccion_texto'] for ruta in rutas for v in ruta]
+        )
+
+        for d, ruta in enumerate(rutas):
+            if not ruta:
+                continue
+            idx_ruta = self.ensure_locations([v['direccion_texto'] for v in ruta])
+
+            # Tiempos de cada candidata a cada visita de la ruta (m×n) y tramos actuales
+            hasta_ruta = self.matrix.time_block(candidatas, idx_ruta)
+            tramos = self.matrix.leg_times(idx_ruta)
+
+            # Delante, entre cada par consecutivo y al final
+            extra = np.concatenate([
+                hasta_ruta[:, :1],
+                hasta_ruta[:, :-1] + hasta_ruta[:, 1:] - tramos,
+                hasta_ruta[:, -1:]
+            ], axis=1)
+            primera = 1 if fixed_start else 0
+            mejor = extra[:, primera:].argmin(axis=1) + primera
+            posiciones[:, d] = mejor
+            segundos[:, d] += extra[np.arange(len(visitas)), mejor]
+
+        return posiciones, segundos
+
+    def optimize_multiday(self, visitas_disponibles, dias_disponibles, duracion_visita_seg=2700, tiempo_jornada_func=None,
+                          depot=None, return_to_depot=False, time_budget_ms=None, anytime=False,
+                          progress_callback=None, strategy=None, time_windows=False):
+        """
+        Distribuye y optimiza visitas en múltiples días
+
+        La matriz de tiempos de todas las visitas se resuelve una sola vez; la
+        asignación y la optimización de cada día trabajan después sobre
+        índices en memoria, sin consultas adicionales al caché ni a la API.
+
+        Estrategias de asignación (strategy):
+            'greedy': llena cada día con la visita más cercana a la última
+            'savings': ahorros de Clarke-Wright con la jornada de cada día
+            'clusters': agrupa por zonas (lat/lon) y enruta cada día aparte;
+                para bolsas de cientos de visitas, ya que solo resuelve los
+                pares de cada zona en lugar de la matriz completa
+            None: 'greedy'
+
+        Con time_windows se respeta la 'franja_horaria' de cada visita y la
+        estrategia se ignora: cada día se llena por inserción con franjas
+        (ver _optimize_multiday_windows).
 
         Args:
             visitas_disponibles: Lista de visitas
             dias_disponibles: Lista de fechas (date objects)
             duracion_visita_seg: Duración por visita
             tiempo_jornada_func: Función que recibe weekday y retorna segundos de jornada
+            depot: Dirección del punto de partida de cada día (None = la primera visita)
+            return_to_depot: Si True, cada día suma la vuelta al punto de partida
+            time_budget_ms: Tiempo de optimización de todos los días, repartido
+                según su número de visitas (None = el de cada día por defecto)
+            anytime: Si True, cada día se mejora con perturbaciones hasta agotar su
+                parte del presupuesto, sea cual sea su tamaño
+            progress_callback: Función progress_callback(fraccion, mensaje)
+            strategy: Estrategia de asignación ('greedy', 'savings', 'clusters' o None)
+            time_windows: Si True, respeta la 'franja_horaria' de cada visita
 
         Returns:
             (plan_dict, visitas_no_asignadas)
@@ -265,62 +866,628 @@ class RouteOptimizer:
         if not tiempo_jornada_func:
             tiempo_jornada_func = lambda wd: 7*3600 if wd == 4 else 9*3600
 
+        if strategy not in (None, 'greedy', 'savings', 'clusters'):
+            raise ValueError(f"Estrategia de planificación desconocida: {strategy}")
+
         plan = {}
-        visitas_restantes = visitas_disponibles[:]
+        if not visitas_disponibles:
+            return plan, []
 
-        for dia in dias_disponibles:
-            presupuesto = tiempo_jornada_func(dia.weekday())
-            visitas_dia = []
-            tiempo_acumulado = 0
-
-            # ESTRATEGIA GREEDY: Añadir visitas una a una de forma inteligente
-            while visitas_restantes:
-                if not visitas_dia:
-                    # Primera visita del día: tomar la primera disponible
-                    candidata = visitas_restantes[0]
-                    tiempo_nueva = duracion_visita_seg
-                else:
-                    # Buscar la visita más cercana a la última añadida
-                    idx_cercana = self._find_nearest(visitas_dia[-1], visitas_restantes)
-                    if idx_cercana is None:
+        if time_windows:
+            return self._optimize_multiday_windows(
+                visitas_disponibles, dias_disponibles, duracion_visita_seg, tiempo_jornada_func,
+                depot, return_to_depot, time_budget_ms, progress_callback
+            )
+
+        # Agrupar por zonas y enrutar cada día por separado
+        if strategy == 'clusters':
+            return self._optimize_multiday_clusters(
+                visitas_disponibles, dias_disponibles, duracion_visita_seg, tiempo_jornada_func,
+                depot, return_to_depot, time_budget_ms, anytime, progress_callback
+            )
+
+        # Una sola matriz para todas las visitas (y el punto de partida en el índice 0)
+        locations = [v['direccion_texto'] for v in visitas_disponibles]
+        base = 1 if depot else 0
+        if depot:
+            locations = [depot] + locations
+        indices = self.ensure_locations(locations)
+        time_matrix = self.matrix.time_submatrix(indices).tolist()
+        vuelta = time_matrix[0] if depot and return_to_depot else [0] * len(time_matrix)
+
+        inicio = time.perf_counter()
+        if anytime and time_budget_ms is None:
+            time_budget_ms = TIEMPO_MAX_OPTIMIZACION_MS
+
+        # Índices pendientes en el orden original (las prioritarias primero)
+        restantes = list(range(base, len(locations)))
+        rutas_dias = []
+
+        if strategy == 'savings':
+            # Ahorros de Clarke-Wright con la jornada de cada día
+            rutas, restantes = plan_heuristics.savings_routes(
+                np.asarray(time_matrix), restantes, duracion_visita_seg,
+                [tiempo_jornada_func(dia.weekday()) for dia in dias_disponibles],
+                depot=0 if depot else None, closed=bool(depot) and return_to_depot
+            )
+            for dia, ruta_dia in zip(dias_disponibles, rutas):
+                if ruta_dia:
+                    puntos = [0] + ruta_dia if depot else ruta_dia
+                    rutas_dias.append((dia, ruta_dia, self._calculate_route_time(
+                        puntos, time_matrix, duracion_visita_seg, bool(depot), return_to_depot
+                    )))
+        else:
+            for dia in dias_disponibles:
+                if not restantes:
+                    break
+
+                presupuesto = tiempo_jornada_func(dia.weekday())
+                ruta_dia = []
+                tiempo_acumulado = 0
+
+                # ESTRATEGIA GREEDY: Añadir visitas una a una de forma inteligente
+                while restantes:
+                    if not ruta_dia:
+                        # Primera visita del día: tomar la primera disponible
+                        candidata = restantes[0]
+                        tiempo_nueva = duracion_visita_seg + (time_matrix[0][candidata] if depot else 0)
+                    else:
+                        # La visita más cercana a la última añadida
+                        fila = time_matrix[ruta_dia[-1]]
+                        candidata = min(restantes, key=fila.__getitem__)
+                        tiempo_nueva = duracion_visita_seg + fila[candidata]
+
+                    # Verificar si cabe en el presupuesto (incluida la vuelta, si se cuenta)
+                    if tiempo_acumulado + tiempo_nueva + vuelta[candidata] <= presupuesto:
+                        ruta_dia.append(candidata)
+                        restantes.remove(candidata)
+                        tiempo_acumulado += tiempo_nueva
+                    else:
+                        # No cabe más, pasar al siguiente día
                         break
 
-                    candidata = visitas_restantes[idx_cercana]
+                if ruta_dia:
+                    rutas_dias.append((dia, ruta_dia, tiempo_acumulado + vuelta[ruta_dia[-1]]))
 
-                    # Calcular tiempo de viaje desde la última visita
-                    _, tiempo_viaje = self.get_distance_duration(
-                        visitas_dia[-1]['direccion_texto'],
-                        candidata['direccion_texto']
-                    )
+        if progress_callback:
+            progress_callback(0.0, "Visitas repartidas entre los días")
 
-                    tiempo_nueva = duracion_visita_seg + (tiempo_viaje if tiempo_viaje else 1800)
+        # Optimizar cada día completo UNA SOLA VEZ al final
+        asignadas = pendientes = sum(len(ruta_dia) for _, ruta_dia, _ in rutas_dias)
+        for dia, ruta_dia, tiempo_construido in rutas_dias:
+            hecho = 1 - pendientes / asignadas
+            parte = len(ruta_dia) / asignadas
+            presupuesto_dia = None
+            if time_budget_ms is not None:
+                # Lo que quede del presupuesto, en proporción a las visitas por optimizar
+                restante_ms = time_budget_ms - (time.perf_counter() - inicio) * 1000
+                presupuesto_dia = max(0, restante_ms * len(ruta_dia) / pendientes)
 
-                # Verificar si cabe en el presupuesto
-                if tiempo_acumulado + tiempo_nueva <= presupuesto:
-                    visitas_dia.append(candidata)
-                    visitas_restantes.remove(candidata)
-                    tiempo_acumulado += tiempo_nueva
+            avance_dia = None
+            if progress_callback:
+                avance_dia = lambda fraccion, mensaje, hecho=hecho, parte=parte, dia=dia: progress_callback(
+                    hecho + parte * fraccion, f"{dia.strftime('%d/%m')}: {mensaje}"
+                )
+
+            if 1 < len(ruta_dia) and (anytime or len(ruta_dia) <= LIMITE_VISITAS_2OPT):
+                # Para días pequeños (o con presupuesto anytime), vale la pena optimizar
+                # sobre la submatriz del día
+                puntos = [0] + ruta_dia if depot else ruta_dia
+                sub_matrix = [[time_matrix[i][j] for j in puntos] for i in puntos]
+                orden, tiempo_final = self._optimize_route_indices(
+                    sub_matrix, duracion_visita_seg, time_budget_ms=presupuesto_dia,
+                    depot=bool(depot), return_to_depot=return_to_depot,
+                    anytime=anytime, progress_callback=avance_dia
+                )
+                if tiempo_final <= tiempo_construido:
+                    ruta_dia = [puntos[k] for k in orden[base:]]
                 else:
-                    # No cabe más, pasar al siguiente día
+                    # La búsqueda local sin tiempo no mejoró el orden construido
+                    tiempo_final = tiempo_construido
+            else:
+                # Para días grandes, usar el orden construido (ya es bueno)
+                tiempo_final = tiempo_construido
+
+            plan[dia.isoformat()] = {
+                'ruta': [visitas_disponibles[i - base] for i in ruta_dia],
+                'tiempo_total': tiempo_final
+            }
+            pendientes -= len(ruta_dia)
+
+        if progress_callback:
+            progress_callback(1.0, "Plan completado")
+
+        return plan, [visitas_disponibles[i - base] for i in restantes]
+
+    def _optimize_multiday_clusters(self, visitas_disponibles, dias_disponibles, duracion_visita_seg,
+                                    tiempo_jornada_func, depot=None, return_to_depot=False,
+                                    time_budget_ms=None, anytime=False, progress_callback=None):
+        """
+        optimize_multiday para muchas visitas: agrupar primero, enrutar después
+
+        Las visitas con lat/lon se reparten en un clúster por día con un k-means
+        con capacidad (las de más prioridad primero, hasta FACTOR_CANDIDATAS_CLUSTER
+        veces la capacidad estimada de los días) y después se enruta cada
+        clúster por separado. Solo se resuelven los pares dentro de cada
+        clúster, no la matriz completa. Cada ruta se recorta a su jornada
+        quitando las visitas más apartadas (trim_route). Al final, las visitas que se quedan sin
+        día (quitadas, por encima de la capacidad estimada o sin coordenadas)
+        se insertan por orden de prioridad donde quepan, probando solo los
+        DIAS_CANDIDATOS_REINSERCION días más cercanos si tienen coordenadas.
+
+        Returns:
+            (plan_dict, visitas_no_asignadas), como optimize_multiday
+        """
+        inicio = time.perf_counter()
+        if anytime and time_budget_ms is None:
+            time_budget_ms = TIEMPO_MAX_OPTIMIZACION_MS
+
+        presupuestos = [tiempo_jornada_func(dia.weekday()) for dia in dias_disponibles]
+        # Plazas de cada clúster: varias veces las visitas que se estima que caben en el día
+        capacidades = [
+            FACTOR_CANDIDATAS_CLUSTER * max(1, presupuesto // (duracion_visita_seg + TIEMPO_TRAMO_ESTIMADO_CLUSTER_SEG))
+            for presupuesto in presupuestos
+        ]
+
+        # Las de más prioridad (orden original) hasta llenar las plazas de los clústeres
+        con_coordenadas = [i for i, v in enumerate(visitas_disponibles) if has_coordinates(v)]
+        sin_coordenadas = [i for i, v in enumerate(visitas_disponibles) if not has_coordinates(v)]
+        candidatas = con_coordenadas[:sum(capacidades)]
+        no_asignadas = con_coordenadas[sum(capacidades):]
+
+        etiquetas = capacitated_kmeans(
+            to_plane([(visitas_disponibles[i]['lat'], visitas_disponibles[i]['lon']) for i in candidatas]),
+            capacidades
+        )
+        grupos = [[i for i, e in zip(candidatas, etiquetas) if e == c] for c in range(len(dias_disponibles))]
+
+        # Índices en la matriz compartida; solo se resuelven los pares de cada clúster
+        matrix = self.matrix
+        base = 1 if depot else 0
+        inicio_ruta = matrix.add_locations([depot]) if depot else []
+        indice = dict(zip(candidatas, matrix.add_locations(
+            [visitas_disponibles[i]['direccion_texto'] for i in candidatas]
+        )))
+
+        def puntos(ruta):
+            return inicio_ruta + [indice[i] for i in ruta]
+
+        def tiempo_dia(ruta):
+            sub_matrix = matrix.time_submatrix(puntos(ruta))
+            return self._calculate_route_time(
+                list(range(len(sub_matrix))), sub_matrix, duracion_visita_seg, bool(depot), return_to_depot
+            )
+
+        self._resolve_pairs(sorted({par for grupo in grupos if grupo for par in matrix.missing_pairs(puntos(grupo))}))
+        if progress_callback:
+            progress_callback(0.0, "Visitas agrupadas por zonas")
+
+        presupuesto_rutas = None
+        if time_budget_ms is not None:
+            presupuesto_rutas = max(0, time_budget_ms - (time.perf_counter() - inicio) * 1000)
+        ordenes = self._route_clusters(
+            [matrix.time_submatrix(puntos(grupo)).tolist() if grupo else None for grupo in grupos],
+            presupuesto_rutas, bool(depot) and return_to_depot, anytime, progress_callback
+        )
+        rutas = [[grupo[k - base] for k in orden[base:]] for grupo, orden in zip(grupos, ordenes)]
+
+        # Recortar cada día a su jornada quitando las visitas más apartadas
+        for c, (ruta, presupuesto) in enumerate(zip(rutas, presupuestos)):
+            locales, quitadas = plan_heuristics.trim_route(
+                matrix.time_submatrix(puntos(ruta)), list(range(base, base + len(ruta))),
+                duracion_visita_seg, presupuesto, depot=0 if depot else None,
+                closed=bool(depot) and return_to_depot
+            )
+            rutas[c] = [ruta[k - base] for k in locales]
+            no_asignadas.extend(ruta[k - base] for k in quitadas)
+
+        # Visitas sin día: inserción más barata, por orden de prioridad, en los días con hueco
+        posicion = dict(zip(con_coordenadas, to_plane(
+            [(visitas_disponibles[i]['lat'], visitas_disponibles[i]['lon']) for i in con_coordenadas]
+        )))
+
+        def cercania(i, ruta):
+            """Distancia en el plano de la visita i a la visita más próxima de la ruta (0 si no hay)"""
+            puntos_ruta = [posicion[j] for j in ruta if j in posicion]
+            if not puntos_ruta:
+                return 0.0
+            return float(np.linalg.norm(np.asarray(puntos_ruta) - posicion[i], axis=1).min())
+
+        tiempos = [tiempo_dia(ruta) if ruta else 0 for ruta in rutas]
+
+        def dias_candidatos(i):
+            """Días con hueco para una visita más; con coordenadas, solo los más cercanos"""
+            con_hueco = [c for c in range(len(rutas)) if presupuestos[c] - tiempos[c] >= duracion_visita_seg]
+            if i in posicion:
+                con_hueco = sorted(con_hueco, key=lambda c: cercania(i, rutas[c]))[:DIAS_CANDIDATOS_REINSERCION]
+            return con_hueco
+
+        pendientes = sorted(no_asignadas + sin_coordenadas)
+        no_asignadas = []
+        for k, i in enumerate(pendientes):
+            if k % LOTE_REINSERCION_CLUSTER == 0:
+                # Pares de un lote de visitas con sus días candidatos en una sola consulta
+                pares = set()
+                for j in pendientes[k:k + LOTE_REINSERCION_CLUSTER]:
+                    if j not in indice:
+                        indice[j] = matrix.add_locations([visitas_disponibles[j]['direccion_texto']])[0]
+                    destinos = inicio_ruta + [indice[m] for c in dias_candidatos(j) for m in rutas[c]]
+                    pares.update((min(indice[j], d), max(indice[j], d)) for d in destinos if indice[j] != d)
+                self._resolve_pairs(sorted(par for par in pares if not matrix.known[par]))
+
+            con_hueco = dias_candidatos(i)
+            if not con_hueco:
+                no_asignadas.extend(pendientes[k:])
+                break
+
+            visita = visitas_disponibles[i]
+            posiciones, segundos = self.insertion_costs(
+                [visita], [[visitas_disponibles[j] for j in rutas[c]] for c in con_hueco], duracion_visita_seg
+            )
+
+            for k_dia in np.argsort(segundos[0], kind='stable'):
+                c = con_hueco[k_dia]
+                nueva = rutas[c][:posiciones[0, k_dia]] + [i] + rutas[c][posiciones[0, k_dia]:]
+                tiempo_nueva = tiempo_dia(nueva)
+                if tiempo_nueva <= presupuestos[c]:
+                    rutas[c], tiempos[c] = nueva, tiempo_nueva
                     break
+            else:
+                no_asignadas.append(i)
 
-            # Optimizar el día completo UNA SOLA VEZ al final (si tiene pocas visitas)
-            if visitas_dia:
-                if len(visitas_dia) <= LIMITE_VISITAS_2OPT:
-                    # Para días pequeños, vale la pena optimizar
-                    visitas_optimizadas, tiempo_final = self.optimize_route(visitas_dia, duracion_visita_seg)
-                else:
-                    # Para días grandes, usar el orden greedy (ya es bueno)
-                    visitas_optimizadas = visitas_dia
-                    tiempo_final = tiempo_acumulado
+        plan = {
+            dia.isoformat(): {
+                'ruta': [visitas_disponibles[i] for i in ruta],
+                'tiempo_total': int(tiempo_dia(ruta))
+            }
+            for dia, ruta in zip(dias_disponibles, rutas) if ruta
+        }
+
+        return plan, [visitas_disponibles[i] for i in sorted(no_asignadas)]
+
+    def recommend_days(self, visitas, dias_candidatos, num_dias, duracion_visita_seg=2700,
+                       tiempo_jornada_func=None, depot=None, return_to_depot=False, mandatory_ids=(),
+                       prizes=None, time_budget_ms=TIEMPO_MAX_RECOMENDAR_DIAS_MS, progress_callback=None):
+        """
+        Evalúa todas las combinaciones de num_dias días y las ordena de mejor a peor
+
+        Cada combinación se planifica con el mismo proceso que la
+        planificación automática: optimize_multiday en modo anytime y después
+        improve_plan (LNS con obligatorias y premios), repartiendo
+        time_budget_ms entre ellas en la misma proporción que
+        TIEMPO_MAX_OPTIMIZACION_MS y TIEMPO_MAX_LNS_MS. La matriz de todas las
+        visitas se resuelve una sola vez y las combinaciones se evalúan una
+        tras otra en este hilo (el servidor de Streamlit ya es multihilo). Los
+        días solo se distinguen por su jornada, así que las combinaciones con
+        las mismas jornadas en el mismo orden se planifican una sola vez.
+
+        Orden: más obligatorias cubiertas, después más visitas planificadas y
+        después menos tiempo de viaje.
+
+        Args:
+            visitas: Visitas a planificar (las de mandatory_ids son obligatorias)
+            dias_candidatos: Fechas entre las que elegir (date objects)
+            num_dias: Número de días de cada combinación
+            duracion_visita_seg: Duración por visita
+            tiempo_jornada_func: Función que recibe weekday y retorna segundos de jornada
+            depot: Dirección del punto de partida de cada día (None = sin punto de partida)
+            return_to_depot: Si True, cada día suma la vuelta al punto de partida
+            mandatory_ids: ids de visitas obligatorias
+            prizes: {id: segundos} premio de cada visita opcional
+            time_budget_ms: Tiempo total para todas las combinaciones
+            progress_callback: Función progress_callback(fraccion, mensaje)
+
+        Returns:
+            Lista de dicts, de mejor a peor: {'dias', 'obligatorias', 'visitas',
+            'tiempo_viaje', 'plan', 'no_asignadas'}; 'plan' y 'no_asignadas'
+            como en optimize_multiday
+        """
+        if not tiempo_jornada_func:
+            tiempo_jornada_func = lambda wd: 7*3600 if wd == 4 else 9*3600
+
+        combinaciones = [list(c) for c in combinations(sorted(dias_candidatos), num_dias)]
+        if not visitas or not combinaciones:
+            return []
+
+        # Resolver la matriz una vez: las evaluaciones ya no consultan el caché ni la API
+        self.ensure_locations(([depot] if depot else []) + [v['direccion_texto'] for v in visitas])
+
+        # Jornadas distintas a evaluar (en el orden de los días de cada combinación) y sus días
+        perfiles = {}
+        for dias in combinaciones:
+            perfiles.setdefault(tuple(tiempo_jornada_func(d.weekday()) for d in dias), dias)
+
+        presupuesto = time_budget_ms / len(perfiles)
+        presupuesto_lns = presupuesto * TIEMPO_MAX_LNS_MS / (TIEMPO_MAX_OPTIMIZACION_MS + TIEMPO_MAX_LNS_MS)
+
+        resultados = {}
+        for k, (limites, dias) in enumerate(perfiles.items()):
+            avance_multidia = avance_lns = None
+            if progress_callback:
+                avance_multidia = lambda fraccion, mensaje, k=k: progress_callback(
+                    (k + fraccion / 2) / len(perfiles), f"Combinación {k + 1} de {len(perfiles)}: {mensaje}"
+                )
+                avance_lns = lambda fraccion, mensaje, k=k: progress_callback(
+                    (k + 0.5 + fraccion / 2) / len(perfiles), f"Combinación {k + 1} de {len(perfiles)}: {mensaje}"
+                )
+
+            plan, no_asignadas = self.optimize_multiday(
+                visitas, dias, duracion_visita_seg, tiempo_jornada_func, depot, return_to_depot,
+                time_budget_ms=presupuesto - presupuesto_lns, anytime=True, progress_callback=avance_multidia
+            )
+            resultados[limites] = (dias,) + self.improve_plan(
+                plan, no_asignadas, dias, duracion_visita_seg, tiempo_jornada_func, depot, return_to_depot,
+                mandatory_ids=mandatory_ids, prizes=prizes, time_budget_ms=presupuesto_lns,
+                progress_callback=avance_lns
+            )
+
+        mandatory_ids = set(mandatory_ids)
+        ranking = []
+        for dias in combinaciones:
+            # El plan de la combinación con las mismas jornadas, en estos días
+            dias_perfil, plan_perfil, no_asignadas = resultados[tuple(tiempo_jornada_func(d.weekday()) for d in dias)]
+            plan = {
+                dia.isoformat(): plan_perfil[dia_perfil.isoformat()]
+                for dia, dia_perfil in zip(dias, dias_perfil) if dia_perfil.isoformat() in plan_perfil
+            }
+            planificadas = [v for datos in plan.values() for v in datos['ruta']]
+            ranking.append({
+                'dias': dias,
+                'obligatorias': sum(1 for v in planificadas if v.get('id') in mandatory_ids),
+                'visitas': len(planificadas),
+                'tiempo_viaje': sum(datos['tiempo_total'] for datos in plan.values())
+                                - len(planificadas) * duracion_visita_seg,
+                'plan': plan,
+                'no_asignadas': no_asignadas
+            })
+
+        ranking.sort(key=lambda r: (-r['obligatorias'], -r['visitas'], r['tiempo_viaje']))
+        return ranking
+
+    def _optimize_multiday_windows(self, visitas_disponibles, dias_disponibles, duracion_visita_seg,
+                                   tiempo_jornada_func, depot=None, return_to_depot=False,
+                                   time_budget_ms=None, progress_callback=None):
+        """
+        optimize_multiday respetando la 'franja_horaria' de cada visita
+
+        Cada día empieza con la primera visita pendiente (por prioridad) que
+        cabe y se llena insertando en cada paso la visita que menos viaje
+        añade sin salirse de ninguna franja ni de la jornada; después se
+        mejora con relocate y se vuelve a intentar insertar en el tiempo
+        liberado. Las comprobaciones de franja son O(1) por posición gracias
+        a la holgura hacia delante (window_heuristics).
+
+        Returns:
+            (plan_dict, visitas_no_asignadas), como optimize_multiday; el
+            tiempo total de cada día incluye las esperas
+        """
+        inicio = time.perf_counter()
+        locations = [v['direccion_texto'] for v in visitas_disponibles]
+        base = 1 if depot else 0
+        if depot:
+            locations = [depot] + locations
+        time_matrix = self.matrix.time_submatrix(self.ensure_locations(locations)).tolist()
+        ventanas = self._time_windows(visitas_disponibles, depot)
+        closed = bool(depot) and return_to_depot
+
+        plan = {}
+        restantes = list(range(base, len(locations)))
+        for d, dia in enumerate(dias_disponibles):
+            if not restantes:
+                break
+
+            fin_dia = _INICIO_DIA_SEG + tiempo_jornada_func(dia.weekday())
+            deadline = None
+            if time_budget_ms is not None:
+                # Lo que quede del presupuesto, repartido entre los días que faltan
+                restante_ms = time_budget_ms - (time.perf_counter() - inicio) * 1000
+                deadline = time.perf_counter() + max(0, restante_ms) / (len(dias_disponibles) - d) / 1000
+
+            def rellenar(ruta, candidatas, cheapest=True):
+                return window_heuristics.insert_visits(
+                    ruta, candidatas, time_matrix, duracion_visita_seg, ventanas, _INICIO_DIA_SEG,
+                    fin_dia, bool(depot), closed, cheapest=cheapest
+                )
+
+            # Primera visita: la de más prioridad que quepa
+            ruta = [0] if depot else []
+            for k, v in enumerate(restantes):
+                ruta, fuera = rellenar(ruta, [v], cheapest=False)
+                if not fuera:
+                    break
+            else:
+                continue
+            ruta, _ = rellenar(ruta, restantes[k + 1:])
+            ruta = window_heuristics.relocate(
+                ruta, time_matrix, duracion_visita_seg, ventanas, _INICIO_DIA_SEG, fin_dia,
+                bool(depot), closed, deadline
+            )
+            en_ruta = set(ruta)
+            ruta, _ = rellenar(ruta, [v for v in restantes if v not in en_ruta])
+            en_ruta = set(ruta)
+            restantes = [v for v in restantes if v not in en_ruta]
+
+            inicios = window_heuristics.schedule(
+                ruta, time_matrix, duracion_visita_seg, ventanas, _INICIO_DIA_SEG, bool(depot)
+            )
+            fin_ruta = window_heuristics.route_end(
+                ruta, inicios, time_matrix, duracion_visita_seg, bool(depot), closed
+            )
+            plan[dia.isoformat()] = {
+                'ruta': [visitas_disponibles[i - base] for i in ruta[base:]],
+                'tiempo_total': fin_ruta - _INICIO_DIA_SEG
+            }
+            if progress_callback:
+                progress_callback((d + 1) / len(dias_disponibles), f"{dia.strftime('%d/%m')}: ruta con franjas")
+
+        if progress_callback:
+            progress_callback(1.0, "Plan completado")
+
+        return plan, [visitas_disponibles[i - base] for i in restantes]
+
+    def _route_clusters(self, matrices, time_budget_ms=None, closed=False, anytime=False, progress_callback=None):
+        """
+        Enruta varias submatrices con route_heuristics.solve_route
+
+        Se resuelven una tras otra en este proceso (el servidor de Streamlit es
+        multihilo y no se crean procesos con fork). time_budget_ms es el tiempo
+        total, repartido a partes iguales entre las rutas.
+
+        Args:
+            matrices: Lista de matrices de tiempos (None para grupos vacíos)
+
+        Returns:
+            Lista con la ruta (índices) de cada matriz ([] para las vacías)
+        """
+        activas = [c for c, sub_matrix in enumerate(matrices) if sub_matrix]
+        ordenes = [[] for _ in matrices]
+        if not activas:
+            return ordenes
+
+        presupuesto = None
+        if time_budget_ms is not None:
+            presupuesto = time_budget_ms / len(activas)
+
+        for hechas, c in enumerate(activas, 1):
+            ordenes[c] = route_heuristics.solve_route(matrices[c], None, presupuesto, closed, anytime)
+            if progress_callback:
+                progress_callback(hechas / len(activas), f"Ruta {hechas} de {len(activas)} calculada")
+
+        return ordenes
+
+    def mandatory_feasibility(self, visitas, dias_disponibles, duracion_visita_seg=2700,
+                              tiempo_jornada_func=None, depot=None, return_to_depot=False):
+        """
+        Comprueba de forma barata si unas visitas obligatorias pueden caber en los días
+
+        No construye ningún plan: compara la cota inferior de
+        plan_heuristics.mandatory_lower_bound con la suma de las jornadas, y
+        comprueba que cada visita quepa sola en la jornada más larga. Si no es
+        factible, ningún plan puede cubrirlas todas; si lo es, no está
+        garantizado (la cota es optimista).
+
+        Args:
+            visitas: Visitas obligatorias
+            dias_disponibles: Lista de fechas (date objects)
+            duracion_visita_seg: Duración por visita
+            tiempo_jornada_func: Función que recibe weekday y retorna segundos de jornada
+            depot: Dirección del punto de partida de cada día (None = sin punto de partida)
+            return_to_depot: Si True, cada día suma la vuelta al punto de partida
+
+        Returns:
+            (factible, segundos_minimos, segundos_disponibles)
+        """
+        if not tiempo_jornada_func:
+            tiempo_jornada_func = lambda wd: 7*3600 if wd == 4 else 9*3600
+
+        limites = [tiempo_jornada_func(dia.weekday()) for dia in dias_disponibles]
+        disponible = sum(limites)
+        if not visitas:
+            return True, 0, disponible
+        if not limites:
+            return False, len(visitas) * duracion_visita_seg, 0
+
+        locations = [v['direccion_texto'] for v in visitas]
+        base = 1 if depot else 0
+        if depot:
+            locations = [depot] + locations
+        time_matrix = self.matrix.time_submatrix(self.ensure_locations(locations))
+        indices = list(range(base, len(locations)))
+
+        minimo = plan_heuristics.mandatory_lower_bound(
+            time_matrix, indices, duracion_visita_seg, len(limites), depot=0 if depot else None
+        )
+
+        # Cada visita sola (con la ida y, si se cuenta, la vuelta) debe caber en algún día
+        sola = np.full(len(indices), duracion_visita_seg, dtype=np.int64)
+        if depot:
+            sola += time_matrix[0, indices]
+            if return_to_depot:
+                sola += time_matrix[indices, 0]
+
+        return minimo <= disponible and int(sola.max()) <= max(limites), minimo, disponible
+
+    def improve_plan(self, plan, visitas_no_asignadas, dias_disponibles, duracion_visita_seg=2700,
+                     tiempo_jornada_func=None, depot=None, return_to_depot=False, pinned_ids=(),
+                     mandatory_ids=(), prizes=None, time_budget_ms=TIEMPO_MAX_LNS_MS, seed=0,
+                     progress_callback=None):
+        """
+        Mejora un plan de varios días con búsqueda de vecindario grande (LNS)
+
+        Parte del plan de optimize_multiday (o de cualquier plan válido) y usa
+        plan_heuristics.ruin_and_recreate sobre la matriz compartida como un
+        problema de recogida de premios: las visitas de mandatory_ids se
+        cubren siempre que quepan, las demás entran si su premio compensa el
+        tiempo que añaden y, a igualdad, se acortan los días. Las visitas de
+        pinned_ids que ya están en el plan no cambian de día.
+
+        Args:
+            plan: {fecha_iso: {'ruta': [visitas], 'tiempo_total': segundos}}
+            visitas_no_asignadas: Visitas sin día, en orden de prioridad
+            dias_disponibles: Lista de fechas (date objects)
+            duracion_visita_seg: Duración por visita
+            tiempo_jornada_func: Función que recibe weekday y retorna segundos de jornada
+            depot: Dirección del punto de partida de cada día (None = la primera visita)
+            return_to_depot: Si True, cada día suma la vuelta al punto de partida
+            pinned_ids: ids de visitas que no cambian de día si ya están en el plan
+            mandatory_ids: ids de visitas obligatorias (pueden cambiar de día)
+            prizes: {id: segundos} premio de cada visita opcional (por defecto
+                PENALIZACION_VISITA_NO_ASIGNADA_SEG)
+            time_budget_ms: Tiempo máximo en milisegundos
+            seed: Semilla de la búsqueda (reproducible con el mismo tiempo)
+            progress_callback: Función progress_callback(fraccion, mensaje)
+
+        Returns:
+            (plan_dict, visitas_no_asignadas), como optimize_multiday
+        """
+        if not tiempo_jornada_func:
+            tiempo_jornada_func = lambda wd: 7*3600 if wd == 4 else 9*3600
+
+        # Todas las visitas en una lista; los índices de la matriz van desplazados por el punto de partida
+        visitas = []
+        rutas = []
+        for dia in dias_disponibles:
+            datos_dia = plan.get(dia.isoformat())
+            ruta_dia = datos_dia['ruta'] if datos_dia else []
+            rutas.append(list(range(len(visitas), len(visitas) + len(ruta_dia))))
+            visitas.extend(ruta_dia)
+        libres = list(range(len(visitas), len(visitas) + len(visitas_no_asignadas)))
+        visitas.extend(visitas_no_asignadas)
+        if not visitas:
+            return {}, []
+
+        locations = [v['direccion_texto'] for v in visitas]
+        base = 1 if depot else 0
+        if depot:
+            locations = [depot] + locations
+        time_matrix = self.matrix.time_submatrix(self.ensure_locations(locations))
 
-                plan[dia.isoformat()] = {
-                    'ruta': visitas_optimizadas,
-                    'tiempo_total': tiempo_final
-                }
+        pinned_ids, mandatory_ids, prizes = set(pinned_ids), set(mandatory_ids), prizes or {}
+        fijas = [i + base for i, v in enumerate(visitas) if v.get('id') in pinned_ids]
+        obligatorias = [i + base for i, v in enumerate(visitas) if v.get('id') in mandatory_ids]
+        premios = {i + base: prizes[v.get('id')] for i, v in enumerate(visitas) if v.get('id') in prizes}
+        rutas, libres = plan_heuristics.ruin_and_recreate(
+            time_matrix, [[i + base for i in ruta] for ruta in rutas], [i + base for i in libres],
+            duracion_visita_seg, [tiempo_jornada_func(dia.weekday()) for dia in dias_disponibles],
+            fijas=fijas, obligatorias=obligatorias, premios=premios,
+            depot=0 if depot else None, closed=bool(depot) and return_to_depot,
+            time_budget_ms=time_budget_ms, seed=seed, progress=progress_callback
+        )
 
-        return plan, visitas_restantes
+        matriz_lista = time_matrix.tolist()
+        nuevo_plan = {}
+        for dia, ruta_dia in zip(dias_disponibles, rutas):
+            if not ruta_dia:
+                continue
+            puntos = [0] + ruta_dia if depot else ruta_dia
+            nuevo_plan[dia.isoformat()] = {
+                'ruta': [visitas[i - base] for i in ruta_dia],
+                'tiempo_total': self._calculate_route_time(
+                    puntos, matriz_lista, duracion_visita_seg, bool(depot), return_to_depot
+                )
+            }
 
+        return nuevo_plan, [visitas[i - base] for i in libres]
 
 # Función de utilidad para usar fácilmente
 def optimizar_ruta_visitas(visitas, duracion_visita_seg=2700):
@@ -1,10 +1,12 @@
 """
 Servicio para calcular scores de idoneidad de visitas
 """
-from typing import Dict
+from typing import Dict, List
 from datetime import date
 
-from models import Visit, ScoreInfo
+import numpy as np
+
+from models import Visit, ScoreInfo, ScoreTable
 from config import (
     get_daily_time_budget, PESO_CAPACIDAD, PESO_PROXIMIDAD,
     PROXIMIDAD_IDEAL, PROXIMIDAD_MAXIMA, DURACION_VISITA_SEGUNDOS
@@ -39,8 +41,24 @@ class ScoringService:
         datos_dia = plan_actual.get(dia_iso, [])
         visitas_dia = datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia
 
-        # Factor 1: Capacidad disponible
-        capacidad_disponible = self._calculate_capacity_factor(dia, visitas_dia)
+        ruta_dia, tiempo_actual = self._optimize_day(visitas_dia)
+        _, tiempo_extra = self.optimizer.insertion_cost(ruta_dia, visita, DURACION_VISITA_SEGUNDOS, fixed_start=True)
+
+        return self._build_score(visita, dia, visitas_dia, tiempo_actual, tiempo_extra)
+
+    def _build_score(
+        self,
+        visita: dict,
+        dia: date,
+        visitas_dia: list,
+        tiempo_actual: int,
+        tiempo_extra: int
+    ) -> ScoreInfo:
+        """Combina los factores de un día ya evaluado en un ScoreInfo"""
+        limite = get_daily_time_budget(dia.weekday())
+
+        # Factor 1: Capacidad disponible tras añadir la visita
+        capacidad_disponible = self._calculate_capacity_factor(dia, tiempo_actual + tiempo_extra)
 
         # Factor 2: Proximidad geográfica
         proximidad = self._calculate_proximity_factor(visita, visitas_dia)
@@ -49,31 +67,29 @@ class ScoringService:
         score = (capacidad_disponible * PESO_CAPACIDAD) + (proximidad * PESO_PROXIMIDAD)
 
         # Calcular % de capacidad usada
-        limite = get_daily_time_budget(dia.weekday())
-        tiempo_actual = self._calculate_day_time(visitas_dia)
         capacidad_pct = (tiempo_actual / limite * 100) if limite > 0 else 0
 
         return ScoreInfo(
             score=score,
             capacidad_disponible=capacidad_disponible,
             proximidad=proximidad,
-            capacidad_pct=capacidad_pct
+            capacidad_pct=capacidad_pct,
+            tiempo_extra=tiempo_extra
         )
 
-    def _calculate_capacity_factor(self, dia: date, visitas_dia: list) -> float:
+    def _calculate_capacity_factor(self, dia: date, tiempo_dia: int) -> float:
         """
         Calcula el factor de capacidad disponible (0-1)
 
         Args:
             dia: Fecha del día
-            visitas_dia: Visitas ya asignadas al día
+            tiempo_dia: Tiempo del día con la visita evaluada ya insertada
 
         Returns:
-            Factor de capacidad (0=lleno, 1=vacío)
+            Factor de capacidad (0=lleno o no cabe, 1=vacío)
         """
         limite = get_daily_time_budget(dia.weekday())
-        tiempo_actual = self._calculate_day_time(visitas_dia)
-        capacidad_disponible = max(0, (limite - tiempo_actual) / limite)
+        capacidad_disponible = max(0, (limite - tiempo_dia) / limite)
 
         return capacidad_disponible
 
@@ -92,20 +108,18 @@ class ScoringService:
             # Bonus por ser el primero del día
             return 0.7
 
-        # Calcular distancia promedio a las visitas del día
-        distancias = []
-        for v_existente in visitas_dia:
-            dist, _ = self.optimizer.get_distance_duration(
-                visita['direccion_texto'],
-                v_existente['direccion_texto']
-            )
-            if dist:
-                distancias.append(dist)
+        # Calcular distancia promedio a las visitas del día (fila de la matriz compartida)
+        (fila,), columnas = self.optimizer.ensure_block(
+            [visita['direccion_texto']], [v['direccion_texto'] for v in visitas_dia]
+        )
+        matrix = self.optimizer.matrix
+        distancias = matrix.meters[fila, columnas]
+        distancias = distancias[matrix.known[fila, columnas] & (distancias > 0)]
 
-        if not distancias:
+        if not distancias.size:
             return 0.5  # Valor neutral si no se pudo calcular
 
-        dist_promedio = sum(distancias) / len(distancias)
+        dist_promedio = float(distancias.mean())
 
         # Normalizar: 0-20km = 1.0, >50km = 0
         proximidad = max(0, 1 - (dist_promedio / PROXIMIDAD_MAXIMA))
@@ -114,11 +128,94 @@ class ScoringService:
 
     def _calculate_day_time(self, visitas: list) -> int:
         """Calcula tiempo total de un día"""
+        _, tiempo = self._optimize_day(visitas)
+        return tiempo
+
+    def _optimize_day(self, visitas: list) -> tuple:
+        """Orden optimizado y tiempo total de un día"""
         if not visitas:
-            return 0
+            return [], 0
 
-        _, tiempo = self.optimizer.optimize_route(visitas, DURACION_VISITA_SEGUNDOS)
-        return tiempo
+        return self.optimizer.optimize_route(visitas, DURACION_VISITA_SEGUNDOS)
+
+    def score_matrix(
+        self,
+        visitas: List[dict],
+        dias: List[date],
+        plan_actual: Dict[str, dict]
+    ) -> ScoreTable:
+        """
+        Calcula los scores de muchas visitas para muchos días de una vez
+
+        Cada día se optimiza una sola vez; la inserción de todas las visitas
+        en todos los días y las proximidades salen de la matriz compartida en
+        operaciones vectorizadas.
+
+        Args:
+            visitas: Visitas a evaluar (filas de la tabla)
+            dias: Fechas a evaluar (columnas de la tabla)
+            plan_actual: Plan actual (legacy format)
+
+        Returns:
+            ScoreTable con arrays visitas×días
+        """
+        dias_visitas = []
+        for dia in dias:
+            datos_dia = plan_actual.get(dia.isoformat(), [])
+            dias_visitas.append(datos_dia['ruta'] if isinstance(datos_dia, dict) else datos_dia)
+        dias_optimizados = [self._optimize_day(visitas_dia) for visitas_dia in dias_visitas]
+
+        tiempos = np.array([tiempo for _, tiempo in dias_optimizados], dtype=np.int64)
+        limites = np.array([get_daily_time_budget(dia.weekday()) for dia in dias], dtype=np.int64)
+
+        # Factor 1: Capacidad disponible tras insertar cada visita en cada día
+        _, extras = self.optimizer.insertion_costs(
+            visitas, [ruta for ruta, _ in dias_optimizados], DURACION_VISITA_SEGUNDOS, fixed_start=True
+        )
+        capacidad = np.maximum(0, (limites - tiempos - extras) / limites)
+
+        # Factor 2: Proximidad geográfica
+        proximidad = self._proximity_matrix(visitas, dias_visitas)
+
+        return ScoreTable(
+            dias=list(dias),
+            scores=(capacidad * PESO_CAPACIDAD) + (proximidad * PESO_PROXIMIDAD),
+            capacidad_disponible=capacidad,
+            proximidad=proximidad,
+            tiempo_extra=extras,
+            capacidad_pct=tiempos / limites * 100
+        )
+
+    def _proximity_matrix(self, visitas: List[dict], dias_visitas: List[list]) -> np.ndarray:
+        """
+        Factor de proximidad (0-1) de cada visita a cada día, vectorizado
+
+        Mismos criterios que _calculate_proximity_factor: 0.7 si el día está
+        vacío, 0.5 si no hay distancias conocidas.
+        """
+        proximidad = np.full((len(visitas), len(dias_visitas)), 0.7)
+        if not visitas:
+            return proximidad
+
+        matrix = self.optimizer.matrix
+        for d, visitas_dia in enumerate(dias_visitas):
+            if not visitas_dia:
+                continue
+
+            filas, columnas = self.optimizer.ensure_block(
+                [v['direccion_texto'] for v in visitas], [v['direccion_texto'] for v in visitas_dia]
+            )
+            malla = np.ix_(filas, columnas)
+            distancias = matrix.meters[malla]
+            validas = matrix.known[malla] & (distancias > 0)
+
+            cuantas = validas.sum(axis=1)
+            promedio = np.where(validas, distancias, 0).sum(axis=1) / np.maximum(cuantas, 1)
+            proximidad[:, d] = np.where(
+                cuantas > 0, np.maximum(0, 1 - (promedio / PROXIMIDAD_MAXIMA)), 0.5
+            )
+
+        return proximidad
 
     def calculate_scores_for_all_days(
         self,
@@ -137,12 +234,9 @@ class ScoringService:
         Returns:
             Dict {fecha_iso: ScoreInfo}
         """
-        scores = {}
-
-        for dia in dias_disponibles:
-            scores[dia.isoformat()] = self.calculate_score(visita, dia, plan_actual)
+        tabla = self.score_matrix([visita], dias_disponibles, plan_actual)
 
-        return scores
+        return {dia.isoformat(): tabla.score_info(0, dia) for dia in dias_disponibles}
 
     def get_best_day(
         self,
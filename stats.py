@@ -4,14 +4,14 @@ import pandas as pd
 from datetime import date, timedelta
 from database import supabase
 import plotly.express as px
-import googlemaps
 from streamlit_calendar import calendar
+from route_optimizer import RouteOptimizer
 
 @st.cache_data(ttl=3600)
 def calcular_kilometraje_equipo(_start_date, _end_date):
     """
     Calcula el kilometraje total y por coordinador para un rango de fechas.
-    Utiliza la API Directions con waypoints para optimizar las llamadas.
+    Suma los tramos de cada jornada usando el caché de rutas de RouteOptimizer.
     """
     try:
         visitas_res = supabase.table('visitas').select('*, coordinador:usuario_id(*)').gte('fecha_asignada', _start_date).lte('fecha_asignada', _end_date).execute()
@@ -28,8 +28,8 @@ def calcular_kilometraje_equipo(_start_date, _end_date):
         if df_visitas.empty:
             return 0, pd.DataFrame()
 
-        gmaps = googlemaps.Client(key=st.secrets["google"]["api_key"])
-        km_por_coordinador = {}
+        optimizer = RouteOptimizer()
+        jornadas = []
 
         for (coordinador, fecha), group in df_visitas.groupby(['nombre_coordinador', 'fecha_asignada']):
             if group.empty:
@@ -38,38 +38,26 @@ def calcular_kilometraje_equipo(_start_date, _end_date):
             punto_partida = group['punto_partida'].iloc[0]
             group['hora_asignada'] = pd.to_datetime(group['hora_asignada'], format='%H:%M', errors='coerce').dt.time
             group.sort_values('hora_asignada', inplace=True)
-            
-            direcciones = group['direccion_texto'].tolist()
-            
-            # Si solo hay una visita, es un viaje de ida y vuelta (A->B)
-            if len(direcciones) == 1:
-                origen = punto_partida
-                destino = direcciones[0]
-                try:
-                    dist_matrix = gmaps.distance_matrix(origen, destino, mode="driving")
-                    km_dia = dist_matrix['rows'][0]['elements'][0].get('distance', {}).get('value', 0) / 1000
-                    km_por_coordinador[coordinador] = km_por_coordinador.get(coordinador, 0) + km_dia
-                except Exception:
-                    continue # Ignorar si hay un error con esta ruta
-            
-            # Si hay más de una visita, usamos la API Directions con waypoints (A->B->C->...)
-            else:
-                origen = punto_partida
-                destino = direcciones[-1]
-                waypoints = direcciones[:-1]
-
-                try:
-                    directions_result = gmaps.directions(origen, destino, waypoints=waypoints, mode="driving")
-                    if not directions_result:
-                        continue
-                    
-                    total_km_dia = 0
-                    for leg in directions_result[0]['legs']:
-                        total_km_dia += leg['distance']['value']
-                    
-                    km_por_coordinador[coordinador] = km_por_coordinador.get(coordinador, 0) + (total_km_dia / 1000)
-                except Exception:
-                    continue # Ignorar si hay un error con esta ruta
+
+            # Recorrido A->B->C->... desde el punto de partida
+            jornadas.append((coordinador, [punto_partida] + group['direccion_texto'].tolist()))
+
+        # Todos los tramos de todas las jornadas en una sola pasada por el caché de rutas
+        # (claves normalizadas y simétricas) y, si faltan, en bloques de la Distance Matrix API;
+        # los tramos repetidos entre días y coordinadores no se pagan dos veces
+        rutas_indices = optimizer.ensure_legs([paradas for _, paradas in jornadas])
+        metros = optimizer.matrix.meters
+        conocidos = optimizer.matrix.known
+
+        km_por_coordinador = {}
+        for (coordinador, _), indices in zip(jornadas, rutas_indices):
+            origenes, destinos = indices[:-1], indices[1:]
+            total_metros_dia = int(metros[origenes, destinos][conocidos[origenes, destinos]].sum())
+
+            if total_metros_dia:
+                km_por_coordinador[coordinador] = km_por_coordinador.get(coordinador, 0) + (total_metros_dia / 1000)
+
+        optimizer.flush_route_cache()
 
         if not km_por_coordinador:
             return 0, pd.DataFrame()
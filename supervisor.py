@@ -16,7 +16,8 @@ from ui_components import UIComponents
 from route_optimizer import RouteOptimizer
 from config import (
     get_daily_time_budget, DURACION_VISITA_SEGUNDOS,
-    PUNTO_INICIO_MARTIN, MIN_VISITAS_AUTO_ASIGNAR
+    PUNTO_INICIO_MARTIN, MIN_VISITAS_AUTO_ASIGNAR, TIEMPO_MAX_OPTIMIZACION_MS,
+    TIEMPO_MAX_LNS_MS, PREMIO_VISITA_PROPUESTA_SEG, TIEMPO_MAX_RECOMENDAR_DIAS_MS
 )
 from database import supabase
 
@@ -89,33 +90,77 @@ def load_weekly_visits():
 
 # ==================== ALGORITMO AUTOMÁTICO ====================
 
-def generar_planificacion_automatica(dias_seleccionados):
+def generar_planificacion_automatica(dias_seleccionados, progress_callback=None):
     """
     Genera planificación automática optimizada
 
+    La optimización se limita a TIEMPO_MAX_OPTIMIZACION_MS y el plan
+    resultante se mejora después con LNS durante TIEMPO_MAX_LNS_MS como
+    recogida de premios: las visitas con ayuda solicitada son obligatorias y
+    las 'Propuesta' valen PREMIO_VISITA_PROPUESTA_SEG. Antes de optimizar se
+    avisa si las obligatorias no pueden caber en los días elegidos.
+
     Args:
         dias_seleccionados: Lista de fechas (date objects)
+        progress_callback: Función progress_callback(fraccion, mensaje) para
+            mostrar el avance de la optimización
 
     Returns:
         Tupla (plan_final, visitas_no_planificadas)
     """
     services = get_services()
     optimizer = services['optimizer']
+    services['manager'].use_week_matrix(
+        dias_seleccionados[0] - timedelta(days=dias_seleccionados[0].weekday())
+    )
 
     visitas_obligatorias, visitas_opcionales = load_weekly_visits()
 
     if not visitas_obligatorias and not visitas_opcionales:
         return None, None
 
+    # Avisar antes de optimizar si las obligatorias no caben de ninguna forma
+    factible, minimo, disponible = optimizer.mandatory_feasibility(
+        visitas_obligatorias, dias_seleccionados, DURACION_VISITA_SEGUNDOS, get_daily_time_budget
+    )
+    if not factible:
+        st.error(
+            f"¡Atención! Las {len(visitas_obligatorias)} visitas con ayuda solicitada necesitan al menos "
+            f"{minimo / 3600:.1f} h y los días elegidos suman {disponible / 3600:.1f} h: no caben todas. "
+            "Se planificarán las que quepan."
+        )
+
     # Priorizar obligatorias primero
     todas_visitas = visitas_obligatorias + visitas_opcionales
 
+    # Avance: la primera mitad para optimize_multiday y la segunda para el LNS
+    avance_multidia = avance_lns = None
+    if progress_callback:
+        avance_multidia = lambda fraccion, mensaje: progress_callback(fraccion / 2, mensaje)
+        avance_lns = lambda fraccion, mensaje: progress_callback(0.5 + fraccion / 2, mensaje)
+
     # Optimizar multidía
     plan_final, visitas_no_planificadas = optimizer.optimize_multiday(
         todas_visitas,
         dias_seleccionados,
         DURACION_VISITA_SEGUNDOS,
-        get_daily_time_budget
+        get_daily_time_budget,
+        time_budget_ms=TIEMPO_MAX_OPTIMIZACION_MS,
+        anytime=True,
+        progress_callback=avance_multidia
+    )
+
+    # Mejorar el plan con LNS (más visitas en los mismos días)
+    plan_final, visitas_no_planificadas = optimizer.improve_plan(
+        plan_final,
+        visitas_no_planificadas,
+        dias_seleccionados,
+        DURACION_VISITA_SEGUNDOS,
+        get_daily_time_budget,
+        mandatory_ids=[v['id'] for v in visitas_obligatorias],
+        prizes={v['id']: PREMIO_VISITA_PROPUESTA_SEG for v in visitas_opcionales},
+        time_budget_ms=TIEMPO_MAX_LNS_MS,
+        progress_callback=avance_lns
     )
 
     # Verificar que todas las obligatorias están incluidas
@@ -132,6 +177,46 @@ def generar_planificacion_automatica(dias_seleccionados):
     return plan_final, visitas_no_planificadas
 
 
+def recomendar_dias(dias_candidatos, num_dias, progress_callback=None):
+    """
+    Recomienda qué num_dias días de la semana planificar
+
+    Planifica cada combinación de días igual que generar_planificacion_automatica
+    (optimize_multiday + improve_plan con obligatorias y premios), con
+    TIEMPO_MAX_RECOMENDAR_DIAS_MS en total para todas.
+
+    Args:
+        dias_candidatos: Lista de fechas (date objects) entre las que elegir
+        num_dias: Número de días a planificar
+        progress_callback: Función progress_callback(fraccion, mensaje)
+
+    Returns:
+        Ranking de RouteOptimizer.recommend_days (mejor primero), o [] si no hay visitas
+    """
+    services = get_services()
+    optimizer = services['optimizer']
+    services['manager'].use_week_matrix(
+        dias_candidatos[0] - timedelta(days=dias_candidatos[0].weekday())
+    )
+
+    visitas_obligatorias, visitas_opcionales = load_weekly_visits()
+
+    if not visitas_obligatorias and not visitas_opcionales:
+        return []
+
+    return optimizer.recommend_days(
+        visitas_obligatorias + visitas_opcionales,
+        dias_candidatos,
+        num_dias,
+        DURACION_VISITA_SEGUNDOS,
+        get_daily_time_budget,
+        mandatory_ids=[v['id'] for v in visitas_obligatorias],
+        prizes={v['id']: PREMIO_VISITA_PROPUESTA_SEG for v in visitas_opcionales},
+        time_budget_ms=TIEMPO_MAX_RECOMENDAR_DIAS_MS,
+        progress_callback=progress_callback
+    )
+
+
 # ==================== MODO AUTOMÁTICO ====================
 
 def modo_automatico():
@@ -152,9 +237,31 @@ def modo_automatico():
 
     num_dias = st.slider("¿Cuántos días quieres planificar?", min_value=1, max_value=5, value=3)
 
+    if st.button("💡 Recomendar días", use_container_width=True):
+        progreso = st.progress(0, text="Evaluando combinaciones de días...")
+        ranking = recomendar_dias(
+            dias_semana_siguiente, num_dias,
+            lambda fraccion, mensaje: progreso.progress(fraccion, text=mensaje)
+        )
+        progreso.empty()
+        st.session_state.dias_recomendados = ranking[0]['dias'] if ranking else None
+
+        if ranking:
+            st.dataframe(pd.DataFrame([{
+                'Días': ", ".join(dias_es.get(d.strftime('%A')) for d in r['dias']),
+                'Obligatorias': r['obligatorias'],
+                'Visitas': r['visitas'],
+                'Viaje (h)': round(r['tiempo_viaje'] / 3600, 1)
+            } for r in ranking]), use_container_width=True, hide_index=True)
+        else:
+            st.info("No hay visitas para la próxima semana.")
+
+    # Preseleccionar la recomendación si coincide con el número de días
+    recomendados = st.session_state.get('dias_recomendados') or []
     dias_seleccionados = st.multiselect(
         f"Elige {num_dias} días de la próxima semana:",
         options=dias_semana_siguiente,
+        default=recomendados if len(recomendados) == num_dias else None,
         format_func=lambda d: f"{dias_es.get(d.strftime('%A'))}, {d.strftime('%d/%m')}",
         max_selections=num_dias
     )
@@ -175,7 +282,11 @@ def modo_automatico():
             status_text.text("🧠 Optimizando rutas con algoritmo mejorado...")
             progress_bar.progress(40)
 
-            plan, no_asignadas = generar_planificacion_automatica(dias_seleccionados)
+            def mostrar_avance(fraccion, mensaje):
+                progress_bar.progress(40 + int(30 * fraccion))
+                status_text.text(f"🧠 {mensaje}")
+
+            plan, no_asignadas = generar_planificacion_automatica(dias_seleccionados, mostrar_avance)
 
             status_text.text("⏰ Calculando horarios...")
             progress_bar.progress(70)
@@ -235,6 +346,7 @@ def modo_manual():
     today = date.today()
     start_of_next_week = today + timedelta(days=-today.weekday(), weeks=1)
     end_of_next_week = start_of_next_week + timedelta(days=4)
+    manager.use_week_matrix(start_of_next_week)
 
     response = supabase.table('visitas').select('*, usuarios(nombre_completo)').neq(
         'status', 'Realizada'
@@ -299,7 +411,11 @@ def modo_manual():
 
             # Lista de visitas disponibles
             if visitas_disponibles:
-                for visita in visitas_disponibles:
+                # Scores de todas las visitas para todos los días, calculados una sola vez
+                dias_semana = [start_of_next_week + timedelta(days=i) for i in range(5)]
+                tabla_scores = scorer.score_matrix(visitas_disponibles, dias_semana, plan_manual)
+
+                for fila, visita in enumerate(visitas_disponibles):
                     with st.container(border=True):
                         c1, c2 = st.columns([3, 1])
 
@@ -310,14 +426,12 @@ def modo_manual():
 
                         with c2:
                             # Selector con scores
-                            dias_semana = [start_of_next_week + timedelta(days=i) for i in range(5)]
-                            scores_dias = scorer.calculate_scores_for_all_days(visita, dias_semana, plan_manual)
-                            dias_ordenados = scorer.sort_days_by_score(visita, dias_semana, plan_manual)
+                            dias_ordenados = tabla_scores.dias_ordenados(fila)
 
                             def format_dia_con_score(d):
                                 if d is None:
                                     return "Elegir día..."
-                                score_info = scores_dias[d.isoformat()]
+                                score_info = tabla_scores.score_info(fila, d)
                                 return f"{d.strftime('%a %d/%m')} {score_info.estrellas} ({score_info.capacidad_pct:.0f}%)"
 
                             dia_seleccionado = st.selectbox(
@@ -333,7 +447,7 @@ def modo_manual():
 
                                 # Verificar límite de jornada
                                 visitas_del_dia = manager.extract_visits_from_day(plan_manual.get(dia_iso, []))
-                                tiempo_actual = manager.calculate_day_time(visitas_del_dia)
+                                # Tiempo reoptimizado: el mismo que mostrará el día (queda memorizado)
                                 tiempo_con_nueva = manager.calculate_day_time(visitas_del_dia + [visita])
                                 limite_dia = get_daily_time_budget(dia_seleccionado.weekday())
 
@@ -399,6 +513,14 @@ def modo_manual():
                     on_apply=lambda sug: apply_suggestion_and_refresh(sug, plan_manual, balancer, manager)
                 )
 
+            if not analysis.plan_esta_balanceado:
+                if st.button("⚖️ Rebalancear toda la semana", key="rebalancear_manual", use_container_width=True):
+                    with st.spinner("Buscando el mejor reparto entre días..."):
+                        resultado = balancer.rebalance(plan_manual)
+                    manager.set_plan_manual(manager.convert_auto_to_manual(resultado.plan))
+                    st.success(f"✅ Plan rebalanceado ({resultado.movimientos_aplicados} movimientos)")
+                    st.rerun()
+
             if analysis.plan_esta_balanceado:
                 st.success("✅ El plan está bien balanceado. ¡Buen trabajo!")
 
@@ -432,6 +554,10 @@ def modo_hibrido():
     st.subheader("🔄 Modo Híbrido")
     st.info("Genera una propuesta automática optimizada y edítala antes de confirmar.")
 
+    # Matriz de distancias de la semana (se amplía al añadir visitas)
+    today = date.today()
+    manager.use_week_matrix(today + timedelta(days=-today.weekday(), weeks=1))
+
     if 'plan_hibrido' not in st.session_state:
         # Paso 1: Generar propuesta
         today = date.today()
@@ -456,7 +582,11 @@ def modo_hibrido():
             else:
                 with st.spinner("🧠 Generando propuesta optimizada..."):
                     dias_seleccionados.sort()
-                    plan, no_asignadas = generar_planificacion_automatica(dias_seleccionados)
+                    progreso = st.progress(0)
+                    plan, no_asignadas = generar_planificacion_automatica(
+                        dias_seleccionados,
+                        lambda fraccion, mensaje: progreso.progress(fraccion, text=mensaje)
+                    )
 
                     if plan:
                         st.session_state.plan_hibrido = plan
@@ -527,7 +657,7 @@ def modo_hibrido():
                     )
 
                     if nueva_visita:
-                        tiempo_actual = manager.calculate_day_time(visitas_dia)
+                        # Tiempo reoptimizado: el mismo que mostrará el día (queda memorizado)
                         tiempo_con_nueva = manager.calculate_day_time(visitas_dia + [nueva_visita])
                         limite = get_daily_time_budget(dia.weekday())
 
@@ -0,0 +1,163 @@
+"""
+Elementos de la Distance Matrix API pedidos por la ruta en bloque (tiles)
+
+Se sustituyen el cliente de googlemaps y la tabla rutas_cache por dobles en
+memoria para contar peticiones y elementos con el caché frío y caliente.
+"""
+import os
+import sys
+from datetime import datetime
+from itertools import combinations
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import route_optimizer  # noqa: E402
+from config import GOOGLE_MAPS_CHUNK_SIZE, GOOGLE_MAPS_MAX_ELEMENTOS  # noqa: E402
+from route_cache import get_route_memory_cache  # noqa: E402
+
+
+class FakeGmaps:
+    """Cliente de Distance Matrix que cuenta peticiones y elementos"""
+
+    def __init__(self):
+        self.requests = 0
+        self.elements = 0
+
+    def distance_matrix(self, origins, destinations, mode="driving"):
+        origins = [origins] if isinstance(origins, str) else origins
+        destinations = [destinations] if isinstance(destinations, str) else destinations
+        assert len(origins) <= GOOGLE_MAPS_CHUNK_SIZE
+        assert len(destinations) <= GOOGLE_MAPS_CHUNK_SIZE
+        assert len(origins) * len(destinations) <= GOOGLE_MAPS_MAX_ELEMENTOS
+
+        self.requests += 1
+        self.elements += len(origins) * len(destinations)
+        return {'rows': [
+            {'elements': [
+                {'status': 'OK', 'distance': {'value': 1000 + k}, 'duration': {'value': 60 + k}}
+                for k, _ in enumerate(destinations)
+            ]}
+            for _ in origins
+        ]}
+
+
+class FakeQuery:
+    """Subconjunto de la API de consultas de supabase usado por rutas_cache"""
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.filtros = []
+        self.escritura = None
+        self.rango = None
+        self.limite = None
+
+    def select(self, *args):
+        return self
+
+    def in_(self, columna, valores):
+        valores = set(valores)
+        self.filtros.append(lambda fila: fila[columna] in valores)
+        return self
+
+    def gte(self, columna, valor):
+        self.filtros.append(lambda fila: fila[columna] >= valor)
+        return self
+
+    def range(self, inicio, fin):
+        self.rango = (inicio, fin)
+        return self
+
+    def limit(self, n):
+        self.limite = n
+        return self
+
+    def upsert(self, filas, on_conflict=None):
+        self.escritura = filas
+        return self
+
+    def insert(self, filas):
+        self.escritura = filas
+        return self
+
+    def execute(self):
+        if self.escritura is not None:
+            for fila in self.escritura:
+                fila = dict(fila, fecha_calculo=fila.get('fecha_calculo') or datetime.now().isoformat())
+                self.filas[(fila['origen'], fila['destino'])] = fila
+            return type('Respuesta', (), {'data': self.escritura})()
+
+        data = [fila for fila in self.filas.values() if all(f(fila) for f in self.filtros)]
+        if self.rango:
+            data = data[self.rango[0]:self.rango[1] + 1]
+        if self.limite:
+            data = data[:self.limite]
+        return type('Respuesta', (), {'data': data})()
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.filas = {}
+
+    def table(self, nombre):
+        assert nombre == 'rutas_cache'
+        return FakeQuery(self.filas)
+
+
+@pytest.fixture
+def entorno(monkeypatch):
+    gmaps = FakeGmaps()
+    db = FakeSupabase()
+    monkeypatch.setattr(route_optimizer.googlemaps, 'Client', lambda key=None: gmaps)
+    monkeypatch.setattr(route_optimizer.st, 'secrets', {'google': {'api_key': 'test'}})
+    monkeypatch.setattr(route_optimizer, 'supabase', db)
+    get_route_memory_cache().clear()
+    yield gmaps, db
+    get_route_memory_cache().clear()
+
+
+def _direcciones(n):
+    return [f"Carrer {k}, Girona" for k in range(n)]
+
+
+def test_cache_frio_pide_cada_par_una_vez(entorno):
+    gmaps, db = entorno
+    direcciones = _direcciones(30)
+
+    optimizer = route_optimizer.RouteOptimizer()
+    optimizer.build_distance_matrix(direcciones)
+
+    pares = len(direcciones) * (len(direcciones) - 1) // 2
+    assert gmaps.elements == optimizer.api_elements == pares
+    assert gmaps.requests == optimizer.api_requests
+    assert gmaps.requests >= -(-pares // GOOGLE_MAPS_MAX_ELEMENTOS)
+    assert len(db.filas) == pares
+
+
+def test_cache_caliente_no_pide_elementos(entorno):
+    gmaps, db = entorno
+    direcciones = _direcciones(30)
+    route_optimizer.RouteOptimizer().build_distance_matrix(direcciones)
+    pedidos = gmaps.elements
+
+    # Otro proceso: matriz y caché en memoria vacíos, solo rutas_cache
+    get_route_memory_cache().clear()
+    optimizer = route_optimizer.RouteOptimizer()
+    _, tiempos = optimizer.build_distance_matrix(direcciones)
+
+    assert gmaps.elements == pedidos
+    assert optimizer.api_elements == optimizer.api_requests == 0
+    assert all(tiempos[i][j] > 0 for i, j in combinations(range(len(direcciones)), 2))
+
+
+def test_ampliar_matriz_solo_pide_pares_nuevos(entorno):
+    gmaps, _ = entorno
+    direcciones = _direcciones(31)
+
+    optimizer = route_optimizer.RouteOptimizer()
+    optimizer.build_distance_matrix(direcciones[:-1])
+    pedidos = gmaps.elements
+    optimizer.build_distance_matrix(direcciones)
+
+    assert gmaps.elements - pedidos == len(direcciones) - 1
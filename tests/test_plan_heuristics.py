@@ -0,0 +1,189 @@
+"""
+Búsqueda entre días (plan_heuristics) y RouteOptimizer.improve_plan
+
+Invariantes sobre instancias aleatorias: cada visita queda en un solo día o
+sin asignar, ningún día pasa de su jornada, las obligatorias siguen en el
+plan y el coste nunca empeora respecto al plan de partida.
+"""
+import os
+import random
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plan_heuristics  # noqa: E402
+import route_optimizer  # noqa: E402
+from config import PENALIZACION_VISITA_NO_ASIGNADA_SEG  # noqa: E402
+from distance_matrix import DistanceMatrix  # noqa: E402
+
+DURACION = 1800
+
+
+def _matriz(n, rng):
+    """Tiempos euclídeos (métricos y simétricos) entre n puntos al azar"""
+    puntos = np.array([(rng.uniform(0, 40), rng.uniform(0, 40)) for _ in range(n)])
+    km = np.sqrt(((puntos[:, None, :] - puntos[None, :, :]) ** 2).sum(axis=2))
+    return (km * 90).astype(np.int64)
+
+
+def _tiempo_dia(ruta, tm, depot, closed):
+    if not ruta:
+        return 0
+    puntos = ([depot] if depot is not None else []) + list(ruta)
+    tiempo = sum(int(tm[a, b]) for a, b in zip(puntos, puntos[1:])) + len(ruta) * DURACION
+    if closed and depot is not None:
+        tiempo += int(tm[ruta[-1], depot])
+    return tiempo
+
+
+def _coste(rutas, libres, tm, depot, closed, premios):
+    return (sum(_tiempo_dia(r, tm, depot, closed) for r in rutas)
+            + sum(premios.get(v, PENALIZACION_VISITA_NO_ASIGNADA_SEG) for v in libres))
+
+
+def _reparto(rutas, libres):
+    return Counter(v for ruta in rutas for v in ruta) + Counter(libres)
+
+
+@pytest.mark.parametrize("depot,closed", [(None, False), (0, False), (0, True)])
+def test_ruin_and_recreate_invariantes(depot, closed):
+    rng = random.Random(17)
+    for semilla in range(6):
+        tm = _matriz(41, rng)
+        visitas = list(range(1, 41)) if depot is not None else list(range(41))
+        limites = [rng.choice([5, 6, 7]) * 3600 for _ in range(4)]
+        rutas, libres = plan_heuristics.savings_routes(tm, visitas, DURACION, limites, depot=depot, closed=closed)
+
+        planificadas = [v for ruta in rutas for v in ruta]
+        obligatorias = rng.sample(planificadas, 4)
+        fijas = rng.sample([v for v in planificadas if v not in obligatorias], 2)
+        dia_fija = {v: d for d, ruta in enumerate(rutas) for v in ruta if v in fijas}
+        premios = {v: rng.randint(600, 7200) for v in visitas}
+
+        nuevas, nuevas_libres = plan_heuristics.ruin_and_recreate(
+            tm, rutas, libres, DURACION, limites, fijas=fijas, obligatorias=obligatorias,
+            premios=premios, depot=depot, closed=closed, time_budget_ms=150, seed=semilla
+        )
+
+        assert _reparto(nuevas, nuevas_libres) == Counter(visitas)
+        for ruta, limite in zip(nuevas, limites):
+            assert _tiempo_dia(ruta, tm, depot, closed) <= limite
+        assert not set(obligatorias) & set(nuevas_libres)
+        for v, d in dia_fija.items():
+            assert v in nuevas[d]
+        assert (_coste(nuevas, nuevas_libres, tm, depot, closed, premios)
+                <= _coste(rutas, libres, tm, depot, closed, premios))
+
+
+def test_ruin_and_recreate_mete_obligatorias_que_faltaban():
+    rng = random.Random(23)
+    tm = _matriz(31, rng)
+    limites = [6 * 3600] * 3
+    rutas, libres = plan_heuristics.savings_routes(tm, list(range(1, 31)), DURACION, limites, depot=0)
+    assert libres
+    obligatorias = libres[:2]
+
+    nuevas, nuevas_libres = plan_heuristics.ruin_and_recreate(
+        tm, rutas, libres, DURACION, limites, obligatorias=obligatorias, depot=0, time_budget_ms=150
+    )
+
+    assert not set(obligatorias) & set(nuevas_libres)
+    assert _reparto(nuevas, nuevas_libres) == Counter(range(1, 31))
+    for ruta, limite in zip(nuevas, limites):
+        assert _tiempo_dia(ruta, tm, 0, False) <= limite
+
+
+def test_best_moves_delta_coincide_con_el_plan_aplicado():
+    rng = random.Random(29)
+    for _ in range(20):
+        tm = _matriz(24, rng)
+        visitas = list(range(24))
+        rng.shuffle(visitas)
+        rutas = [visitas[k::4] for k in range(4)]
+        limites = [rng.choice([4, 5, 6]) * 3600 for _ in rutas]
+
+        def coste(rs):
+            return sum(
+                int(plan_heuristics.day_cost(plan_heuristics.day_time(r, tm, DURACION), limite))
+                for r, limite in zip(rs, limites)
+            )
+
+        for movimiento in plan_heuristics.best_moves(rutas, tm, DURACION, limites):
+            aplicado = plan_heuristics.apply_move(rutas, movimiento)
+
+            assert movimiento['delta'] < 0
+            assert coste(aplicado) - coste(rutas) == movimiento['delta']
+            assert _reparto(aplicado, []) == Counter(visitas)
+
+
+def test_rebalance_no_empeora_el_plan():
+    rng = random.Random(31)
+    for _ in range(10):
+        tm = _matriz(30, rng)
+        visitas = list(range(30))
+        rng.shuffle(visitas)
+        # Días descompensados: uno sobrecargado y otro casi vacío
+        rutas = [visitas[:14], visitas[14:17], visitas[17:24], visitas[24:]]
+        limites = [6 * 3600] * 4
+
+        def coste(rs):
+            return sum(
+                int(plan_heuristics.day_cost(plan_heuristics.day_time(r, tm, DURACION), limite))
+                for r, limite in zip(rs, limites)
+            )
+
+        nuevas, aplicados = plan_heuristics.rebalance(rutas, tm, DURACION, limites, time_budget_ms=500)
+
+        assert _reparto(nuevas, []) == Counter(visitas)
+        assert coste(nuevas) <= coste(rutas)
+        assert all(m['delta'] < 0 for m in aplicados)
+
+
+@pytest.fixture
+def optimizer(monkeypatch):
+    monkeypatch.setattr(route_optimizer.googlemaps, 'Client', lambda key=None: None)
+    monkeypatch.setattr(route_optimizer.st, 'secrets', {'google': {'api_key': 'test'}})
+
+    rng = random.Random(37)
+    tm = _matriz(36, rng)
+    direcciones = [f"Carrer {k}, Girona" for k in range(36)]
+    matrix = DistanceMatrix()
+    indices = matrix.add_locations(direcciones)
+    for a in range(36):
+        for b in range(a + 1, 36):
+            matrix.set_pair(indices[a], indices[b], int(tm[a, b]) * 10, int(tm[a, b]))
+    return route_optimizer.RouteOptimizer(matrix), direcciones
+
+
+@pytest.mark.parametrize("return_to_depot", [False, True])
+def test_improve_plan_invariantes(optimizer, return_to_depot):
+    optimizer, direcciones = optimizer
+    depot = direcciones[0]
+    visitas = [{'id': k, 'direccion_texto': d} for k, d in enumerate(direcciones[1:], 1)]
+    dias = [date(2026, 10, 19) + timedelta(days=k) for k in range(3)]
+    jornada = lambda wd: 6 * 3600  # noqa: E731
+
+    plan, no_asignadas = optimizer.optimize_multiday(
+        visitas, dias, DURACION, jornada, depot=depot, return_to_depot=return_to_depot
+    )
+    obligatorias = {v['id'] for datos in plan.values() for v in datos['ruta'][:2]}
+
+    mejorado, sin_dia = optimizer.improve_plan(
+        plan, no_asignadas, dias, DURACION, jornada, depot=depot, return_to_depot=return_to_depot,
+        mandatory_ids=obligatorias, time_budget_ms=200
+    )
+
+    ids = [v['id'] for datos in mejorado.values() for v in datos['ruta']] + [v['id'] for v in sin_dia]
+    assert sorted(ids) == list(range(1, 36))
+    assert all(datos['tiempo_total'] <= 6 * 3600 for datos in mejorado.values())
+    assert obligatorias <= {v['id'] for datos in mejorado.values() for v in datos['ruta']}
+
+    def coste(p, libres):
+        return (sum(datos['tiempo_total'] for datos in p.values())
+                + len(libres) * PENALIZACION_VISITA_NO_ASIGNADA_SEG)
+    assert coste(mejorado, sin_dia) <= coste(plan, no_asignadas)
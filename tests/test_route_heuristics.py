@@ -0,0 +1,74 @@
+"""
+Ruta exacta (route_heuristics.held_karp) frente a fuerza bruta
+
+Matrices aleatorias de hasta 8 puntos con el punto 0 como inicio fijo,
+como camino abierto y como circuito que vuelve al inicio.
+"""
+import os
+import random
+import sys
+from itertools import permutations
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import route_heuristics  # noqa: E402
+
+
+def _matriz(n, rng, simetrica=True):
+    matriz = [[0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            matriz[i][j] = rng.randint(60, 3600)
+            matriz[j][i] = matriz[i][j] if simetrica else rng.randint(60, 3600)
+    return matriz
+
+
+def _fuerza_bruta(matriz, closed):
+    return min(
+        route_heuristics.route_travel_time([0, *resto], matriz, closed)
+        for resto in permutations(range(1, len(matriz)))
+    )
+
+
+@pytest.fixture(autouse=True)
+def memoria_vacia():
+    route_heuristics._exact_routes.clear()
+    yield
+    route_heuristics._exact_routes.clear()
+
+
+@pytest.mark.parametrize("closed", [False, True])
+@pytest.mark.parametrize("simetrica", [True, False])
+def test_held_karp_igual_que_fuerza_bruta(closed, simetrica):
+    rng = random.Random(7)
+    for n in range(1, 9):
+        for _ in range(5):
+            matriz = _matriz(n, rng, simetrica)
+            ruta = route_heuristics.held_karp(matriz, closed)
+
+            assert ruta[0] == 0
+            assert sorted(ruta) == list(range(n))
+            assert route_heuristics.route_travel_time(ruta, matriz, closed) == _fuerza_bruta(matriz, closed)
+
+
+def test_memoria_distingue_ruta_abierta_y_circuito():
+    rng = random.Random(11)
+    for _ in range(20):
+        matriz = _matriz(7, rng)
+        for closed in (False, True):
+            primera = route_heuristics.held_karp(matriz, closed)
+            # Segunda llamada: sale de la memoria por la huella de la matriz
+            segunda = route_heuristics.held_karp([fila[:] for fila in matriz], closed)
+
+            assert segunda == primera
+            assert route_heuristics.route_travel_time(segunda, matriz, closed) == _fuerza_bruta(matriz, closed)
+
+
+def test_solve_route_exacta_hasta_el_limite():
+    rng = random.Random(3)
+    matriz = _matriz(8, rng)
+    for closed in (False, True):
+        ruta = route_heuristics.solve_route(matriz, closed=closed)
+        assert route_heuristics.route_travel_time(ruta, matriz, closed) == _fuerza_bruta(matriz, closed)
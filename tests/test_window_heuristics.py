@@ -0,0 +1,159 @@
+"""
+Rutas con franjas horarias (window_heuristics)
+
+Comprueba sobre instancias aleatorias que las visitas que se devuelven en
+la ruta empiezan dentro de su franja, que al llegar antes se espera a que
+abra y que las que no caben se informan como no asignadas en lugar de
+colocarse tarde.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import route_heuristics  # noqa: E402
+import window_heuristics as wh  # noqa: E402
+
+DURACION = 1800
+INICIO = 9 * 3600
+FIN_DIA = 18 * 3600
+
+
+def _instancia(n, rng):
+    matriz = [[0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            matriz[i][j] = matriz[j][i] = rng.randint(300, 1800)
+
+    ventanas = []
+    for _ in range(n):
+        if rng.random() < 0.3:
+            ventanas.append(None)
+        else:
+            abre = rng.randrange(9, 17) * 3600
+            ventanas.append((abre, abre + rng.choice([1, 2, 3]) * 3600))
+    return matriz, ventanas
+
+
+def _factible(route, matriz, ventanas, depot, closed):
+    inicios = wh.schedule(route, matriz, DURACION, ventanas, INICIO, depot)
+    for v, hora in zip(route, inicios):
+        if ventanas[v] is not None:
+            assert ventanas[v][0] <= hora <= ventanas[v][1]
+    fin = wh.route_end(route, inicios, matriz, DURACION, depot, closed)
+    assert fin is None or fin <= FIN_DIA
+    return inicios
+
+
+def test_parse_franja():
+    assert wh.parse_franja("10:00-12:30") == (36000, 45000)
+    assert wh.parse_franja("9:15 - 11:00") == (33300, 39600)
+    assert wh.parse_franja("12:00-10:00") is None
+    assert wh.parse_franja("mañana") is None
+    assert wh.parse_franja(None) is None
+
+
+def test_llegar_antes_espera_a_que_abra():
+    matriz = [[0, 600, 900], [600, 0, 300], [900, 300, 0]]
+    ventanas = [None, (10 * 3600, 12 * 3600), None]
+
+    inicios = wh.schedule([0, 1, 2], matriz, DURACION, ventanas, INICIO, depot=True)
+
+    # Se llega a las 9:10 y se espera a las 10:00; la siguiente sale al terminar
+    assert inicios == [INICIO, 10 * 3600, 10 * 3600 + DURACION + 300]
+
+
+@pytest.mark.parametrize("depot,closed", [(False, False), (True, False), (True, True)])
+def test_insert_visits_respeta_franjas_y_jornada(depot, closed):
+    rng = random.Random(5)
+    for _ in range(40):
+        matriz, ventanas = _instancia(12, rng)
+        candidatas = list(range(1 if depot else 0, 12))
+        rng.shuffle(candidatas)
+
+        for cheapest in (False, True):
+            route, no_insertadas = wh.insert_visits(
+                [0] if depot else [], candidatas, matriz, DURACION, ventanas, INICIO, FIN_DIA,
+                depot, closed, cheapest=cheapest
+            )
+
+            assert sorted(route[1:] if depot else route) == sorted(set(candidatas) - set(no_insertadas))
+            assert len(route) + len(no_insertadas) == len(candidatas) + (1 if depot else 0)
+            _factible(route, matriz, ventanas, depot, closed)
+
+
+@pytest.mark.parametrize("depot,closed", [(False, False), (True, True)])
+def test_holgura_hacia_delante_es_exacta(depot, closed):
+    rng = random.Random(9)
+    for _ in range(30):
+        matriz, ventanas = _instancia(9, rng)
+        route, _ = wh.insert_visits(
+            [0] if depot else [], range(1 if depot else 0, 9), matriz, DURACION, ventanas,
+            INICIO, FIN_DIA, depot, closed
+        )
+        inicios = wh.schedule(route, matriz, DURACION, ventanas, INICIO, depot)
+        holgura = wh.forward_slack(route, inicios, matriz, DURACION, ventanas, FIN_DIA, depot, closed)
+
+        for k, margen in enumerate(holgura):
+            assert margen >= 0
+            if margen == wh.SIN_LIMITE:
+                continue
+            # Retrasar la parada k su holgura mantiene la ruta factible; un segundo más, no
+            for retraso, factible in ((margen, True), (margen + 1, False)):
+                horas = list(inicios[:k]) + [inicios[k] + retraso]
+                for j in range(k + 1, len(route)):
+                    llegada = horas[-1] + wh._servicio(j - 1, DURACION, depot) + matriz[route[j - 1]][route[j]]
+                    horas.append(max(llegada, ventanas[route[j]][0]) if ventanas[route[j]] else llegada)
+                fin = wh.route_end(route, horas, matriz, DURACION, depot, closed)
+                assert (wh.lateness(route, horas, ventanas, FIN_DIA, fin) == 0) == factible
+
+
+def test_relocate_no_empeora_ni_rompe_franjas():
+    rng = random.Random(13)
+    for _ in range(30):
+        matriz, ventanas = _instancia(10, rng)
+        route, _ = wh.insert_visits([0], range(1, 10), matriz, DURACION, ventanas, INICIO, FIN_DIA, depot=True)
+
+        mejorada = wh.relocate(route, matriz, DURACION, ventanas, INICIO, FIN_DIA, depot=True)
+
+        assert mejorada[0] == 0 and sorted(mejorada) == sorted(route)
+        assert route_heuristics.route_travel_time(mejorada, matriz) <= route_heuristics.route_travel_time(route, matriz)
+        _factible(mejorada, matriz, ventanas, True, False)
+
+
+def test_visita_imposible_se_informa_sin_colocarla_tarde():
+    matriz = [[0, 600, 600], [600, 0, 600], [600, 600, 0]]
+    # La franja de 2 cierra antes de poder llegar (salida a las 9:00)
+    ventanas = [None, (10 * 3600, 11 * 3600), (9 * 3600, 9 * 3600 + 300)]
+
+    route, no_insertadas = wh.insert_visits(
+        [0], [1, 2], matriz, DURACION, ventanas, INICIO, FIN_DIA, depot=True
+    )
+    assert route == [0, 1]
+    assert no_insertadas == [2]
+
+    ruta, fuera = wh.solve_route_windows(matriz, DURACION, ventanas, INICIO, FIN_DIA, depot=True)
+    assert fuera == [2]
+    _factible([v for v in ruta if v not in fuera], matriz, ventanas, True, False)
+
+
+@pytest.mark.parametrize("depot,closed", [(False, False), (True, False), (True, True)])
+def test_solve_route_windows_solo_informa_las_que_no_caben(depot, closed):
+    rng = random.Random(21)
+    for _ in range(30):
+        matriz, ventanas = _instancia(11, rng)
+
+        ruta, fuera = wh.solve_route_windows(matriz, DURACION, ventanas, INICIO, FIN_DIA, depot, closed)
+
+        assert sorted(ruta) == list(range(11))
+        dentro = [v for v in ruta if v not in fuera]
+        _factible(dentro, matriz, ventanas, depot, closed)
+        # Ninguna de las informadas cabía en la ruta de las que sí se planifican
+        inicios = wh.schedule(dentro, matriz, DURACION, ventanas, INICIO, depot)
+        holgura = wh.forward_slack(dentro, inicios, matriz, DURACION, ventanas, FIN_DIA, depot, closed)
+        for v in fuera:
+            assert wh.best_insertion(dentro, inicios, holgura, v, matriz, DURACION, ventanas,
+                                     INICIO, FIN_DIA, depot, closed) is None
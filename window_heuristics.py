@@ -0,0 +1,318 @@
+"""
+Rutas con franjas horarias (VRPTW) sobre matrices de tiempos en memoria
+
+Cada visita puede tener una franja (inicio, fin) en segundos desde medianoche
+en la que debe empezar; si se llega antes se espera a que abra. El día empieza
+a la hora de inicio y no puede terminar después de `fin` (inicio + jornada).
+Como en route_heuristics, route[0] es fijo y, con depot=True, es el punto de
+partida (sin duración de visita).
+
+La factibilidad de insertar una visita se comprueba en O(1) con la holgura
+hacia delante de cada posición: cuánto se puede retrasar esa visita sin que
+ninguna posterior salga de su franja ni el día se pase de la jornada.
+"""
+import re
+import time
+
+from config import TIEMPO_MAX_BUSQUEDA_LOCAL_MS
+
+# Valor de "sin límite" para franjas abiertas y el fin del día
+SIN_LIMITE = float('inf')
+
+
+def parse_franja(franja):
+    """
+    Convierte una franja "HH:MM-HH:MM" en segundos desde medianoche
+
+    Args:
+        franja: Texto de la franja (p. ej. "10:00-12:00"), o None
+
+    Returns:
+        Tupla (inicio, fin) en segundos, o None si no hay franja válida
+    """
+    horas = re.findall(r'(\d{1,2}):(\d{2})', franja or '')
+    if len(horas) != 2:
+        return None
+
+    (h1, m1), (h2, m2) = horas
+    inicio, fin = int(h1) * 3600 + int(m1) * 60, int(h2) * 3600 + int(m2) * 60
+    return (inicio, fin) if inicio <= fin else None
+
+
+def _servicio(k, duracion, depot):
+    """Duración de la parada en la posición k (el punto de partida no tiene)"""
+    return 0 if depot and k == 0 else duracion
+
+
+def schedule(route, time_matrix, duracion, ventanas, inicio, depot=False):
+    """
+    Hora de inicio de cada parada, esperando a que abra su franja si se llega antes
+
+    Args:
+        route: Ruta (lista de índices)
+        time_matrix: Matriz de tiempos
+        duracion: Duración de cada visita
+        ventanas: Franja (inicio, fin) o None por índice de la matriz
+        inicio: Hora de inicio del día (segundos)
+        depot: Si True, route[0] es el punto de partida
+
+    Returns:
+        Lista con la hora de inicio de cada posición
+    """
+    inicios = []
+    hora = inicio
+    for k, v in enumerate(route):
+        if k:
+            hora = inicios[-1] + _servicio(k - 1, duracion, depot) + time_matrix[route[k - 1]][v]
+        if ventanas[v] is not None:
+            hora = max(hora, ventanas[v][0])
+        inicios.append(hora)
+    return inicios
+
+
+def route_end(route, inicios, time_matrix, duracion, depot=False, closed=False):
+    """Hora a la que termina el día (con la vuelta a route[0] si closed)"""
+    if not route:
+        return None
+    fin = inicios[-1] + _servicio(len(route) - 1, duracion, depot)
+    if closed and len(route) > 1:
+        fin += time_matrix[route[-1]][route[0]]
+    return fin
+
+
+def lateness(route, inicios, ventanas, fin_dia=SIN_LIMITE, fin_ruta=None):
+    """Segundos de retraso sumados (llegadas tras el cierre de la franja y exceso de jornada)"""
+    retraso = sum(
+        max(0, hora - ventanas[v][1]) for v, hora in zip(route, inicios) if ventanas[v] is not None
+    )
+    if fin_ruta is not None:
+        retraso += max(0, fin_ruta - fin_dia)
+    return retraso
+
+
+def forward_slack(route, inicios, time_matrix, duracion, ventanas, fin_dia=SIN_LIMITE,
+                  depot=False, closed=False):
+    """
+    Holgura hacia delante de cada posición
+
+    holgura[k] es lo máximo que se puede retrasar el inicio de la parada k
+    sin que ella ni ninguna posterior salgan de su franja ni el día termine
+    después de fin_dia. Las esperas de las paradas posteriores absorben
+    parte del retraso. Negativa si la ruta ya no es factible.
+
+    Returns:
+        Lista con la holgura de cada posición
+    """
+    n = len(route)
+    holgura = [0] * n
+    if not n:
+        return holgura
+
+    siguiente = fin_dia - route_end(route, inicios, time_matrix, duracion, depot, closed)
+    for k in range(n - 1, -1, -1):
+        v = route[k]
+        cierre = ventanas[v][1] - inicios[k] if ventanas[v] is not None else SIN_LIMITE
+        holgura[k] = min(cierre, siguiente)
+        if k:
+            # La espera de esta parada absorbe el retraso de la anterior
+            llegada = inicios[k - 1] + _servicio(k - 1, duracion, depot) + time_matrix[route[k - 1]][v]
+            siguiente = inicios[k] - llegada + holgura[k]
+    return holgura
+
+
+def best_insertion(route, inicios, holgura, v, time_matrix, duracion, ventanas, inicio,
+                   fin_dia=SIN_LIMITE, depot=False, closed=False):
+    """
+    Posición factible más barata (menos viaje añadido) para insertar v
+
+    Cada posición se comprueba en O(1) con los inicios y la holgura de la
+    ruta actual.
+
+    Returns:
+        Tupla (posicion, viaje_añadido), o None si no cabe en ninguna
+    """
+    d = time_matrix
+    n = len(route)
+    abre, cierra = ventanas[v] if ventanas[v] is not None else (-SIN_LIMITE, SIN_LIMITE)
+    mejor = None
+
+    for p in range(1 if depot else 0, n + 1):
+        prev = route[p - 1] if p else None
+        nxt = route[p] if p < n else None
+
+        llegada = inicio if prev is None else inicios[p - 1] + _servicio(p - 1, duracion, depot) + d[prev][v]
+        hora = max(llegada, abre)
+        if hora > cierra:
+            continue
+
+        if nxt is not None:
+            # Cuánto se retrasa la parada siguiente
+            retraso = max(0, hora + duracion + d[v][nxt] - inicios[p])
+            if retraso > holgura[p]:
+                continue
+            extra = d[v][nxt] - (d[prev][nxt] if prev is not None else 0)
+        else:
+            vuelta = d[v][route[0]] if closed and n else 0
+            if hora + duracion + vuelta > fin_dia:
+                continue
+            extra = vuelta - (d[prev][route[0]] if closed and prev is not None and n > 1 else 0)
+        if prev is not None:
+            extra += d[prev][v]
+
+        if mejor is None or extra < mejor[1]:
+            mejor = (p, extra)
+
+    return mejor
+
+
+def insert_visits(route, candidatas, time_matrix, duracion, ventanas, inicio, fin_dia=SIN_LIMITE,
+                  depot=False, closed=False, cheapest=False):
+    """
+    Inserta candidatas en la ruta respetando franjas y jornada
+
+    Con cheapest=False se prueban en el orden recibido (cada una en su
+    posición más barata); con cheapest=True se inserta en cada paso la
+    candidata que menos viaje añade de todas.
+
+    Returns:
+        (ruta, no_insertadas): nueva ruta y candidatas sin hueco, en orden
+    """
+    route = list(route)
+    pendientes = list(candidatas)
+    no_insertadas = []
+
+    def estado():
+        inicios = schedule(route, time_matrix, duracion, ventanas, inicio, depot)
+        return inicios, forward_slack(route, inicios, time_matrix, duracion, ventanas, fin_dia, depot, closed)
+
+    inicios, holgura = estado()
+    while pendientes:
+        if cheapest:
+            opciones = []
+            for v in pendientes:
+                hueco = best_insertion(route, inicios, holgura, v, time_matrix, duracion, ventanas,
+                                       inicio, fin_dia, depot, closed)
+                if hueco is not None:
+                    opciones.append((hueco[1], v, hueco[0]))
+            if not opciones:
+                break
+            _, v, p = min(opciones, key=lambda o: o[0])
+        else:
+            v = pendientes[0]
+            hueco = best_insertion(route, inicios, holgura, v, time_matrix, duracion, ventanas,
+                                   inicio, fin_dia, depot, closed)
+            if hueco is None:
+                no_insertadas.append(pendientes.pop(0))
+                continue
+            p = hueco[0]
+
+        route.insert(p, v)
+        pendientes.remove(v)
+        inicios, holgura = estado()
+
+    return route, no_insertadas + pendientes
+
+
+def relocate(route, time_matrix, duracion, ventanas, inicio, fin_dia=SIN_LIMITE, depot=False,
+             closed=False, deadline=None):
+    """
+    Búsqueda local "relocate" con franjas
+
+    Saca cada visita y la vuelve a insertar en su posición factible más
+    barata si así se ahorra viaje, hasta que ningún movimiento mejora.
+
+    Returns:
+        Ruta mejorada (nueva lista); factible si la de partida lo era
+    """
+    route = list(route)
+    d = time_matrix
+    mejorado = True
+
+    while mejorado:
+        mejorado = False
+        for k in range(1 if depot else 0, len(route)):
+            if deadline is not None and time.perf_counter() > deadline:
+                return route
+
+            v = route[k]
+            prev = route[k - 1] if k else None
+            nxt = route[k + 1] if k + 1 < len(route) else None
+            if nxt is not None:
+                ahorro = d[v][nxt] - (d[prev][nxt] if prev is not None else 0)
+            else:
+                ahorro = (d[v][route[0]] - d[prev][route[0]]) if closed and prev is not None and k > 1 else 0
+            if prev is not None:
+                ahorro += d[prev][v]
+
+            resto = route[:k] + route[k + 1:]
+            inicios = schedule(resto, d, duracion, ventanas, inicio, depot)
+            holgura = forward_slack(resto, inicios, d, duracion, ventanas, fin_dia, depot, closed)
+            if holgura and min(holgura) < 0:
+                # Quitarla no deja una ruta factible (matriz no métrica): no tocar
+                continue
+
+            hueco = best_insertion(resto, inicios, holgura, v, d, duracion, ventanas, inicio,
+                                   fin_dia, depot, closed)
+            if hueco is not None and hueco[1] < ahorro and hueco[0] != k:
+                resto.insert(hueco[0], v)
+                route = resto
+                mejorado = True
+
+    return route
+
+
+def solve_route_windows(time_matrix, duracion, ventanas, inicio, fin_dia=SIN_LIMITE, depot=False,
+                        closed=False, time_budget_ms=None):
+    """
+    Ruta con todas las visitas respetando las franjas siempre que se pueda
+
+    Inserta primero las visitas de franja más temprana en cerrar (las más
+    restringidas) en su posición factible más barata, mejora con relocate,
+    vuelve a probar las que no cabían y, si alguna sigue sin hueco, la añade
+    donde menos retraso provoque para que la ruta las incluya todas.
+
+    Args:
+        time_matrix: Matriz de tiempos (lista de listas)
+        duracion: Duración de cada visita
+        ventanas: Franja (inicio, fin) o None por índice de la matriz
+        inicio: Hora de inicio del día (segundos)
+        fin_dia: Hora límite de fin del día (segundos)
+        depot: Si True, el índice 0 es el punto de partida
+        closed: Si True (con depot), el día termina al volver al punto de partida
+        time_budget_ms: Tiempo máximo de la búsqueda local (None = TIEMPO_MAX_BUSQUEDA_LOCAL_MS)
+
+    Returns:
+        (ruta, fuera_de_franja): lista de índices (empieza en 0 si depot) y
+        las visitas que no caben en su franja
+    """
+    if time_budget_ms is None:
+        time_budget_ms = TIEMPO_MAX_BUSQUEDA_LOCAL_MS
+    deadline = time.perf_counter() + time_budget_ms / 1000
+
+    n = len(time_matrix)
+    visitas = range(1 if depot else 0, n)
+    candidatas = sorted(
+        visitas,
+        key=lambda v: (ventanas[v][1], ventanas[v][0]) if ventanas[v] is not None else (SIN_LIMITE, SIN_LIMITE)
+    )
+
+    route, fuera = insert_visits(
+        [0] if depot else [], candidatas, time_matrix, duracion, ventanas, inicio, fin_dia, depot, closed
+    )
+    route = relocate(route, time_matrix, duracion, ventanas, inicio, fin_dia, depot, closed, deadline)
+
+    # relocate puede abrir huecos: volver a probar las que no cabían
+    if fuera:
+        route, fuera = insert_visits(route, fuera, time_matrix, duracion, ventanas, inicio, fin_dia, depot, closed)
+
+    # Visitas sin hueco: en la posición que menos retraso total añade
+    for v in fuera:
+        opciones = []
+        for p in range(1 if depot else 0, len(route) + 1):
+            prueba = route[:p] + [v] + route[p:]
+            inicios = schedule(prueba, time_matrix, duracion, ventanas, inicio, depot)
+            fin_ruta = route_end(prueba, inicios, time_matrix, duracion, depot, closed)
+            opciones.append((lateness(prueba, inicios, ventanas, fin_dia, fin_ruta), p))
+        route.insert(min(opciones)[1], v)
+
+    return route, fuera